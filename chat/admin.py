@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Conversation, Message, TypingStatus, Call
+from .models import UserProfile, Conversation, Message, TypingStatus, Call, ConversationInbox
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -25,6 +25,12 @@ class TypingStatusAdmin(admin.ModelAdmin):
     list_display = ['user', 'conversation', 'is_typing', 'timestamp']
     list_filter = ['is_typing', 'timestamp']
 
+@admin.register(ConversationInbox)
+class ConversationInboxAdmin(admin.ModelAdmin):
+    list_display = ['user', 'conversation', 'other_user', 'last_message_preview', 'unread_count', 'updated_at']
+    list_filter = ['updated_at']
+    search_fields = ['user__username', 'other_user__username']
+
 @admin.register(Call)
 class CallAdmin(admin.ModelAdmin):
     list_display = ['call_id', 'caller', 'callee', 'call_type', 'status', 'initiated_at', 'duration']
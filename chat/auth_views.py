@@ -7,7 +7,8 @@ from django.db import IntegrityError, transaction
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
-from .models import UserProfile, Conversation, Message
+from .models import UserProfile, Conversation, Message, ConversationInbox
+from . import inbox, search
 import os
 
 def login_view(request):
@@ -119,12 +120,7 @@ def signup_view(request):
                 print(f"DEBUG: User {username} created successfully with ID: {user.id}")
                 
                 # Create user profile (use get_or_create to avoid unique constraint issues)
-                profile, created = UserProfile.objects.get_or_create(
-                    user=user,
-                    defaults={
-                        'avatar': f'https://ui-avatars.com/api/?background=random&name={first_name}+{last_name}&size=128'
-                    }
-                )
+                profile, created = UserProfile.objects.get_or_create(user=user)
                 if not created:
                     print(f"DEBUG: UserProfile for user {username} already existed, using existing profile")
                 else:
@@ -211,6 +207,7 @@ def delete_account(request):
         for conversation in user_conversations:
             # Remove user from conversation participants
             conversation.participants.remove(user)
+            ConversationInbox.objects.filter(conversation=conversation, user=user).delete()
             
             # If conversation has no participants left, delete it entirely
             if conversation.participants.count() == 0:
@@ -219,6 +216,7 @@ def delete_account(request):
                 MessageReaction.objects.filter(message__conversation=conversation).delete()
                 MessageEdit.objects.filter(message__conversation=conversation).delete()
                 TypingStatus.objects.filter(conversation=conversation).delete()
+                search.conversation_deleted(conversation)
                 conversation.messages.all().delete()
                 conversation.delete()
             else:
@@ -229,6 +227,8 @@ def delete_account(request):
                     message.deleted_by = user
                     message.deleted_at = timezone.now()
                     message.save()
+                    search.message_changed(message)
+                inbox.refresh_last_message(conversation)
         
         # Delete typing status records for this user
         from .models import TypingStatus
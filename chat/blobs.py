@@ -0,0 +1,123 @@
+"""
+Content-addressed storage of chat attachments.
+
+Every attachment is stored once per SHA-256 under chat_files/blobs/ and
+recorded in a Blob row that counts the messages pointing at it. Message.file
+names the blob's path, so URLs, thumbnails and downloads work as before.
+Uploading bytes that are already stored writes nothing; the message just
+takes another reference. When the last message referencing a blob is
+deleted (conversation or account deletion), the row and file are reclaimed.
+Soft-deleted messages keep their reference so they can be restored.
+
+Attachments stored before blobs existed live under
+chat_files/conversation_<id>/; ``python manage.py dedup_attachments`` moves
+them into the blob store.
+"""
+import os
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .image_pipeline import file_hash
+from .models import Blob, Message, UploadSession
+
+BLOB_ROOT = 'chat_files/blobs'
+LEGACY_ROOT = 'chat_files'
+
+
+def blob_path(digest, extension=''):
+    name = f'{BLOB_ROOT}/{digest[:2]}/{digest}'
+    return f'{name}.{extension}' if extension else name
+
+
+def move(source, target):
+    """Rename a stored file to target (same file system, no copy); returns target"""
+    target_path = default_storage.path(target)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    os.replace(default_storage.path(source), target_path)
+    return target
+
+
+def acquire(digest, size, extension, store, references=1):
+    """
+    Take references on the blob of digest and return it. store(name) writes
+    the bytes and returns the stored name; it is only called when the blob is
+    not stored yet.
+    """
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+            if blob is None:
+                blob = Blob.objects.create(sha256=digest, path=store(blob_path(digest, extension)), size=size)
+            elif not default_storage.exists(blob.path):
+                # The row survived its file (restored database, manual cleanup)
+                blob.path = store(blob.path)
+                blob.save(update_fields=['path'])
+            Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + references)
+    except IntegrityError:
+        # A concurrent upload of the same bytes created the row first
+        return acquire(digest, size, extension, store, references)
+    blob.ref_count += references
+    return blob
+
+
+def release(blob_id):
+    """Drop one reference; the last one deletes the blob and, after commit, its file"""
+    Blob.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    blob = Blob.objects.filter(id=blob_id, ref_count=0, messages__isnull=True).first()
+    if blob is None:
+        return
+    blob.delete()
+    transaction.on_commit(lambda: _delete_file(blob.sha256, blob.path))
+
+
+def _delete_file(digest, path):
+    # Unless the same bytes were uploaded again in the meantime
+    if not Blob.objects.filter(sha256=digest).exists():
+        default_storage.delete(path)
+
+
+def legacy_files():
+    """Storage names of attachments still in chat_files/conversation_<id>/, one directory entry at a time"""
+    root = default_storage.path(LEGACY_ROOT)
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as conversations:
+        for conversation in conversations:
+            if not conversation.name.startswith('conversation_') or not conversation.is_dir():
+                continue
+            with os.scandir(conversation.path) as entries:
+                for entry in entries:
+                    # Thumbnails (thumbs/) stay where they are
+                    if entry.is_file():
+                        yield f'{LEGACY_ROOT}/{conversation.name}/{entry.name}'
+
+
+def adopt(name, digest=None):
+    """
+    Move a pre-blob attachment into the blob store and point its messages at
+    it; a duplicate of a stored blob is deleted instead. Returns (messages
+    moved, bytes freed). Files of uploads in progress or of no message are
+    left alone.
+    """
+    messages = Message.objects.filter(file=name, blob__isnull=True)
+    if not messages.exists() or UploadSession.objects.filter(path=name).exists():
+        return 0, 0
+
+    size = default_storage.size(name)
+    if digest is None:
+        with default_storage.open(name, 'rb') as file:
+            digest = file_hash(file)
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in os.path.basename(name) else ''
+
+    with transaction.atomic():
+        blob = acquire(digest, size, extension, lambda target: move(name, target), references=0)
+        moved = messages.update(file=blob.path, blob=blob)
+        Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + moved)
+        freed = 0
+        if default_storage.exists(name):
+            # Not moved: the blob was already stored
+            default_storage.delete(name)
+            freed = size
+    return moved, freed
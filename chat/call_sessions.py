@@ -0,0 +1,206 @@
+"""
+Registry of live call sessions used to route WebRTC signalling.
+
+A call setup sends an offer, an answer and dozens of ICE candidates, and each
+frame has to find the other peer. Sessions are registered when a call is
+initiated or accepted and evicted when it is rejected, ended or missed.
+Signalling frames then resolve the peer without touching the database. A
+miss (e.g. the call was created by another worker with the local store)
+falls back to one query and refills the registry.
+
+Stores:
+    local - dict in this process, enough for a single worker
+    redis - one hash per call in the channel layer's Redis, shared by workers
+    none  - always read the database (used by tools/call_benchmark.py)
+"""
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Call
+from .query_stats import database_sync_to_async
+
+SESSION_TTL = getattr(settings, 'CALL_SESSION_TTL', 4 * 60 * 60)
+
+
+def session_from_call(call):
+    """Build a session dict from a Call without loading its related objects"""
+    return {
+        'call_id': str(call.call_id),
+        'caller_id': call.caller_id,
+        'callee_id': call.callee_id,
+        'conversation_id': call.conversation_id,
+        'call_type': call.call_type,
+    }
+
+
+def peer_of(session, user_id):
+    """The other participant of a call, or None if user_id is not in it"""
+    if session['caller_id'] == user_id:
+        return session['callee_id']
+    if session['callee_id'] == user_id:
+        return session['caller_id']
+    return None
+
+
+class LocalCallStore:
+    """Sessions kept in this process only"""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def put_sync(self, session):
+        self._prune()
+        self._sessions[session['call_id']] = (time.monotonic() + self.ttl, session)
+
+    def discard_sync(self, call_id):
+        self._sessions.pop(str(call_id), None)
+
+    async def put(self, session):
+        self.put_sync(session)
+
+    async def get(self, call_id):
+        entry = self._sessions.get(str(call_id))
+        if entry is None:
+            return None
+        expires, session = entry
+        if expires < time.monotonic():
+            del self._sessions[str(call_id)]
+            return None
+        return session
+
+    async def discard(self, call_id):
+        self.discard_sync(call_id)
+
+    def _prune(self):
+        now = time.monotonic()
+        for call_id in [call_id for call_id, (expires, _) in self._sessions.items() if expires < now]:
+            del self._sessions[call_id]
+
+
+class RedisCallStore:
+    """Sessions in a Redis hash per call, shared by all workers"""
+
+    def __init__(self, url, prefix, ttl=SESSION_TTL):
+        self.url = url
+        self.prefix = f'{prefix}:call:'
+        self.ttl = ttl
+        self._client = None
+        self._sync_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    @property
+    def sync_client(self):
+        # HTTP views run outside the consumers' event loop
+        if self._sync_client is None:
+            import redis
+            self._sync_client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._sync_client
+
+    def _key(self, call_id):
+        return f'{self.prefix}{call_id}'
+
+    def put_sync(self, session):
+        with self.sync_client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(session['call_id']), mapping=session)
+            pipe.expire(self._key(session['call_id']), self.ttl)
+            pipe.execute()
+
+    def discard_sync(self, call_id):
+        self.sync_client.delete(self._key(call_id))
+
+    async def put(self, session):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(session['call_id']), mapping=session)
+            pipe.expire(self._key(session['call_id']), self.ttl)
+            await pipe.execute()
+
+    async def get(self, call_id):
+        data = await self.client.hgetall(self._key(call_id))
+        if not data:
+            return None
+        for field in ('caller_id', 'callee_id', 'conversation_id'):
+            data[field] = int(data[field])
+        return data
+
+    async def discard(self, call_id):
+        await self.client.delete(self._key(call_id))
+
+
+class NullCallStore:
+    """No caching: every lookup goes to the database"""
+
+    def put_sync(self, session):
+        pass
+
+    def discard_sync(self, call_id):
+        pass
+
+    async def put(self, session):
+        pass
+
+    async def get(self, call_id):
+        return None
+
+    async def discard(self, call_id):
+        pass
+
+
+def build_store(backend=None):
+    backend = backend or getattr(settings, 'CALL_REGISTRY_BACKEND', 'local')
+    if backend == 'redis':
+        return RedisCallStore(settings.REDIS_URL, getattr(settings, 'CHANNEL_LAYER_PREFIX', 'chat'))
+    if backend == 'none':
+        return NullCallStore()
+    return LocalCallStore()
+
+
+store = build_store()
+
+
+@database_sync_to_async
+def _load_session(call_id):
+    call = Call.objects.filter(call_id=call_id).only(
+        'call_id', 'caller_id', 'callee_id', 'conversation_id', 'call_type'
+    ).first()
+    return session_from_call(call) if call else None
+
+
+async def get_session(call_id):
+    """Resolve a call's participants, from the registry when possible"""
+    session = await store.get(call_id)
+    if session is None:
+        try:
+            session = await _load_session(call_id)
+        except (ValidationError, ValueError):
+            # Malformed call id
+            return None
+        if session is not None:
+            await store.put(session)
+    return session
+
+
+async def register(session):
+    await store.put(session)
+
+
+async def forget(call_id):
+    await store.discard(call_id)
+
+
+def register_call(call):
+    """Synchronous registration for HTTP views"""
+    store.put_sync(session_from_call(call))
+
+
+def forget_call(call_id):
+    """Synchronous eviction for HTTP views"""
+    store.discard_sync(call_id)
@@ -0,0 +1,159 @@
+"""
+Expiry of calls that are never answered.
+
+A ringing call is scheduled on an in-process hashed timer wheel when it is
+initiated, over the socket or by the HTTP view, and cancelled when it is
+accepted, rejected or ended. If the timer
+fires, the call is marked missed and both participants get ``call_ended``.
+
+The wheel lives in the ASGI process, so calls whose worker died are picked
+up by ``python manage.py expire_calls`` (cron), and initiating a new call
+first expires stale ringing calls of that conversation.
+"""
+import asyncio
+import math
+from datetime import timedelta
+
+from asgiref.sync import SyncToAsync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import call_sessions
+from .ice_batching import ice_batcher
+from .models import Call
+
+RING_TIMEOUT = getattr(settings, 'CALL_RING_TIMEOUT', 45)
+RINGING = ('initiated', 'ringing')
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule and cancel, one ticking task per process"""
+
+    def __init__(self, tick=1.0, slots=64):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.position = 0
+        self._slot_of = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key, delay, callback):
+        """Run the coroutine function callback() after roughly delay seconds"""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self.position + ticks) % len(self.slots)
+        rounds = (ticks - 1) // len(self.slots)
+        self.slots[slot][key] = [rounds, callback]
+        self._slot_of[key] = slot
+        self._ensure_running()
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self):
+        """Move one tick forward and return the callbacks that are due"""
+        self.position = (self.position + 1) % len(self.slots)
+        bucket = self.slots[self.position]
+        due = []
+        for key, entry in list(bucket.items()):
+            if entry[0] > 0:
+                entry[0] -= 1
+            else:
+                del bucket[key]
+                del self._slot_of[key]
+                due.append(entry[1])
+        return due
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        # Stops when nothing is scheduled; the next schedule() restarts it
+        while self._slot_of:
+            await asyncio.sleep(self.tick)
+            for callback in self.advance():
+                asyncio.get_running_loop().create_task(_run_safely(callback))
+
+
+async def _run_safely(callback):
+    try:
+        await callback()
+    except Exception as e:
+        print(f"Call timeout failed: {e}")
+
+
+wheel = TimerWheel()
+
+
+def expire_call(call_id):
+    """Mark a call missed if it is still ringing; returns its session or None"""
+    with transaction.atomic():
+        call = Call.objects.select_for_update().filter(call_id=call_id, status__in=RINGING).first()
+        if call is None or not call.mark_as_missed():
+            return None
+    call_sessions.forget_call(call.call_id)
+    return call_sessions.session_from_call(call)
+
+
+def expire_stale_calls(timeout=RING_TIMEOUT, conversation=None):
+    """Mark every call that has been ringing for longer than timeout as missed"""
+    stale = Call.objects.filter(
+        status__in=RINGING,
+        initiated_at__lt=timezone.now() - timedelta(seconds=timeout)
+    )
+    if conversation is not None:
+        stale = stale.filter(conversation=conversation)
+
+    expired = []
+    for call_id in stale.values_list('call_id', flat=True):
+        session = expire_call(call_id)
+        if session:
+            expired.append(session)
+    return expired
+
+
+async def notify_missed(channel_layer, session):
+    """Tell both participants that the call timed out"""
+    ice_batcher.discard(session['call_id'])
+    for user_id in (session['caller_id'], session['callee_id']):
+        await channel_layer.group_send(
+            f'user_{user_id}',
+            {
+                'type': 'call_ended',
+                'call_id': session['call_id'],
+                'ended_by': None,
+                'reason': 'missed'
+            }
+        )
+
+
+def schedule_timeout(channel_layer, call_id, timeout=RING_TIMEOUT):
+    """Start the ring timer of a freshly initiated call"""
+    async def on_timeout():
+        session = await database_sync_to_async(expire_call)(call_id)
+        if session:
+            await notify_missed(channel_layer, session)
+
+    wheel.schedule(str(call_id), timeout, on_timeout)
+
+
+def schedule_timeout_from_sync(channel_layer, call_id, timeout=RING_TIMEOUT):
+    """schedule_timeout() for sync views: on the event loop the view was called from"""
+    loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    if loop is None or not loop.is_running():
+        # Not served by the ASGI server (test client, WSGI): expire_calls picks the call up
+        return False
+    loop.call_soon_threadsafe(schedule_timeout, channel_layer, call_id, timeout)
+    return True
+
+
+def cancel_timeout(call_id):
+    wheel.cancel(str(call_id))
@@ -1,14 +1,17 @@
+from channels.layers import get_channel_layer
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, Http404
 from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
 import json
 
 from .models import Call, Conversation, UserProfile
+from . import call_sessions, call_timeouts
 
 @login_required
 @require_POST
@@ -37,23 +40,28 @@ def initiate_call(request):
         if callee not in conversation.participants.all():
             return JsonResponse({'success': False, 'error': 'Callee is not in this conversation'})
         
-        # Check if there's already an active call
-        active_call = Call.objects.filter(
-            conversation=conversation,
-            status__in=['initiated', 'ringing', 'accepted']
-        ).first()
+        # Abandoned calls whose timer was lost must not block a new one
+        call_timeouts.expire_stale_calls(conversation=conversation)
         
-        if active_call:
+        # Check if there's already an active call
+        if Call.objects.filter(conversation=conversation, status__in=Call.ACTIVE_STATUSES).exists():
             return JsonResponse({'success': False, 'error': 'Call already in progress'})
         
         # Create new call
-        call = Call.objects.create(
-            conversation=conversation,
-            caller=request.user,
-            callee=callee,
-            call_type=call_type,
-            status='initiated'
-        )
+        try:
+            with transaction.atomic():
+                call = Call.objects.create(
+                    conversation=conversation,
+                    caller=request.user,
+                    callee=callee,
+                    call_type=call_type,
+                    status='initiated'
+                )
+        except IntegrityError:
+            return JsonResponse({'success': False, 'error': 'Call already in progress'})
+        call_sessions.register_call(call)
+        # Same ring timeout as calls started over the socket
+        call_timeouts.schedule_timeout_from_sync(get_channel_layer(), call.call_id)
         
         return JsonResponse({
             'success': True,
@@ -87,8 +95,10 @@ def accept_call(request):
         if call.status not in ['initiated', 'ringing']:
             return JsonResponse({'success': False, 'error': 'Call cannot be accepted'})
         
-        # Accept the call
-        call.accept_call()
+        # Accept the call, unless it was missed or rejected since the check
+        if not call.accept_call():
+            return JsonResponse({'success': False, 'error': 'Call cannot be accepted'})
+        call_sessions.register_call(call)
         
         return JsonResponse({
             'success': True,
@@ -121,7 +131,9 @@ def reject_call(request):
             return JsonResponse({'success': False, 'error': 'Call cannot be rejected'})
         
         # Reject the call
-        call.reject_call()
+        if not call.reject_call():
+            return JsonResponse({'success': False, 'error': 'Call cannot be rejected'})
+        call_sessions.forget_call(call.call_id)
         
         return JsonResponse({
             'success': True,
@@ -153,6 +165,7 @@ def end_call(request):
         
         # End the call
         call.end_call()
+        call_sessions.forget_call(call.call_id)
         
         return JsonResponse({
             'success': True,
@@ -291,7 +304,9 @@ def mark_call_missed(request):
             return JsonResponse({'success': False, 'error': 'Call cannot be marked as missed'})
         
         # Mark as missed
-        call.mark_as_missed()
+        if not call.mark_as_missed():
+            return JsonResponse({'success': False, 'error': 'Call cannot be marked as missed'})
+        call_sessions.forget_call(call.call_id)
         
         return JsonResponse({
             'success': True,
@@ -1,14 +1,22 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from .models import Conversation, Message, UserProfile, TypingStatus, Call
+from . import inbox, receipts, search
+from . import call_sessions, call_timeouts, message_writer, presence
+from .metrics import MeasuredConsumerMixin
+from .query_stats import database_sync_to_async, instrument_frame
+from .ice_batching import ice_batcher
+from .typing_indicators import typing_tracker
 from django.utils import timezone
 import asyncio
 from typing import Dict, Set
 import uuid
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(MeasuredConsumerMixin, AsyncWebsocketConsumer):
+    @instrument_frame
     async def connect(self):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
@@ -37,38 +45,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # Mark user as online
-        await self.update_user_status(True)
-        
-        # Send user joined notification to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_online': True
-            }
-        )
+        # Mark user as online (only announced for the user's first socket)
+        await presence.user_connected(self.channel_layer, self.user, self.channel_name)
 
     async def disconnect(self, close_code):
+        ice_batcher.cancel_channel(self.channel_name)
+        
         if hasattr(self, 'user') and not self.user.is_anonymous:
-            # Mark user as offline
-            await self.update_user_status(False)
-            
-            # Stop typing if user was typing
-            await self.set_typing_status(False)
+            # Mark user as offline (only announced when their last socket closes)
+            await presence.user_disconnected(self.channel_layer, self.user, self.channel_name)
             
-            # Send user left notification to room
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_status',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                    'is_online': False
-                }
-            )
+            # Stop typing if receivers may still show the indicator
+            if typing_tracker.clear(self.conversation_id, self.user.id):
+                await self.broadcast(
+                    {
+                        'type': 'typing_status',
+                        'user_id': self.user.id,
+                        'username': self.user.username,
+                        'is_typing': False,
+                        'expires_in': typing_tracker.ttl
+                    }
+                )
         
         # Leave room group
         if hasattr(self, 'room_group_name'):
@@ -84,11 +81,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
+    @instrument_frame
     async def receive(self, text_data):
         try:
             text_data_json = json.loads(text_data)
             message_type = text_data_json.get('type', 'message')
             
+            if settings.MESSAGE_WRITE_BEHIND and text_data_json.get('message_id'):
+                # Edits, deletes, reactions and receipts must find the row in the database
+                await message_writer.get_writer().ensure_persisted(text_data_json['message_id'])
+            
             if message_type == 'message':
                 message_content = text_data_json.get('message', '')
                 temp_id = text_data_json.get('temp_id', None)
@@ -96,12 +98,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 if not message_content.strip():
                     return
                 
-                # Save message to database
-                message = await self.save_message(message_content)
+                # Save message to database, or queue it for the next batch in write-behind mode
+                if settings.MESSAGE_WRITE_BEHIND:
+                    message = await message_writer.get_writer().submit(
+                        int(self.conversation_id), self.user.id, message_content
+                    )
+                else:
+                    message = await self.save_message(message_content)
+                # Receivers hide the indicator when the message lands
+                typing_tracker.clear(self.conversation_id, self.user.id)
                 
                 # Send message to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
+                await self.broadcast(
                     {
                         'type': 'chat_message',
                         'message': message_content,
@@ -115,33 +123,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 )
             
             elif message_type == 'typing':
-                is_typing = text_data_json.get('is_typing', False)
-                await self.set_typing_status(is_typing)
+                is_typing = bool(text_data_json.get('is_typing', False))
                 
-                # Send typing status to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_status',
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                        'is_typing': is_typing
-                    }
-                )
+                # Debounced in memory: at most one broadcast per window, no DB write
+                if typing_tracker.should_broadcast(self.conversation_id, self.user.id, is_typing):
+                    if settings.TYPING_ANALYTICS:
+                        await self.set_typing_status(is_typing)
+                    
+                    # Send typing status to room group
+                    await self.broadcast(
+                        {
+                            'type': 'typing_status',
+                            'user_id': self.user.id,
+                            'username': self.user.username,
+                            'is_typing': is_typing,
+                            'expires_in': typing_tracker.ttl
+                        }
+                    )
             
             elif message_type == 'message_read':
+                # "Read up to message N": one UPDATE and one broadcast carrying the watermark
                 message_id = text_data_json.get('message_id')
-                await self.mark_message_read(message_id)
+                watermark = await self.mark_message_read(message_id)
                 
-                # Send read status to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_status_update',
-                        'message_id': message_id,
-                        'status': 'read'
-                    }
-                )
+                if watermark:
+                    # Send read status to room group
+                    await self.broadcast(
+                        {
+                            'type': 'message_status_update',
+                            'message_id': watermark,
+                            'up_to_id': watermark,
+                            'reader_id': self.user.id,
+                            'status': 'read'
+                        }
+                    )
             
             elif message_type == 'message_reaction':
                 message_id = text_data_json.get('message_id')
@@ -152,8 +167,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     result = await self.handle_message_reaction(message_id, emoji, action)
                     if result:
                         # Send reaction update to room group
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
+                        await self.broadcast(
                             {
                                 'type': 'reaction_update',
                                 'message_id': message_id,
@@ -173,8 +187,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     result = await self.edit_message(message_id, new_content)
                     if result:
                         # Send edit update to room group
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
+                        await self.broadcast(
                             {
                                 'type': 'message_edit_update',
                                 'message_id': message_id,
@@ -191,8 +204,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     result = await self.delete_message(message_id)
                     if result:
                         # Send delete update to room group
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
+                        await self.broadcast(
                             {
                                 'type': 'message_delete_update',
                                 'message_id': message_id,
@@ -207,8 +219,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     message_data = await self.get_file_message(message_id)
                     if message_data:
                         # Send file message to room group
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
+                        await self.broadcast(
                             {
                                 'type': 'file_message_update',
                                 'message_id': message_data['id'],
@@ -219,6 +230,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                                 'file_icon': message_data['file_icon'],
                                 'message_type': message_data['message_type'],
                                 'is_image': message_data['is_image'],
+                                'preview': message_data['preview'],
                                 'username': self.user.username,
                                 'user_id': self.user.id,
                                 'timestamp': message_data['timestamp'],
@@ -226,13 +238,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             }
                         )
                         
+            elif message_type == 'heartbeat':
+                await presence.heartbeat(self.channel_layer, self.user, self.channel_name)
+            
             elif message_type == 'user_activity':
                 activity = text_data_json.get('activity', 'active')  # 'active', 'away', 'busy'
-                await self.update_user_activity(activity)
+                # Activity keeps the socket's presence fresh; last_seen is written on disconnect
+                await presence.heartbeat(self.channel_layer, self.user, self.channel_name)
                 
                 # Send activity status to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
+                await self.broadcast(
                     {
                         'type': 'user_activity_update',
                         'user_id': self.user.id,
@@ -253,6 +268,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     print(f"📞 Call created: {call}")
                     
                     if call:
+                        await call_sessions.register(call)
+                        call_timeouts.schedule_timeout(self.channel_layer, call['call_id'])
                         group_name = f'user_{callee_id}'
                         print(f"📞 Sending call notification to group: {group_name}")
                         
@@ -277,9 +294,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             elif message_type == 'call_accept':
                 call_id = text_data_json.get('call_id')
                 if call_id:
-                    success = await self.accept_call(call_id)
-                    if success:
-                        call_data = await self.get_call_data(call_id)
+                    call_data = await self.accept_call(call_id)
+                    if call_data:
+                        call_timeouts.cancel_timeout(call_id)
+                        await call_sessions.register(call_data)
                         # Notify caller that call was accepted
                         await self.channel_layer.group_send(
                             f'user_{call_data["caller_id"]}',
@@ -293,9 +311,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             elif message_type == 'call_reject':
                 call_id = text_data_json.get('call_id')
                 if call_id:
-                    success = await self.reject_call(call_id)
-                    if success:
-                        call_data = await self.get_call_data(call_id)
+                    call_data = await self.reject_call(call_id)
+                    if call_data:
+                        call_timeouts.cancel_timeout(call_id)
+                        await call_sessions.forget(call_id)
+                        ice_batcher.discard(call_id)
                         # Notify caller that call was rejected
                         await self.channel_layer.group_send(
                             f'user_{call_data["caller_id"]}',
@@ -309,10 +329,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             elif message_type == 'call_end':
                 call_id = text_data_json.get('call_id')
                 if call_id:
-                    success = await self.end_call(call_id)
-                    if success:
-                        call_data = await self.get_call_data(call_id)
-                        other_user_id = call_data['caller_id'] if call_data['caller_id'] != self.user.id else call_data['callee_id']
+                    call_data = await self.end_call(call_id)
+                    if call_data:
+                        call_timeouts.cancel_timeout(call_id)
+                        await call_sessions.forget(call_id)
+                        ice_batcher.discard(call_id)
+                        other_user_id = call_sessions.peer_of(call_data, self.user.id)
                         # Notify other participant that call ended
                         await self.channel_layer.group_send(
                             f'user_{other_user_id}',
@@ -328,8 +350,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 call_id = text_data_json.get('call_id')
                 offer = text_data_json.get('offer')
                 if call_id and offer:
-                    call_data = await self.get_call_data(call_id)
-                    other_user_id = call_data['callee_id']
+                    other_user_id = await self.signalling_peer(call_id)
+                    if other_user_id is None:
+                        return
                     await self.channel_layer.group_send(
                         f'user_{other_user_id}',
                         {
@@ -339,13 +362,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             'from_user_id': self.user.id
                         }
                     )
+                    # The peer now has our description; release candidates held back for it
+                    await ice_batcher.mark_ready(call_id, self.user.id)
             
             elif message_type == 'webrtc_answer':
                 call_id = text_data_json.get('call_id')
                 answer = text_data_json.get('answer')
                 if call_id and answer:
-                    call_data = await self.get_call_data(call_id)
-                    other_user_id = call_data['caller_id']
+                    other_user_id = await self.signalling_peer(call_id)
+                    if other_user_id is None:
+                        return
                     await self.channel_layer.group_send(
                         f'user_{other_user_id}',
                         {
@@ -355,26 +381,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             'from_user_id': self.user.id
                         }
                     )
+                    # The peer now has our description; release candidates held back for it
+                    await ice_batcher.mark_ready(call_id, self.user.id)
             
-            elif message_type == 'webrtc_ice_candidate':
+            elif message_type in ('webrtc_ice_candidate', 'webrtc_ice_candidates'):
+                # Single candidates (older clients) and batches are coalesced per call and direction
                 call_id = text_data_json.get('call_id')
-                candidate = text_data_json.get('candidate')
-                if call_id and candidate:
-                    call_data = await self.get_call_data(call_id)
-                    other_user_id = call_data['caller_id'] if call_data['caller_id'] != self.user.id else call_data['callee_id']
-                    await self.channel_layer.group_send(
-                        f'user_{other_user_id}',
-                        {
-                            'type': 'webrtc_ice_candidate_received',
-                            'call_id': call_id,
-                            'candidate': candidate,
-                            'from_user_id': self.user.id
-                        }
+                candidates = text_data_json.get('candidates')
+                if candidates is None and text_data_json.get('candidate'):
+                    candidates = [text_data_json['candidate']]
+                if call_id and candidates:
+                    other_user_id = await self.signalling_peer(call_id)
+                    if other_user_id is None:
+                        return
+                    await ice_batcher.add(
+                        self.channel_layer, call_id, self.user.id, other_user_id, candidates, self.channel_name
                     )
                 
         except Exception as e:
             print(f"Error in receive: {e}")
 
+    async def signalling_peer(self, call_id):
+        """Other participant of a call, resolved from the session registry"""
+        session = await call_sessions.get_session(call_id)
+        if session is None:
+            return None
+        return call_sessions.peer_of(session, self.user.id)
+
+    async def broadcast(self, event):
+        """Send an event to everyone in this conversation's room"""
+        event['stream'] = self.conversation_id
+        await self.channel_layer.group_send(self.room_group_name, event)
+
     async def chat_message(self, event):
         # Send message to WebSocket
         message_data = {
@@ -400,7 +438,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'type': 'typing',
                 'user_id': event['user_id'],
                 'username': event['username'],
-                'is_typing': event['is_typing']
+                'is_typing': event['is_typing'],
+                'expires_in': event.get('expires_in')
             }))
 
     async def user_status(self, event):
@@ -417,6 +456,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'message_status',
             'message_id': event['message_id'],
+            'up_to_id': event.get('up_to_id'),
+            'reader_id': event.get('reader_id'),
             'status': event['status']
         }))
     
@@ -462,12 +503,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'file_icon': event['file_icon'],
             'message_type': event['message_type'],
             'is_image': event['is_image'],
+            **event.get('preview', {}),
             'username': event['username'],
             'user_id': event['user_id'],
             'timestamp': event['timestamp'],
             'status': event['status']
         }))
     
+    async def attachment_ready(self, event):
+        # Thumbnail and placeholder of an image message, from the image pipeline
+        await self.send(text_data=json.dumps({
+            'type': 'attachment_ready',
+            'message_id': event['message_id'],
+            'image_width': event['image_width'],
+            'image_height': event['image_height'],
+            'thumbnail_url': event['thumbnail_url'],
+            'placeholder': event['placeholder']
+        }))
+    
     async def user_activity_update(self, event):
         # Send user activity update to WebSocket
         if event['user_id'] != self.user.id:  # Don't send to the user who changed activity
@@ -520,7 +573,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'call_ended',
             'call_id': event['call_id'],
-            'ended_by': event['ended_by']
+            'ended_by': event['ended_by'],
+            'reason': event.get('reason', 'ended')
         }))
     
     # WebRTC signaling handlers
@@ -551,6 +605,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'from_user_id': event['from_user_id']
         }))
 
+    async def webrtc_ice_candidates_received(self, event):
+        # Send a coalesced batch of ICE candidates to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'webrtc_ice_candidates',
+            'call_id': event['call_id'],
+            'candidates': event['candidates'],
+            'from_user_id': event['from_user_id']
+        }))
+
     @database_sync_to_async
     def save_message(self, content):
         conversation = Conversation.objects.get(id=self.conversation_id)
@@ -561,27 +624,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         conversation.updated_at = timezone.now()
         conversation.save()
+        inbox.record_new_message(message)
+        search.record_new_message(message)
         
         return {
             'id': message.id,
             'timestamp': message.timestamp.isoformat()
         }
 
-    @database_sync_to_async
-    def update_user_status(self, is_online):
-        try:
-            profile = UserProfile.objects.get(user=self.user)
-            profile.is_online = is_online
-            if not is_online:
-                profile.last_seen = timezone.now()
-            profile.save()
-        except UserProfile.DoesNotExist:
-            UserProfile.objects.create(
-                user=self.user,
-                is_online=is_online,
-                last_seen=timezone.now()
-            )
-
     @database_sync_to_async
     def set_typing_status(self, is_typing):
         try:
@@ -598,10 +648,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def mark_message_read(self, message_id):
         try:
-            message = Message.objects.get(id=message_id)
-            message.mark_as_read()
-        except Message.DoesNotExist:
-            pass
+            conversation = Conversation.objects.get(id=self.conversation_id, participants=self.user)
+            return receipts.mark_read_up_to(conversation, self.user, message_id)
+        except (Conversation.DoesNotExist, ValueError, TypeError):
+            return None
     
     @database_sync_to_async
     def handle_message_reaction(self, message_id, emoji, action):
@@ -655,6 +705,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message.is_edited = True
             message.edited_at = timezone.now()
             message.save()
+            inbox.message_changed(message)
+            search.message_changed(message)
             
             return {
                 'success': True,
@@ -668,6 +720,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             message = Message.objects.get(id=message_id, sender=self.user)
             message.soft_delete(self.user)
+            inbox.message_changed(message)
+            search.message_changed(message)
             return {'success': True}
         except Message.DoesNotExist:
             return None
@@ -685,25 +739,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'file_icon': message.get_file_icon(),
                 'message_type': message.message_type,
                 'is_image': message.is_image,
+                'preview': message.attachment_preview(),
                 'timestamp': message.timestamp.isoformat()
             }
         except Message.DoesNotExist:
             return None
     
-    @database_sync_to_async
-    def update_user_activity(self, activity):
-        try:
-            profile = UserProfile.objects.get(user=self.user)
-            # You could add an activity field to UserProfile if needed
-            # For now, we'll just update last_seen
-            profile.last_seen = timezone.now()
-            profile.save()
-        except UserProfile.DoesNotExist:
-            UserProfile.objects.create(
-                user=self.user,
-                last_seen=timezone.now()
-            )
-    
     # Call management database methods
     @database_sync_to_async
     def initiate_call(self, callee_id, call_type):
@@ -711,81 +752,66 @@ class ChatConsumer(AsyncWebsocketConsumer):
             conversation = Conversation.objects.get(id=self.conversation_id)
             callee = User.objects.get(id=callee_id)
             
-            # Check if there's already an active call
-            active_call = Call.objects.filter(
-                conversation=conversation,
-                status__in=['initiated', 'ringing', 'accepted']
-            ).first()
+            # Abandoned calls whose timer was lost must not block a new one
+            call_timeouts.expire_stale_calls(conversation=conversation)
             
-            if active_call:
+            # Check if there's already an active call
+            if Call.objects.filter(conversation=conversation, status__in=Call.ACTIVE_STATUSES).exists():
                 return None  # Call already in progress
             
-            call = Call.objects.create(
-                conversation=conversation,
-                caller=self.user,
-                callee=callee,
-                call_type=call_type,
-                status='initiated'
-            )
+            with transaction.atomic():
+                call = Call.objects.create(
+                    conversation=conversation,
+                    caller=self.user,
+                    callee=callee,
+                    call_type=call_type,
+                    status='initiated'
+                )
             
-            return {
-                'call_id': call.call_id,
-                'caller_id': self.user.id,
-                'callee_id': callee_id,
-                'call_type': call_type
-            }
+            return call_sessions.session_from_call(call)
         except (Conversation.DoesNotExist, User.DoesNotExist):
             return None
+        except IntegrityError:
+            return None  # Another call won the race (one active call per conversation)
     
     @database_sync_to_async
     def accept_call(self, call_id):
         try:
             call = Call.objects.get(call_id=call_id, callee=self.user)
-            call.accept_call()
-            return True
+            # Too late if the ring timeout (or a reject) got there first
+            if not call.accept_call():
+                return None
+            return call_sessions.session_from_call(call)
         except Call.DoesNotExist:
-            return False
+            return None
     
     @database_sync_to_async
     def reject_call(self, call_id):
         try:
             call = Call.objects.get(call_id=call_id, callee=self.user)
-            call.reject_call()
-            return True
+            if not call.reject_call():
+                return None
+            return call_sessions.session_from_call(call)
         except Call.DoesNotExist:
-            return False
+            return None
     
     @database_sync_to_async
     def end_call(self, call_id):
         try:
             call = Call.objects.get(call_id=call_id)
             # Check if user is participant in this call
-            if call.caller == self.user or call.callee == self.user:
+            if self.user.id in (call.caller_id, call.callee_id):
                 call.end_call()
-                return True
-            return False
-        except Call.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def get_call_data(self, call_id):
-        try:
-            call = Call.objects.get(call_id=call_id)
-            return {
-                'call_id': str(call.call_id),
-                'caller_id': call.caller.id,
-                'callee_id': call.callee.id,
-                'call_type': call.call_type,
-                'status': call.status,
-                'conversation_id': call.conversation.id
-            }
+                return call_sessions.session_from_call(call)
+            return None
         except Call.DoesNotExist:
             return None
 
 
-class UserConsumer(AsyncWebsocketConsumer):
+class UserConsumer(MeasuredConsumerMixin, AsyncWebsocketConsumer):
     """Consumer for user-specific notifications like incoming calls"""
     
+    @instrument_frame
     async def connect(self):
         self.user = self.scope['user']
         
@@ -801,19 +827,36 @@ class UserConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await presence.user_connected(self.channel_layer, self.user, self.channel_name)
         print(f"User {self.user.username} connected to personal channel")
     
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
+            await presence.user_disconnected(self.channel_layer, self.user, self.channel_name)
             await self.channel_layer.group_discard(
                 self.user_group_name,
                 self.channel_name
             )
         print(f"User {self.user.username if hasattr(self, 'user') else 'unknown'} disconnected from personal channel")
     
+    @instrument_frame
     async def receive(self, text_data):
-        # Handle any user-specific messages if needed
-        pass
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        
+        if data.get('type') == 'heartbeat':
+            await presence.heartbeat(self.channel_layer, self.user, self.channel_name)
+    
+    async def user_status(self, event):
+        # Presence changes of the user's contacts
+        await self.send(text_data=json.dumps({
+            'type': 'user_status',
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'is_online': event['is_online']
+        }))
     
     # Call event handlers - these are the same as in ChatConsumer
     async def incoming_call(self, event):
@@ -844,7 +887,8 @@ class UserConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'call_ended',
             'call_id': event['call_id'],
-            'ended_by': event['ended_by']
+            'ended_by': event['ended_by'],
+            'reason': event.get('reason', 'ended')
         }))
     
     # WebRTC signaling handlers
@@ -871,3 +915,167 @@ class UserConsumer(AsyncWebsocketConsumer):
             'candidate': event['candidate'],
             'from_user_id': event['from_user_id']
         }))
+    
+    async def webrtc_ice_candidates_received(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'webrtc_ice_candidates',
+            'call_id': event['call_id'],
+            'candidates': event['candidates'],
+            'from_user_id': event['from_user_id']
+        }))
+
+
+class MultiplexConsumer(ChatConsumer):
+    """One socket per client carrying many conversation streams.
+    
+    The client subscribes to conversations by frame instead of opening a
+    ChatConsumer socket per conversation, and the socket joins the user's
+    personal group once, so call notifications are delivered once per client.
+    
+    Client frames:
+        {"type": "subscribe", "conversation_id": 12}
+        {"type": "unsubscribe", "conversation_id": 12}
+        {"type": "message", "stream": 12, "message": "hi"}
+    Frames without "stream" go to the most recently subscribed conversation,
+    so existing ChatConsumer clients work unchanged after subscribing.
+    Room events sent back to the client carry the same "stream" key.
+    """
+    
+    # Call signalling is addressed by call_id, not by conversation
+    STREAMLESS_TYPES = {
+        'heartbeat', 'call_accept', 'call_reject', 'call_end',
+        'webrtc_offer', 'webrtc_answer', 'webrtc_ice_candidate', 'webrtc_ice_candidates',
+    }
+    
+    @instrument_frame
+    async def connect(self):
+        self.user = self.scope['user']
+        self.streams = []
+        self.conversation_id = None
+        self.room_group_name = None
+        self._event_stream = None
+        
+        if self.user.is_anonymous:
+            await self.close(code=4001)
+            return
+        
+        await self.channel_layer.group_add(
+            f'user_{self.user.id}',
+            self.channel_name
+        )
+        await self.accept()
+        await presence.user_connected(self.channel_layer, self.user, self.channel_name)
+    
+    async def disconnect(self, close_code):
+        ice_batcher.cancel_channel(self.channel_name)
+        if not hasattr(self, 'streams') or self.user.is_anonymous:
+            return
+        
+        for stream in list(self.streams):
+            await self.unsubscribe(stream)
+        
+        await presence.user_disconnected(self.channel_layer, self.user, self.channel_name)
+        await self.channel_layer.group_discard(
+            f'user_{self.user.id}',
+            self.channel_name
+        )
+    
+    @instrument_frame
+    async def receive(self, text_data):
+        try:
+            text_data_json = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        message_type = text_data_json.get('type', 'message')
+        
+        if message_type in ('subscribe', 'unsubscribe'):
+            try:
+                stream = str(int(text_data_json.get('conversation_id')))
+            except (TypeError, ValueError):
+                await self.send_error('Invalid conversation_id')
+                return
+            if message_type == 'subscribe':
+                await self.subscribe(stream)
+            else:
+                await self.unsubscribe(stream)
+            return
+        
+        stream = text_data_json.get('stream')
+        if stream is None:
+            stream = self.streams[-1] if self.streams else None
+        else:
+            stream = str(stream)
+        
+        if stream not in self.streams and message_type not in self.STREAMLESS_TYPES:
+            await self.send_error('Not subscribed to this conversation', stream=stream)
+            return
+        
+        # Route the frame through the per-conversation handlers
+        self.conversation_id = stream
+        self.room_group_name = f'chat_{stream}' if stream else None
+        try:
+            await super().receive(text_data)
+        finally:
+            self.conversation_id = None
+            self.room_group_name = None
+    
+    async def subscribe(self, stream):
+        if stream in self.streams:
+            # Move to the end so it becomes the default stream again
+            self.streams.remove(stream)
+            self.streams.append(stream)
+        elif await self.is_participant(stream):
+            await self.channel_layer.group_add(f'chat_{stream}', self.channel_name)
+            self.streams.append(stream)
+        else:
+            await self.send_error('Conversation not found', stream=stream)
+            return
+        
+        await super().send(text_data=json.dumps({
+            'type': 'subscribed',
+            'stream': stream
+        }))
+    
+    async def unsubscribe(self, stream):
+        if stream not in self.streams:
+            return
+        
+        self.streams.remove(stream)
+        await self.channel_layer.group_discard(f'chat_{stream}', self.channel_name)
+        
+        # Stop typing if receivers may still show the indicator
+        if typing_tracker.clear(stream, self.user.id):
+            await self.channel_layer.group_send(f'chat_{stream}', {
+                'type': 'typing_status',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'is_typing': False,
+                'expires_in': typing_tracker.ttl,
+                'stream': stream
+            })
+    
+    async def send_error(self, error, stream=None):
+        await super().send(text_data=json.dumps({
+            'type': 'error',
+            'error': error,
+            'stream': stream
+        }))
+    
+    async def dispatch(self, message):
+        # Remember which stream a room event belongs to while its handler runs
+        self._event_stream = message.get('stream')
+        try:
+            await super().dispatch(message)
+        finally:
+            self._event_stream = None
+    
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None and self._event_stream is not None:
+            payload = json.loads(text_data)
+            payload['stream'] = self._event_stream
+            text_data = json.dumps(payload)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+    
+    @database_sync_to_async
+    def is_participant(self, conversation_id):
+        return Conversation.objects.filter(id=conversation_id, participants=self.user).exists()
@@ -0,0 +1,213 @@
+"""
+User directory used by the "new chat" picker: the contacts list and user search.
+
+Every user is indexed as a few normalized terms (lower-cased, accents folded)
+in UserSearchTerm: the username, the first and last name and the full name.
+A lookup is a range scan on the (term, user) index that stops after a fixed
+number of candidates, so its cost does not grow with the number of users.
+On PostgreSQL the term column uses the "C" collation, so the range is exactly
+a prefix, and a pg_trgm index adds substring matches when prefixes find too
+few users.
+
+Ranking: the searcher's contacts (anyone they already have a conversation
+with) come first, then everyone else in term order. Candidate ids of hot
+prefixes and each user's contact terms are kept in small per-process LRU
+caches with a TTL. Profile, avatar and online fields are always read fresh,
+in one query.
+
+The picker opens on the searcher's contacts, a keyset-paginated window of
+their inbox (contacts_page); chat_home embeds only the first window.
+"""
+import base64
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import ConversationInbox, UserProfile, UserSearchTerm
+
+MIN_QUERY_LENGTH = 2
+RESULT_LIMIT = 10
+CONTACTS_PAGE_SIZE = 30
+MAX_CONTACTS_PAGE_SIZE = 100
+# Distinct candidates kept per prefix; enough to fill a page after removing contacts and the searcher
+CANDIDATES = 50
+# A user has at most this many terms, so this many rows always hold CANDIDATES distinct users
+TERMS_PER_USER = 4
+CACHE_SIZE = getattr(settings, 'USER_SEARCH_CACHE_SIZE', 1024)
+CACHE_TTL = getattr(settings, 'USER_SEARCH_CACHE_TTL', 30)
+TERM_MAX_LENGTH = 150
+
+
+class LRUCache:
+    """Small process-local LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+prefix_cache = LRUCache()
+contact_cache = LRUCache()
+
+
+def normalize(text):
+    """Lower-case, fold accents and collapse whitespace"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())[:TERM_MAX_LENGTH]
+
+
+def user_terms(user):
+    """The normalized terms a user can be found by"""
+    first_name = normalize(user.first_name)
+    last_name = normalize(user.last_name)
+    terms = {normalize(user.username), first_name, last_name, normalize(f'{first_name} {last_name}')}
+    terms.discard('')
+    return terms
+
+
+def index_user(user):
+    """Replace the directory terms of a user; called whenever a user is saved"""
+    with transaction.atomic():
+        UserSearchTerm.objects.filter(user_id=user.id).delete()
+        UserSearchTerm.objects.bulk_create([UserSearchTerm(user_id=user.id, term=term) for term in user_terms(user)])
+    # Only this process's cache; other workers catch up within CACHE_TTL
+    prefix_cache.clear()
+
+
+def _prefix_range(prefix):
+    return {'term__gte': prefix, 'term__lt': prefix + '\U0010ffff'}
+
+
+def _candidate_ids(prefix):
+    """Up to CANDIDATES user ids whose terms start with prefix, in term order"""
+    cached = prefix_cache.get(prefix)
+    if cached is not None:
+        return cached
+
+    rows = UserSearchTerm.objects.filter(**_prefix_range(prefix)).order_by('term').values_list('user_id', flat=True)
+    ids = list(dict.fromkeys(rows[:CANDIDATES * TERMS_PER_USER]))[:CANDIDATES]
+    if len(ids) < CANDIDATES and len(prefix) >= 3 and connection.vendor == 'postgresql':
+        # Substring matches ("smi" finds "goldsmith"), served by the trigram index
+        extra = UserSearchTerm.objects.filter(term__contains=prefix).exclude(user_id__in=ids)
+        ids += list(dict.fromkeys(
+            extra.values_list('user_id', flat=True)[:(CANDIDATES - len(ids)) * TERMS_PER_USER]
+        ))[:CANDIDATES - len(ids)]
+
+    prefix_cache.put(prefix, ids)
+    return ids
+
+
+def _contact_terms(user_id):
+    """{contact id: sorted terms} for everyone the user has a conversation with"""
+    cached = contact_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    contacts = {}
+    rows = UserSearchTerm.objects.filter(
+        user_id__in=ConversationInbox.objects.filter(user_id=user_id, other_user__isnull=False).values('other_user_id')
+    ).order_by('term').values_list('user_id', 'term')
+    for contact_id, term in rows:
+        contacts.setdefault(contact_id, []).append(term)
+
+    contact_cache.put(user_id, contacts)
+    return contacts
+
+
+def search_users(user, query, limit=RESULT_LIMIT):
+    """Return [(profile, is_contact)] of users matching query, contacts first"""
+    prefix = normalize(query)
+    if len(prefix) < MIN_QUERY_LENGTH:
+        return []
+
+    contact_hits = sorted(
+        (next(term for term in terms if term.startswith(prefix)), contact_id)
+        for contact_id, terms in _contact_terms(user.id).items()
+        if any(term.startswith(prefix) for term in terms)
+    )
+    contact_ids = [contact_id for _, contact_id in contact_hits]
+    ids = contact_ids + [
+        candidate_id for candidate_id in _candidate_ids(prefix)
+        if candidate_id != user.id and candidate_id not in contact_ids
+    ]
+    ids = ids[:limit]
+
+    users = User.objects.filter(id__in=ids).select_related('userprofile').in_bulk()
+    results = []
+    for user_id in ids:
+        found = users.get(user_id)
+        if found is None:
+            continue
+        try:
+            profile = found.userprofile
+        except UserProfile.DoesNotExist:
+            # Never written on the read path; the signal creates it on the next save
+            profile = UserProfile(user=found)
+        results.append((profile, user_id in contact_ids))
+    return results
+
+
+def _encode_cursor(entry):
+    online = int(bool(getattr(getattr(entry.other_user, 'userprofile', None), 'is_online', False)))
+    raw = f'{online}|{entry.updated_at.isoformat()}|{entry.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    # Malformed input raises ValueError (binascii and unicode errors included)
+    online, updated_at, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return bool(int(online)), datetime.fromisoformat(updated_at), int(entry_id)
+
+
+def contacts_page(user, cursor=None, limit=CONTACTS_PAGE_SIZE):
+    """
+    One window of the user's contacts, online first, then by most recent
+    interaction. Keyset paginated on (online, inbox updated_at, inbox id);
+    returns (inbox entries, next cursor or None). Raises ValueError for a
+    malformed cursor.
+    """
+    entries = ConversationInbox.objects.filter(
+        user=user,
+        other_user__isnull=False
+    ).select_related('other_user__userprofile')
+
+    if cursor:
+        online, updated_at, entry_id = _decode_cursor(cursor)
+        entries = entries.filter(
+            Q(other_user__userprofile__is_online__lt=online) |
+            Q(other_user__userprofile__is_online=online, updated_at__lt=updated_at) |
+            Q(other_user__userprofile__is_online=online, updated_at=updated_at, id__lt=entry_id)
+        )
+
+    window = list(entries.order_by('-other_user__userprofile__is_online', '-updated_at', '-id')[:limit + 1])
+    next_cursor = _encode_cursor(window[limit - 1]) if len(window) > limit else None
+    return window[:limit], next_cursor
@@ -0,0 +1,124 @@
+"""
+Server-side coalescing of trickled ICE candidates.
+
+Candidates are collected per (call, sender) and forwarded to the peer as one
+``webrtc_ice_candidates`` event per ICE_BATCH_WINDOW, instead of one
+group_send and one websocket frame per candidate.
+
+Candidates are held back until the sender's own session description (offer or
+answer) has been relayed, so the peer never receives candidates before the
+remote description they belong to. The peer gets the description first and
+the buffered candidates right after it.
+
+Flushes started by the window timer are tasks the batcher keeps until they
+finish, so they are neither garbage-collected mid-send nor fail unnoticed;
+a socket that disconnects cancels the flushes of the candidates it sent.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+
+WINDOW = getattr(settings, 'ICE_BATCH_WINDOW', 0.05)
+BUFFER_TTL = 120
+
+
+class IceBatcher:
+    def __init__(self, window=WINDOW, ttl=BUFFER_TTL):
+        self.window = window
+        self.ttl = ttl
+        self._batches = {}
+        self._ready = {}
+        # Running timer flushes: task -> channel name of the socket that sent the candidates
+        self._tasks = {}
+
+    async def add(self, channel_layer, call_id, from_user_id, to_user_id, candidates, channel_name=None):
+        """Queue candidates sent by from_user_id (from socket channel_name) for to_user_id"""
+        key = (str(call_id), from_user_id)
+        batch = self._batches.get(key)
+        if batch is None:
+            self._prune()
+            batch = self._batches[key] = {
+                'to_user_id': to_user_id,
+                'candidates': [],
+                'channel_layer': channel_layer,
+                'channel_name': channel_name,
+                'created': time.monotonic(),
+                'timer': None,
+            }
+        batch['candidates'].extend(candidates)
+
+        if key not in self._ready:
+            return
+        self._ready[key] = time.monotonic()
+        if self.window <= 0:
+            await self.flush(key)
+        elif batch['timer'] is None:
+            batch['timer'] = asyncio.get_running_loop().call_later(self.window, self._start_flush, key)
+
+    def _start_flush(self, key):
+        batch = self._batches.get(key)
+        if batch is None:
+            return
+        task = asyncio.get_running_loop().create_task(self.flush(key))
+        self._tasks[task] = batch['channel_name']
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"ICE candidate flush failed: {task.exception()}")
+
+    async def mark_ready(self, call_id, from_user_id):
+        """The sender's description has been relayed: release its buffered candidates"""
+        key = (str(call_id), from_user_id)
+        self._ready[key] = time.monotonic()
+        await self.flush(key)
+
+    async def flush(self, key):
+        batch = self._batches.pop(key, None)
+        if not batch or not batch['candidates']:
+            return
+        if batch['timer'] is not None:
+            batch['timer'].cancel()
+        await batch['channel_layer'].group_send(
+            f"user_{batch['to_user_id']}",
+            {
+                'type': 'webrtc_ice_candidates_received',
+                'call_id': key[0],
+                'candidates': batch['candidates'],
+                'from_user_id': key[1]
+            }
+        )
+
+    def discard(self, call_id):
+        """Forget a finished call"""
+        call_id = str(call_id)
+        for key in [key for key in self._batches if key[0] == call_id]:
+            batch = self._batches.pop(key)
+            if batch['timer'] is not None:
+                batch['timer'].cancel()
+        for key in [key for key in self._ready if key[0] == call_id]:
+            del self._ready[key]
+
+    def cancel_channel(self, channel_name):
+        """A socket disconnected: drop the candidates it sent and stop their flushes"""
+        for key in [key for key, batch in self._batches.items() if batch['channel_name'] == channel_name]:
+            batch = self._batches.pop(key)
+            if batch['timer'] is not None:
+                batch['timer'].cancel()
+        for task in [task for task, owner in self._tasks.items() if owner == channel_name]:
+            task.cancel()
+
+    def _prune(self):
+        # Calls that were never ended through a socket (missed, crashed clients)
+        cutoff = time.monotonic() - self.ttl
+        for key in [key for key, batch in self._batches.items() if batch['created'] < cutoff]:
+            batch = self._batches.pop(key)
+            if batch['timer'] is not None:
+                batch['timer'].cancel()
+        for key in [key for key, marked in self._ready.items() if marked < cutoff]:
+            del self._ready[key]
+
+
+ice_batcher = IceBatcher()
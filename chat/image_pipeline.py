@@ -0,0 +1,246 @@
+"""
+Background image processing.
+
+Uploads are stored as-is in the request; resizing happens on a small thread
+pool after the transaction commits (Pillow releases the GIL while decoding,
+resizing and encoding, so threads are enough and keep ORM access simple).
+
+Avatars get square variants of AVATAR_SIZES in WebP and JPEG, stored under
+avatars/<hash[:2]>/<hash>/ where hash is the SHA-256 of the uploaded file.
+Identical uploads share variants and an avatar whose content did not change
+is never processed again. UserProfile.avatar_hash is set once the variants
+exist; until then get_avatar_url() serves the original upload.
+
+Image attachments get their dimensions in the upload request (read from the
+header, no decode), then a WebP thumbnail bounded by THUMBNAIL_SIZE and a
+tiny blurred placeholder (LQIP data: URI) in the background. When those are
+stored, the conversation receives an ``attachment_ready`` event. Messages
+sharing a blob (the same image sent again) reuse the first one's previews.
+
+The event is sent on the server's event loop, captured when the job is
+submitted: the in-memory channel layer's queues belong to that loop and must
+not be touched from a pool thread's own loop.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync, async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+AVATAR_SIZES = (40, 128, 300)
+FORMATS = {'webp': 'webp', 'jpeg': 'jpg'}
+QUALITY = 82
+# Bounding box of attachment thumbnails: chat bubbles are at most 512 css px wide and 256 high
+THUMBNAIL_SIZE = (1024, 512)
+PLACEHOLDER_SIZE = 16
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+WORKERS = getattr(settings, 'IMAGE_PIPELINE_WORKERS', 2)
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image-pipeline')
+# Event loop of the request or consumer that submitted the running job
+_job = threading.local()
+
+
+def _server_loop():
+    """The event loop serving this thread: its own, or the one a sync view was called from"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+
+
+def submit(function, *args):
+    """Run function(*args) on the pipeline pool with its own database connection"""
+    loop = _server_loop()
+
+    def run():
+        _job.loop = loop
+        try:
+            function(*args)
+        except Exception as e:
+            print(f"Image processing failed in {function.__name__}{args}: {e}")
+        finally:
+            _job.loop = None
+            close_old_connections()
+    return executor.submit(run)
+
+
+def group_send(group, event):
+    """Send a channel layer event from a pipeline job"""
+    layer = get_channel_layer()
+    loop = getattr(_job, 'loop', None)
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(layer.group_send(group, event), loop).result(timeout=10)
+    else:
+        # No server loop in this process (management commands): nobody local is listening
+        async_to_sync(layer.group_send)(group, event)
+
+
+def file_hash(file):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def variant_size(size=None):
+    """Smallest avatar variant that covers size pixels (the largest when size is None)"""
+    if size is None:
+        return AVATAR_SIZES[-1]
+    return next((variant for variant in AVATAR_SIZES if variant >= int(size)), AVATAR_SIZES[-1])
+
+
+def avatar_variant_name(digest, size, image_format='webp'):
+    return f'avatars/{digest[:2]}/{digest}/{size}.{FORMATS[image_format]}'
+
+
+def avatar_variants_exist(digest):
+    return all(
+        default_storage.exists(avatar_variant_name(digest, size, image_format))
+        for size in AVATAR_SIZES
+        for image_format in FORMATS
+    )
+
+
+def encode(image, image_format):
+    """Encode an RGB image as WebP or progressive JPEG"""
+    buffer = io.BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=QUALITY, method=4)
+    else:
+        image.save(buffer, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def to_rgb(image):
+    """Flatten transparency onto white; JPEG has no alpha channel"""
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    rgba = image.convert('RGBA')
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def render_avatar_variants(file, digest):
+    """Decode an avatar once and store every size and format"""
+    with Image.open(file) as source:
+        # Phone photos carry their rotation in EXIF
+        image = to_rgb(ImageOps.exif_transpose(source))
+        # Largest first so each smaller variant is resized from the previous one
+        for size in sorted(AVATAR_SIZES, reverse=True):
+            image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            for image_format in FORMATS:
+                name = avatar_variant_name(digest, size, image_format)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                default_storage.save(name, ContentFile(encode(image, image_format)))
+
+
+def process_avatar(profile_id):
+    """Build the variants of a profile's current avatar and record its hash"""
+    from .models import UserProfile
+
+    profile = UserProfile.objects.filter(id=profile_id).first()
+    if profile is None or not profile.avatar:
+        return
+    name = profile.avatar.name
+    with profile.avatar.open('rb') as file:
+        digest = file_hash(file)
+        if not avatar_variants_exist(digest):
+            render_avatar_variants(file, digest)
+    # Only if the avatar was not replaced while this one was being processed
+    UserProfile.objects.filter(id=profile_id, avatar=name).update(avatar_hash=digest)
+
+
+def image_dimensions(file):
+    """(width, height) as displayed, read from the image header without decoding; None if unreadable"""
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+    except Exception:
+        # SVG and anything else Pillow cannot read
+        return None
+    finally:
+        file.seek(0)
+    return width, height
+
+
+def render_placeholder(image):
+    """A 16 px blurred WebP of the image as a data: URI (a few hundred bytes)"""
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def render_message_previews(message):
+    """Decode an image attachment once: (width, height, placeholder, thumbnail file or None)"""
+    with message.file.open('rb') as file, Image.open(file) as source:
+        image = to_rgb(ImageOps.exif_transpose(source))
+        width, height = image.size
+        placeholder = render_placeholder(image)
+        thumbnail = None
+        if width > THUMBNAIL_SIZE[0] or height > THUMBNAIL_SIZE[1] or (message.file_size or 0) > 256 * 1024:
+            image.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            thumbnail = ContentFile(encode(image, 'webp'))
+    return width, height, placeholder, thumbnail
+
+
+def process_message_image(message_id, notify=True):
+    """Store the thumbnail and placeholder of an image message and tell the conversation"""
+    from .models import Message
+
+    message = Message.objects.filter(id=message_id).first()
+    if message is None or not message.file or not message.is_image or message.file_extension == 'svg':
+        return
+
+    # The same image sent before (a shared blob) already has its previews
+    sibling = None
+    if message.blob_id:
+        sibling = Message.objects.filter(blob_id=message.blob_id).exclude(id=message_id).exclude(placeholder='').first()
+    if sibling is not None:
+        width, height, placeholder, thumbnail = sibling.image_width, sibling.image_height, sibling.placeholder, None
+        message.thumbnail = sibling.thumbnail.name or None
+    else:
+        width, height, placeholder, thumbnail = render_message_previews(message)
+
+    if thumbnail is not None:
+        message.thumbnail.save('thumbnail.webp', thumbnail, save=False)
+    message.image_width = width
+    message.image_height = height
+    message.placeholder = placeholder
+    Message.objects.filter(id=message_id).update(
+        image_width=width,
+        image_height=height,
+        thumbnail=message.thumbnail.name if message.thumbnail else None,
+        placeholder=placeholder,
+    )
+
+    if not notify:
+        return
+    group_send(
+        f'chat_{message.conversation_id}',
+        {
+            'type': 'attachment_ready',
+            'message_id': message.id,
+            'stream': str(message.conversation_id),
+            **message.attachment_preview()
+        }
+    )
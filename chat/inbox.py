@@ -0,0 +1,140 @@
+"""
+Maintenance helpers for the denormalized conversation inbox.
+
+Every write path that changes what the chat sidebar shows (new message,
+file upload, edit, delete, restore, read) calls into this module so that
+chat_home can render the whole sidebar from a single indexed query.
+"""
+from collections import Counter
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ConversationInbox, Message
+
+PREVIEW_LENGTH = 255
+
+
+def message_preview(message):
+    """Return the sidebar preview text for a message"""
+    if message.is_deleted:
+        text = message.display_content
+    else:
+        text = message.content or message.file_name
+    return (text or '')[:PREVIEW_LENGTH]
+
+
+def _last_message_fields(message):
+    if message is None:
+        return {
+            'last_message_id': None,
+            'last_message_preview': '',
+            'last_message_sender_id': None,
+            'last_message_status': '',
+            'last_message_at': None,
+        }
+    return {
+        'last_message_id': message.id,
+        'last_message_preview': message_preview(message),
+        'last_message_sender_id': message.sender_id,
+        'last_message_status': message.status,
+        'last_message_at': message.timestamp,
+    }
+
+
+def ensure_inbox_entries(conversation):
+    """Create missing inbox rows for every participant of a conversation"""
+    participant_ids = list(conversation.participants.values_list('id', flat=True))
+    existing = set(
+        ConversationInbox.objects.filter(conversation=conversation).values_list('user_id', flat=True)
+    )
+    last_message = conversation.messages.order_by('-timestamp', '-id').first()
+    fields = _last_message_fields(last_message)
+
+    entries = []
+    for user_id in participant_ids:
+        if user_id in existing:
+            continue
+        other_ids = [pid for pid in participant_ids if pid != user_id]
+        entries.append(ConversationInbox(
+            user_id=user_id,
+            conversation=conversation,
+            other_user_id=other_ids[0] if other_ids else None,
+            updated_at=conversation.updated_at or timezone.now(),
+            **fields
+        ))
+    if entries:
+        ConversationInbox.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def record_new_message(message):
+    """Point every inbox row of the conversation at a freshly created message"""
+    record_new_messages([message])
+
+
+def record_new_messages(messages):
+    """Apply several new messages of one conversation, oldest first, in a few UPDATEs"""
+    last_message = messages[-1]
+    entries = ConversationInbox.objects.filter(conversation_id=last_message.conversation_id)
+    fields = _last_message_fields(last_message)
+    sent_by = Counter(message.sender_id for message in messages)
+
+    # Each row's unread count grows by the messages its owner did not send
+    updated = 0
+    for sender_id, count in sent_by.items():
+        updated += entries.filter(user_id=sender_id).update(
+            unread_count=F('unread_count') + (len(messages) - count),
+            updated_at=last_message.timestamp,
+            **fields
+        )
+    updated += entries.exclude(user_id__in=list(sent_by)).update(
+        unread_count=F('unread_count') + len(messages),
+        updated_at=last_message.timestamp,
+        **fields
+    )
+
+    if not updated:
+        # Conversation predates the inbox table; build its rows from scratch
+        ensure_inbox_entries(last_message.conversation)
+
+
+def message_changed(message):
+    """Refresh the preview of inbox rows whose last message was edited, deleted or restored"""
+    ConversationInbox.objects.filter(last_message=message).update(
+        last_message_preview=message_preview(message),
+        last_message_status=message.status,
+    )
+
+
+def refresh_last_message(conversation):
+    """Recompute the last message snapshot of a conversation from the messages table"""
+    last_message = conversation.messages.order_by('-timestamp', '-id').first()
+    ConversationInbox.objects.filter(conversation=conversation).update(**_last_message_fields(last_message))
+
+
+def mark_inbox_read(conversation, user, up_to_id=None, unread_count=0):
+    """Reset the unread counter for a user and reflect the read receipt on the sender's row"""
+    ConversationInbox.objects.filter(conversation=conversation, user=user).update(unread_count=unread_count)
+    entries = ConversationInbox.objects.filter(
+        conversation=conversation,
+        last_message_status__in=['sent', 'delivered']
+    ).exclude(last_message_sender=user)
+    if up_to_id is not None:
+        entries = entries.filter(last_message_id__lte=up_to_id)
+    entries.update(last_message_status='read')
+
+
+def rebuild_inbox(conversations):
+    """Rebuild inbox rows (including unread counts) for the given conversations"""
+    rebuilt = 0
+    for conversation in conversations.prefetch_related('participants'):
+        ConversationInbox.objects.filter(conversation=conversation).delete()
+        ensure_inbox_entries(conversation)
+        for entry in ConversationInbox.objects.filter(conversation=conversation):
+            entry.unread_count = Message.objects.filter(
+                conversation=conversation,
+                status__in=['sent', 'delivered']
+            ).exclude(sender_id=entry.user_id).count()
+            entry.save(update_fields=['unread_count'])
+        rebuilt += 1
+    return rebuilt
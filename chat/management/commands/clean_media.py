@@ -0,0 +1,71 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from chat.media_gc import BATCH_SIZE, MIN_AGE, ROOTS, collect
+
+class Command(BaseCommand):
+    help = 'Delete media files (attachments, thumbnails, avatars) that no message or profile references'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List orphaned files and their size without deleting them'
+        )
+        parser.add_argument(
+            '--root',
+            action='append',
+            choices=ROOTS,
+            help='Media directory to collect (repeatable; default: all)'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=MIN_AGE.total_seconds() / 60,
+            help='Minutes a file must be old before it can be collected (default: 60)'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Maximum deletions per second (default: unlimited)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Files checked per database lookup'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Keep running, collecting every INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verbose = options['verbosity'] > 1 or dry_run
+        
+        def log(name, size):
+            self.stdout.write(f'{"Orphaned" if dry_run else "Deleting"} {name} ({size} bytes)')
+        
+        while True:
+            report = collect(
+                roots=options['root'] or ROOTS,
+                dry_run=dry_run,
+                min_age=timedelta(minutes=options['min_age']),
+                batch_size=options['batch_size'],
+                rate=options['rate'],
+                log=log if verbose else None
+            )
+            verb = 'Would reclaim' if dry_run else 'Reclaimed'
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Scanned {report["scanned"]} files; {verb} {report["bytes"] / (1024 * 1024):.1f} MB '
+                    f'from {report["deleted"]} orphaned files'
+                )
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
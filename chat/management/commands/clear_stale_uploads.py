@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from chat.uploads import SESSION_TTL, clear_stale_sessions
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were abandoned before being finalized'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=SESSION_TTL.total_seconds() / 3600,
+            help='Hours without a new chunk after which an upload is abandoned (default: 24)'
+        )
+
+    def handle(self, *args, **options):
+        cleared = clear_stale_sessions(max_age=timedelta(hours=options['hours']))
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {cleared} abandoned uploads')
+        )
@@ -0,0 +1,52 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from chat.blobs import adopt, legacy_files
+from chat.image_pipeline import file_hash
+from chat.models import Blob, Message
+
+class Command(BaseCommand):
+    help = 'Move attachments from chat_files/conversation_*/ into the deduplicated blob store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many files are duplicates and how much space they use'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        # Digests seen in this run, so a dry run can tell which files are duplicates
+        seen = set()
+        files = messages = duplicates = freed = 0
+        
+        # One directory entry at a time; a file is read once, to hash it
+        for name in legacy_files():
+            if not Message.objects.filter(file=name, blob__isnull=True).exists():
+                continue
+            try:
+                with default_storage.open(name, 'rb') as file:
+                    digest = file_hash(file)
+                files += 1
+                if dry_run:
+                    if digest in seen or Blob.objects.filter(sha256=digest).exists():
+                        duplicates += 1
+                        freed += default_storage.size(name)
+                    seen.add(digest)
+                    continue
+                moved, file_freed = adopt(name, digest=digest)
+            except OSError as e:
+                self.stdout.write(self.style.WARNING(f'Skipped {name}: {e}'))
+                continue
+            messages += moved
+            if file_freed:
+                duplicates += 1
+                freed += file_freed
+        
+        verb = 'Would free' if dry_run else 'Freed'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Checked {files} attachments ({messages} messages moved); '
+                f'{verb} {freed / (1024 * 1024):.1f} MB from {duplicates} duplicates'
+            )
+        )
@@ -0,0 +1,28 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.call_timeouts import expire_stale_calls, notify_missed
+
+class Command(BaseCommand):
+    help = 'Mark calls that have been ringing too long as missed (fallback for the in-process timer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=settings.CALL_RING_TIMEOUT,
+            help='Seconds a call may ring before it is missed (default: CALL_RING_TIMEOUT)'
+        )
+
+    def handle(self, *args, **options):
+        expired = expire_stale_calls(timeout=options['timeout'])
+        
+        # Reaches connected clients only with a shared (Redis) channel layer
+        channel_layer = get_channel_layer()
+        for session in expired:
+            async_to_sync(notify_missed)(channel_layer, session)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Marked {len(expired)} unanswered calls as missed')
+        )
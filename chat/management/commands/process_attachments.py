@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from chat.image_pipeline import process_message_image
+from chat.models import Message
+
+class Command(BaseCommand):
+    help = 'Build thumbnails and placeholders for image attachments that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Also rebuild previews of attachments that are already processed'
+        )
+
+    def handle(self, *args, **options):
+        messages = Message.objects.filter(message_type='image', is_deleted=False).exclude(file='').exclude(file__iendswith='.svg')
+        if not options['all']:
+            messages = messages.filter(placeholder='')
+        
+        processed = 0
+        for message_id in messages.values_list('id', flat=True).iterator():
+            try:
+                # A backfill, so no attachment_ready events
+                process_message_image(message_id, notify=False)
+                processed += 1
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Skipped message {message_id}: {e}'))
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed {processed} image attachments')
+        )
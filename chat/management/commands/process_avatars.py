@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from chat.image_pipeline import process_avatar
+from chat.models import UserProfile
+
+class Command(BaseCommand):
+    help = 'Build resized avatar variants for uploaded avatars that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Also re-check avatars that are already processed'
+        )
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['all']:
+            profiles = profiles.filter(avatar_hash='')
+        
+        processed = 0
+        for profile_id in profiles.values_list('id', flat=True).iterator():
+            try:
+                process_avatar(profile_id)
+                processed += 1
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Skipped profile {profile_id}: {e}'))
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed {processed} avatars')
+        )
@@ -0,0 +1,116 @@
+import json
+import sys
+from urllib.parse import urlsplit
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import Resolver404, resolve
+from chat import query_stats
+
+LOG_PREFIX = 'query_stats '
+
+class Command(BaseCommand):
+    help = 'Summarize database queries per endpoint and websocket frame type from query_stats log lines, or by requesting URLs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'logs',
+            nargs='*',
+            help='Log files with query_stats lines (QUERY_STATS=true); "-" reads standard input'
+        )
+        parser.add_argument(
+            '--url',
+            action='append',
+            default=[],
+            help='Request this URL in this process and measure it (repeatable)'
+        )
+        parser.add_argument(
+            '--user',
+            help='Username the --url requests are made as'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=1,
+            help='Requests per --url (the first one may fill caches)'
+        )
+        parser.add_argument(
+            '--sort',
+            choices=['db_ms', 'queries', 'duplicates', 'calls'],
+            default='db_ms',
+            help='Order endpoints by total of this column (default: db_ms)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Endpoints to show'
+        )
+
+    def handle(self, *args, **options):
+        if not options['logs'] and not options['url']:
+            raise CommandError('Give log files to summarize or --url to measure')
+
+        query_stats.reset()
+        for name in options['logs']:
+            self.read_log(sys.stdin if name == '-' else open(name, encoding='utf-8', errors='replace'))
+        if options['url']:
+            self.measure(options['url'], options['user'], options['repeat'])
+
+        totals = query_stats.summary()
+        if not totals:
+            self.stdout.write(self.style.WARNING('No query_stats entries found'))
+            return
+
+        self.stdout.write(f'{"Endpoint":<48} {"Calls":>6} {"Queries":>8} {"Max":>5} {"DB ms":>8} {"Dupes":>6} {"Slow":>5}')
+        ordered = sorted(totals.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        for endpoint, endpoint_totals in ordered[:options['limit']]:
+            calls = endpoint_totals['calls']
+            self.stdout.write(
+                f'{endpoint[:48]:<48} {calls:>6} {endpoint_totals["queries"] / calls:>8.1f} '
+                f'{endpoint_totals["max_queries"]:>5} {endpoint_totals["db_ms"] / calls:>8.2f} '
+                f'{endpoint_totals["duplicates"] / calls:>6.1f} {endpoint_totals["slow"]:>5}'
+            )
+            for sql, count in endpoint_totals['repeated'].most_common(2):
+                self.stdout.write(f'    repeated {count}x: {sql[:150]}')
+            if endpoint_totals['slowest']:
+                slowest = endpoint_totals['slowest']
+                self.stdout.write(f'    slowest {slowest["ms"]} ms: {slowest["sql"][:150]}')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{len(totals)} endpoints, {sum(t["calls"] for t in totals.values())} requests and frames')
+        )
+
+    def read_log(self, lines):
+        with lines:
+            for line in lines:
+                start = line.find(LOG_PREFIX)
+                if start == -1:
+                    continue
+                try:
+                    query_stats.record(json.loads(line[start + len(LOG_PREFIX):]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    def measure(self, urls, username, repeat):
+        client = Client()
+        if username:
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'No user {username}')
+            client.force_login(user)
+
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for url in urls:
+                try:
+                    label = f'GET {resolve(urlsplit(url).path).view_name}'
+                except Resolver404:
+                    raise CommandError(f'No view for {url}')
+                for _ in range(repeat):
+                    stats = query_stats.QueryStats(label)
+                    with connection.execute_wrapper(stats):
+                        response = client.get(url)
+                    if response.status_code >= 400:
+                        self.stdout.write(self.style.WARNING(f'{url} answered {response.status_code}'))
+                    query_stats.record(stats.as_dict())
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from chat.models import Conversation
+from chat.inbox import rebuild_inbox
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized conversation inbox from the messages table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conversation',
+            type=int,
+            action='append',
+            help='Only rebuild the given conversation id (may be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.all()
+        if options['conversation']:
+            conversations = conversations.filter(id__in=options['conversation'])
+        
+        self.stdout.write('Rebuilding conversation inbox...')
+        rebuilt = rebuild_inbox(conversations)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt inbox for {rebuilt} conversations')
+        )
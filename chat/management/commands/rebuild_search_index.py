@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from chat.search import REBUILD_BATCH_SIZE, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the message full-text search index from the messages table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=REBUILD_BATCH_SIZE,
+            help='Messages indexed per statement'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding message search index...')
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {indexed} messages')
+        )
@@ -0,0 +1,127 @@
+"""
+Garbage collection of media files nothing points at any more.
+
+Attachments in the blob store are reclaimed with their last message
+(chat/blobs.py), but other files are left behind by deleted conversations
+and accounts: attachments from before the blob store, thumbnails, replaced
+avatars and their resized variants, and uploads interrupted by errors. The
+collector walks the media roots with os.scandir, one directory entry at a
+time, and checks the files in batches. Each batch costs one set lookup per
+table:
+
+    chat_files/  Message.file, Message.thumbnail, Blob.path, UploadSession.path
+    profiles/    UserProfile.avatar
+    avatars/     UserProfile.avatar_hash (avatars/<h[:2]>/<h>/<size>.<ext>)
+    cache/       nothing: rendered initials avatars are no longer written to
+                 disk, so files left there by older versions are all removed
+
+Files younger than min_age are never touched, because the request or
+pipeline writing them may not have committed its row yet. Deletions can be
+rate limited so a large backlog does not saturate the disk. Run it with
+``python manage.py clean_media`` (once, or with --interval as a scheduled
+loop).
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+
+from .models import Blob, Message, UploadSession, UserProfile
+
+ROOTS = ('chat_files', 'profiles', 'avatars', 'cache')
+BATCH_SIZE = 500
+MIN_AGE = timedelta(hours=1)
+
+
+def walk(root, min_age=MIN_AGE, dry_run=False):
+    """Yield (storage name, size) of every file under root older than min_age; removes old empty directories"""
+    cutoff = time.time() - min_age.total_seconds()
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        path = default_storage.path(directory)
+        try:
+            with os.scandir(path) as entries:
+                empty = True
+                for entry in entries:
+                    empty = False
+                    name = f'{directory}/{entry.name}'
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(name)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        if stat.st_mtime < cutoff:
+                            yield name, stat.st_size
+        except FileNotFoundError:
+            continue
+        if empty and directory != root and not dry_run and os.path.getmtime(path) < cutoff:
+            # Emptied by an earlier run (a deleted conversation); the next run removes its parent
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+
+def _avatar_hash(name):
+    parts = name.split('/')
+    return parts[2] if len(parts) == 4 else None
+
+
+def referenced(names):
+    """The subset of names that a row still points at"""
+    names = list(names)
+    found = set()
+    chat_files = [name for name in names if name.startswith('chat_files/')]
+    if chat_files:
+        found.update(Message.objects.filter(file__in=chat_files).values_list('file', flat=True))
+        found.update(Message.objects.filter(thumbnail__in=chat_files).values_list('thumbnail', flat=True))
+        found.update(Blob.objects.filter(path__in=chat_files).values_list('path', flat=True))
+        found.update(UploadSession.objects.filter(path__in=chat_files).values_list('path', flat=True))
+
+    profiles = [name for name in names if name.startswith('profiles/')]
+    if profiles:
+        found.update(UserProfile.objects.filter(avatar__in=profiles).values_list('avatar', flat=True))
+
+    hashes = {_avatar_hash(name) for name in names if name.startswith('avatars/')} - {None}
+    if hashes:
+        live = set(UserProfile.objects.filter(avatar_hash__in=hashes).values_list('avatar_hash', flat=True))
+        found.update(name for name in names if name.startswith('avatars/') and _avatar_hash(name) in live)
+    return found
+
+
+def collect(roots=ROOTS, dry_run=False, min_age=MIN_AGE, batch_size=BATCH_SIZE, rate=None, log=None):
+    """
+    Delete unreferenced media files under roots. rate caps deletions per
+    second. Returns {'scanned', 'deleted', 'bytes'}; with dry_run nothing is
+    deleted and the counts say what would be.
+    """
+    report = {'scanned': 0, 'deleted': 0, 'bytes': 0}
+    started = time.monotonic()
+
+    def sweep(batch):
+        live = referenced(batch)
+        for name, size in batch.items():
+            if name in live:
+                continue
+            if log:
+                log(name, size)
+            if not dry_run:
+                if rate:
+                    # Stay under rate deletions per second on average
+                    time.sleep(max(0.0, started + report['deleted'] / rate - time.monotonic()))
+                default_storage.delete(name)
+            report['deleted'] += 1
+            report['bytes'] += size
+
+    for root in roots:
+        batch = {}
+        for name, size in walk(root, min_age=min_age, dry_run=dry_run):
+            report['scanned'] += 1
+            batch[name] = size
+            if len(batch) >= batch_size:
+                sweep(batch)
+                batch = {}
+        if batch:
+            sweep(batch)
+    return report
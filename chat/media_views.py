@@ -0,0 +1,185 @@
+"""
+Authenticated serving of MEDIA_ROOT.
+
+Attachments and thumbnails are only served to participants of a conversation
+that contains them; avatars go to any signed-in user. The access decision is
+cached per user and file for a minute, so scrubbing through a video costs one
+membership query, not one per range request.
+
+The transfer itself is handed to the front proxy when MEDIA_OFFLOAD is set
+('x-accel' for nginx, 'x-sendfile' for Apache/lighttpd); the proxy then
+handles ranges. Otherwise Django streams the file: whole files through
+FileResponse (sendfile where the server supports it), single byte ranges as
+206 responses. Every response has an ETag (size and mtime) and answers
+If-None-Match with 304. Names that never change content (content hashes and
+random ids) are cached by browsers as immutable; profiles/ names can be
+reused after an avatar is deleted, so those are revalidated.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import require_http_methods
+
+from .blobs import BLOB_ROOT
+from .directory import LRUCache
+from .models import Conversation, Message
+
+OFFLOAD = getattr(settings, 'MEDIA_OFFLOAD', '')
+ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+BLOCK_SIZE = 64 * 1024
+IMMUTABLE = 'private, max-age=31536000, immutable'
+REVALIDATE = 'private, no-cache'
+
+access_cache = LRUCache(size=4096, ttl=60)
+
+_CONVERSATION_FILE = re.compile(r'^chat_files/conversation_(\d+)/')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _is_participant(user, conversation_id):
+    return Conversation.participants.through.objects.filter(
+        conversation_id=conversation_id,
+        user_id=user.id
+    ).exists()
+
+
+def can_access(user, name):
+    """Whether user may read the media file name"""
+    if name.startswith(('profiles/', 'avatars/')):
+        return True
+    if name.startswith(f'{BLOB_ROOT}/'):
+        digest = posixpath.basename(name).split('.')[0]
+        return Message.objects.filter(blob__sha256=digest, conversation__participants=user).exists()
+    match = _CONVERSATION_FILE.match(name)
+    if match is None:
+        return False
+    if _is_participant(user, int(match.group(1))):
+        return True
+    # Thumbnails are shared by every message with the same image, in any conversation
+    return '/thumbs/' in name and Message.objects.filter(thumbnail=name, conversation__participants=user).exists()
+
+
+def _cached_access(user, name):
+    key = (user.id, name)
+    allowed = access_cache.get(key)
+    if allowed is None:
+        allowed = can_access(user, name)
+        access_cache.put(key, allowed)
+    return allowed
+
+
+def _byte_range(header, size):
+    """(start, end) of a single "bytes=" range, None to send everything, or ValueError if unsatisfiable"""
+    match = _RANGE.match(header.strip())
+    if match is None:
+        # Multiple ranges and other units are answered with the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_media(request, path):
+    """Serve a file below MEDIA_ROOT to a user allowed to see it"""
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith('..') or not request.user.is_authenticated or not _cached_access(request.user, name):
+        # Same answer for missing and forbidden files
+        raise Http404('File not found')
+
+    try:
+        full_path = default_storage.path(name)
+        stat = os.stat(full_path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    etag = quote_etag(f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+    content_type, encoding = mimetypes.guess_type(name)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': REVALIDATE if name.startswith('profiles/') else IMMUTABLE,
+        'X-Content-Type-Options': 'nosniff',
+        # Uploaded SVG/HTML must not run scripts on this origin
+        'Content-Security-Policy': "default-src 'none'; img-src 'self' data:; media-src 'self'; style-src 'unsafe-inline'; sandbox",
+    }
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')) or request.headers.get('If-None-Match') == '*':
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if OFFLOAD == 'x-accel':
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        # A URI that nginx decodes; a raw non-ASCII name would be MIME-encoded by Django and not resolve
+        response['X-Accel-Redirect'] = quote(ACCEL_PREFIX.rstrip('/') + '/' + name)
+    elif OFFLOAD == 'x-sendfile':
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        # mod_xsendfile URL-decodes the path (XSendFileUnescape, on by default)
+        response['X-Sendfile'] = quote(full_path)
+    else:
+        response = _file_response(request, full_path, stat.st_size, etag, content_type)
+
+    for header, value in headers.items():
+        response[header] = value
+    if encoding:
+        # .gz and friends are downloads, not transparently decoded content
+        response['Content-Type'] = 'application/octet-stream'
+    return response
+
+
+def _file_response(request, full_path, size, etag, content_type):
+    byte_range = None
+    range_header = request.headers.get('Range')
+    # If-Range: only honour the range when the client's copy is still current
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = _byte_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        body = iter(()) if request.method == 'HEAD' else _read_range(open(full_path, 'rb'), start, length)
+        response = StreamingHttpResponse(body, status=206, content_type=content_type or 'application/octet-stream')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,223 @@
+"""
+Write-behind persistence for chat messages (MESSAGE_WRITE_BEHIND).
+
+ChatConsumer normally saves every message synchronously before broadcasting
+it, which serializes senders on the database. In write-behind mode a message
+gets its snowflake id and timestamp up front, is broadcast at once, and is
+queued. A per-event-loop flusher then inserts queued messages with one
+bulk_create per batch, together with the Conversation and inbox updates,
+inside a single transaction.
+
+Guarantees:
+
+- Bounded memory: once MESSAGE_WRITE_QUEUE_SIZE messages are queued, senders
+  wait for a flush before their message is accepted (backpressure).
+- Read-your-writes for the socket: edits, deletes, reactions and read
+  receipts that reference a queued message flush the queue first.
+- Graceful shutdown: queued messages are flushed synchronously at interpreter
+  exit. Only a hard kill can lose up to one flush interval of messages.
+- No silent loss: a message whose insert fails goes back to the queue and is
+  retried on the next flushes. After WRITE_ATTEMPTS failures it is given up
+  and logged at error level with its full payload, so it can be restored.
+
+Message ids are unique only if every worker has its own MESSAGE_WORKER_ID;
+settings refuse to start write-behind without one.
+"""
+import asyncio
+import atexit
+import json
+import logging
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import inbox, search, snowflake
+from .models import Conversation, Message
+
+BATCH_SIZE = getattr(settings, 'MESSAGE_WRITE_BATCH_SIZE', 200)
+FLUSH_INTERVAL = getattr(settings, 'MESSAGE_WRITE_FLUSH_INTERVAL', 0.05)
+QUEUE_SIZE = getattr(settings, 'MESSAGE_WRITE_QUEUE_SIZE', 5000)
+# Inserts of one message before it is given up (see give_up)
+WRITE_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def write_batch(messages):
+    """Insert queued messages and update their conversations and inbox rows; returns the ones that failed"""
+    try:
+        with transaction.atomic():
+            _insert(messages)
+        return []
+    except Exception as e:
+        # One bad row (e.g. its conversation was deleted) must not fail the whole batch
+        print(f"Batched message insert failed, retrying one by one: {e}")
+    failed = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                _insert([message])
+        except Exception as e:
+            print(f"Message {message.id} insert failed: {e}")
+            message.write_error = e
+            failed.append(message)
+    return failed
+
+
+def give_up(message):
+    """Log a message that could not be written, with everything needed to restore it"""
+    payload = {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'sender_id': message.sender_id,
+        'timestamp': message.timestamp.isoformat(),
+        'content': message.content,
+    }
+    logger.error(
+        'Message %s was broadcast but could not be written after %s attempts (%s): %s',
+        message.id, getattr(message, 'write_attempts', 1), getattr(message, 'write_error', None), json.dumps(payload)
+    )
+
+
+def _insert(messages):
+    Message.objects.bulk_create(messages)
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+    for conversation_id, conversation_messages in by_conversation.items():
+        Conversation.objects.filter(id=conversation_id).update(updated_at=conversation_messages[-1].timestamp)
+        inbox.record_new_messages(conversation_messages)
+    search.record_new_messages(messages)
+
+
+class MessageWriter:
+    """Queue of unsaved messages for one event loop"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.pending = []
+        self.writing = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def submit(self, conversation_id, sender_id, content):
+        """Assign an id and timestamp, queue the message and return them immediately"""
+        while len(self.pending) >= self.queue_size:
+            await self.flush()
+
+        message = Message(
+            id=snowflake.next_id(),
+            conversation_id=conversation_id,
+            sender_id=sender_id,
+            content=content,
+            timestamp=timezone.now(),
+        )
+        self.pending.append(message)
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+        return {
+            'id': message.id,
+            'timestamp': message.timestamp.isoformat()
+        }
+
+    def is_pending(self, message_id):
+        """True if a message with an id up to message_id is queued or being written"""
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return False
+        oldest = (self.writing or self.pending or [None])[0]
+        return oldest is not None and oldest.id <= message_id
+
+    async def ensure_persisted(self, message_id):
+        """Flush first if message_id (or an earlier message) is still queued"""
+        if self.is_pending(message_id):
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            retry = []
+            try:
+                while self.pending:
+                    self.writing, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+                    try:
+                        failed = await database_sync_to_async(write_batch)(self.writing)
+                    finally:
+                        self.writing = []
+                    for message in failed:
+                        message.write_attempts = getattr(message, 'write_attempts', 0) + 1
+                        if message.write_attempts < WRITE_ATTEMPTS:
+                            retry.append(message)
+                        else:
+                            give_up(message)
+            finally:
+                # Failed messages are older than anything queued since; retried on the next flush
+                self.pending[:0] = retry
+
+    async def _flush_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Message flush failed: {e}")
+
+    async def close(self):
+        """Stop the flusher and write everything still queued"""
+        self._flusher.cancel()
+        await self.flush()
+
+
+_writers = {}
+
+
+def get_writer():
+    """Return the writer bound to the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter()
+        # Adopt anything left behind by event loops that have since closed
+        for stale in [other for other in _writers if other.is_closed()]:
+            writer.pending[:0] = _writers.pop(stale).pending
+    return writer
+
+
+def queued():
+    """Messages waiting to be written by every writer in this process"""
+    return sum(len(writer.pending) + len(writer.writing) for writer in list(_writers.values()))
+
+
+def _flush_sync(writer):
+    # A batch interrupted mid-write may or may not have been committed
+    interrupted, writer.writing = writer.writing, []
+    if interrupted:
+        written = set(Message.objects.filter(id__in=[message.id for message in interrupted]).values_list('id', flat=True))
+        unwritten = [message for message in interrupted if message.id not in written]
+        if unwritten:
+            for message in write_batch(unwritten):
+                give_up(message)
+    
+    pending, writer.pending = writer.pending, []
+    for start in range(0, len(pending), writer.batch_size):
+        # Last chance: the process is exiting
+        for message in write_batch(pending[start:start + writer.batch_size]):
+            give_up(message)
+
+
+@atexit.register
+def flush_on_exit():
+    """Durability on graceful shutdown: write whatever the event loops left queued"""
+    for writer in list(_writers.values()):
+        if writer.writing or writer.pending:
+            _flush_sync(writer)
@@ -0,0 +1,420 @@
+"""
+Runtime metrics of the realtime layer, in the Prometheus text format.
+
+    chat_websocket_connections        open sockets per consumer class
+    chat_websocket_frames_total       frames received per consumer and "type"
+    chat_websocket_frame_seconds      time to handle a frame (histogram)
+    chat_group_send_seconds           channel layer group_send latency (histogram)
+    chat_channel_layer_queue_depth    messages waiting in this worker's layer queues
+    chat_message_write_queue_depth    messages waiting for the write-behind writer
+    chat_db_threads_in_flight         database_sync_to_async calls waiting or running
+    chat_db_thread_wait_seconds       time such calls wait for the database thread (histogram)
+    chat_db_call_seconds              time they then run (histogram)
+    chat_upload_bytes_total           bytes received per upload kind
+
+Recording only touches a dict in this process. With METRICS_BACKEND=redis a
+daemon thread flushes every METRICS_FLUSH_INTERVAL seconds: counter and
+histogram increments are added to one Redis hash shared by all workers, so
+totals survive worker restarts, and each worker's gauges are written to a
+hash of its own that expires when the worker stops flushing. /metrics adds
+them up. The local backend only reports the process that answers the scrape,
+which is enough for a single worker.
+
+Consumers count connections and frames through MeasuredConsumerMixin, which
+also times the channel layer's group_send from the first connection on; the
+frame type is read from the head of the frame, so frames are not parsed
+twice. Each metric keeps at most MAX_SERIES label combinations; further ones
+are counted under "other".
+"""
+import atexit
+import os
+import re
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+BACKEND = getattr(settings, 'METRICS_BACKEND', 'local')
+FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+WORKER = f'{socket.gethostname()}:{os.getpid()}'
+# Gauges of a worker that stopped flushing drop out after this many seconds
+GAUGE_TTL = max(1, int(FLUSH_INTERVAL * 3))
+MAX_SERIES = 500
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_registry = {}
+_flusher = None
+
+_FRAME_TYPE = re.compile(r'"type"\s*:\s*"([A-Za-z0-9_]{1,40})"')
+_LE = re.compile(r'le="([^"]*)"')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, label_names, values):
+    if not label_names:
+        return name
+    return name + '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in zip(label_names, values)) + '}'
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """A counter, gauge or histogram and its series in this process"""
+
+    def __init__(self, name, documentation, kind, labels=(), buckets=LATENCY_BUCKETS, collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        # Gauges read when scraped: collect() returns {label values: value}
+        self.collect = collect
+        self.samples = {}
+        # Counter and histogram increments not yet added to the shared store
+        self.pending = {}
+        self._series = {}
+        _registry[name] = self
+
+    @property
+    def sample_names(self):
+        if self.kind == 'histogram':
+            return (f'{self.name}_bucket', f'{self.name}_sum', f'{self.name}_count')
+        return (self.name,)
+
+    def _keys(self, labels):
+        """Sample names of one label combination (caller holds _lock)"""
+        values = tuple(str(labels.get(label, '')) for label in self.labels)
+        keys = self._series.get(values)
+        if keys is not None:
+            return keys
+        if len(self._series) >= MAX_SERIES:
+            values = ('other',) * len(self.labels)
+            keys = self._series.get(values)
+            if keys is not None:
+                return keys
+        if self.kind == 'histogram':
+            bucket_labels = self.labels + ('le',)
+            keys = (
+                [(bound, _sample(f'{self.name}_bucket', bucket_labels, values + (_format(bound),))) for bound in self.buckets],
+                _sample(f'{self.name}_bucket', bucket_labels, values + ('+Inf',)),
+                _sample(f'{self.name}_sum', self.labels, values),
+                _sample(f'{self.name}_count', self.labels, values),
+            )
+            # Every bucket exists from the first observation on, so quantiles see the whole set
+            for _, key in keys[0]:
+                self._add(key, 0)
+            for key in keys[1:]:
+                self._add(key, 0)
+        else:
+            keys = _sample(self.name, self.labels, values)
+        self._series[values] = keys
+        return keys
+
+    def _add(self, key, amount):
+        self.samples[key] = self.samples.get(key, 0) + amount
+        if self.kind != 'gauge' and BACKEND == 'redis':
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    def inc(self, amount=1, **labels):
+        with _lock:
+            self._add(self._keys(labels), amount)
+        if _flusher is None and BACKEND == 'redis':
+            _start_flusher()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def observe(self, value, **labels):
+        with _lock:
+            buckets, infinity, total, count = self._keys(labels)
+            for bound, key in buckets:
+                if value <= bound:
+                    self._add(key, 1)
+            self._add(infinity, 1)
+            self._add(total, value)
+            self._add(count, 1)
+        if _flusher is None and BACKEND == 'redis':
+            _start_flusher()
+
+    def gauge_samples(self):
+        """Current values of a gauge in this process"""
+        if self.collect is None:
+            with _lock:
+                return dict(self.samples)
+        try:
+            return {_sample(self.name, self.labels, values): value for values, value in self.collect().items()}
+        except Exception as e:
+            print(f"Could not collect metric {self.name}: {e}")
+            return {}
+
+
+def _local_samples():
+    samples = {}
+    for metric in _registry.values():
+        if metric.kind == 'gauge':
+            samples.update(metric.gauge_samples())
+        else:
+            with _lock:
+                samples.update(metric.samples)
+    return samples
+
+
+def _take_pending():
+    with _lock:
+        pending = {}
+        for metric in _registry.values():
+            pending.update(metric.pending)
+            metric.pending = {}
+    return pending
+
+
+def _return_pending(pending):
+    """Put back increments that could not be flushed"""
+    owners = _owners()
+    with _lock:
+        for key, amount in pending.items():
+            metric = owners.get(key.split('{', 1)[0])
+            if metric is not None:
+                metric.pending[key] = metric.pending.get(key, 0) + amount
+
+
+def _owners():
+    return {name: metric for metric in _registry.values() for name in metric.sample_names}
+
+
+class LocalMetricsStore:
+    """Metrics of this process only"""
+
+    def flush(self):
+        pass
+
+    def collect(self):
+        return _local_samples()
+
+
+class RedisMetricsStore:
+    """Counters and histograms summed in one Redis hash; gauges in a hash per worker"""
+
+    def __init__(self, url, prefix):
+        self.url = url
+        self.totals_key = f'{prefix}:metrics:totals'
+        self.gauge_prefix = f'{prefix}:metrics:gauges:'
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    def flush(self):
+        pending = _take_pending()
+        gauges = {}
+        for metric in _registry.values():
+            if metric.kind == 'gauge':
+                gauges.update(metric.gauge_samples())
+        gauge_key = self.gauge_prefix + WORKER
+        try:
+            with self.client.pipeline(transaction=True) as pipe:
+                for key, amount in pending.items():
+                    pipe.hincrbyfloat(self.totals_key, key, amount)
+                pipe.delete(gauge_key)
+                if gauges:
+                    pipe.hset(gauge_key, mapping=gauges)
+                    pipe.expire(gauge_key, GAUGE_TTL)
+                pipe.execute()
+        except Exception:
+            _return_pending(pending)
+            raise
+
+    def collect(self):
+        self.flush()
+        samples = {}
+        for key, value in self.client.hgetall(self.totals_key).items():
+            samples[key.decode()] = float(value)
+        for gauge_key in self.client.scan_iter(match=f'{self.gauge_prefix}*', count=500):
+            for key, value in self.client.hgetall(gauge_key).items():
+                key = key.decode()
+                samples[key] = samples.get(key, 0) + float(value)
+        return samples
+
+
+def _build_store():
+    if BACKEND == 'redis':
+        return RedisMetricsStore(settings.REDIS_URL, getattr(settings, 'CHANNEL_LAYER_PREFIX', 'chat'))
+    return LocalMetricsStore()
+
+
+store = _build_store()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"Metrics flush failed: {e}")
+
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True)
+    _flusher.start()
+
+
+@atexit.register
+def flush_on_exit():
+    if _flusher is None:
+        # Nothing recorded
+        return
+    try:
+        store.flush()
+    except Exception as e:
+        print(f"Metrics flush failed: {e}")
+
+
+def _series_order(key):
+    # Buckets of one series together and in ascending order
+    match = _LE.search(key)
+    if match is None:
+        return key, 0.0
+    return _LE.sub('', key), float(match.group(1).replace('+Inf', 'inf'))
+
+
+def exposition(samples):
+    """Prometheus text format of {sample: value}"""
+    by_metric = {}
+    owners = _owners()
+    for key, value in samples.items():
+        metric = owners.get(key.split('{', 1)[0])
+        if metric is not None:
+            by_metric.setdefault(metric.name, []).append((key, value))
+
+    lines = []
+    for metric in _registry.values():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, value in sorted(by_metric.get(metric.name, ()), key=lambda item: _series_order(item[0])):
+            lines.append(f'{key} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def render():
+    """Exposition of all workers (or this process when the shared store is unreachable)"""
+    try:
+        samples = store.collect()
+    except Exception as e:
+        print(f"Could not read shared metrics: {e}")
+        samples = _local_samples()
+    return exposition(samples)
+
+
+def _layer_queue_depth():
+    from channels.layers import channel_layers
+
+    depth = {}
+    for alias, layer in list(channel_layers.backends.items()):
+        # In-memory layer: every channel's queue; Redis layer: messages received but not yet consumed
+        queues = getattr(layer, 'channels', None)
+        if not isinstance(queues, dict):
+            queues = getattr(layer, 'receive_buffer', None)
+        if isinstance(queues, dict):
+            depth[(alias,)] = sum(queue.qsize() for queue in list(queues.values()))
+    return depth
+
+
+def _write_queue_depth():
+    from .message_writer import queued
+    return {(): queued()}
+
+
+connections = Metric('chat_websocket_connections', 'Open websocket connections', 'gauge', ('consumer',))
+frames = Metric('chat_websocket_frames_total', 'Websocket frames received', 'counter', ('consumer', 'type'))
+frame_seconds = Metric('chat_websocket_frame_seconds', 'Time to handle a websocket frame', 'histogram', ('consumer', 'type'))
+group_send_seconds = Metric('chat_group_send_seconds', 'Channel layer group_send latency', 'histogram')
+layer_queue_depth = Metric(
+    'chat_channel_layer_queue_depth', "Messages waiting in this worker's channel layer queues", 'gauge', ('layer',),
+    collect=_layer_queue_depth
+)
+write_queue_depth = Metric(
+    'chat_message_write_queue_depth', 'Messages waiting for the write-behind writer', 'gauge',
+    collect=_write_queue_depth
+)
+db_in_flight = Metric('chat_db_threads_in_flight', 'database_sync_to_async calls waiting or running', 'gauge')
+db_wait_seconds = Metric('chat_db_thread_wait_seconds', 'Time database_sync_to_async calls wait for a thread', 'histogram')
+db_call_seconds = Metric('chat_db_call_seconds', 'Time database_sync_to_async calls run', 'histogram')
+upload_bytes = Metric('chat_upload_bytes_total', 'Bytes received in uploads', 'counter', ('kind',))
+
+
+def measure_group_send(layer):
+    """
+    Time every group_send of a channel layer (once per layer). Called from a
+    consumer, inside the server loop: some layers (redis_pubsub) resolve their
+    attributes per running loop, so the flag is read from the instance itself.
+    """
+    if layer is None or vars(layer).get('_group_send_measured', False):
+        return layer
+    group_send = layer.group_send
+
+    async def timed_group_send(group, message):
+        started = time.perf_counter()
+        try:
+            return await group_send(group, message)
+        finally:
+            group_send_seconds.observe(time.perf_counter() - started)
+
+    layer.group_send = timed_group_send
+    layer._group_send_measured = True
+    return layer
+
+
+class MeasuredConsumerMixin:
+    """Counts the connections and frames of a websocket consumer and times its frame handling"""
+
+    _connection_counted = False
+
+    async def websocket_connect(self, message):
+        measure_group_send(self.channel_layer)
+        await super().websocket_connect(message)
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol)
+        if not self._connection_counted:
+            self._connection_counted = True
+            connections.inc(consumer=type(self).__name__)
+
+    async def websocket_receive(self, message):
+        text = message.get('text')
+        if text is None:
+            frame_type = 'binary'
+        else:
+            match = _FRAME_TYPE.search(text, 0, 200)
+            frame_type = match.group(1) if match else ('other' if '"type"' in text else 'message')
+        started = time.perf_counter()
+        try:
+            await super().websocket_receive(message)
+        finally:
+            consumer = type(self).__name__
+            frames.inc(consumer=consumer, type=frame_type)
+            frame_seconds.observe(time.perf_counter() - started, consumer=consumer, type=frame_type)
+
+    async def websocket_disconnect(self, message):
+        try:
+            await super().websocket_disconnect(message)
+        finally:
+            if self._connection_counted:
+                self._connection_counted = False
+                connections.dec(consumer=type(self).__name__)
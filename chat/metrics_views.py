@@ -0,0 +1,32 @@
+"""
+Metrics endpoint for Prometheus (see chat/metrics.py).
+
+Scrapers authenticate with ``Authorization: Bearer <METRICS_TOKEN>``; staff
+users can open it in a browser.
+"""
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+from . import metrics
+
+TOKEN = getattr(settings, 'METRICS_TOKEN', '')
+
+
+def _authorized(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), TOKEN.encode())
+
+
+@require_GET
+def metrics_view(request):
+    """All workers' metrics in the Prometheus text format"""
+    if not _authorized(request):
+        return HttpResponseForbidden('Forbidden')
+    response = HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+    response['Cache-Control'] = 'no-store'
+    return response
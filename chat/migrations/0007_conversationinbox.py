@@ -0,0 +1,75 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_inbox(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationInbox = apps.get_model('chat', 'ConversationInbox')
+    Message = apps.get_model('chat', 'Message')
+
+    entries = []
+    for conversation in Conversation.objects.prefetch_related('participants'):
+        participant_ids = [p.id for p in conversation.participants.all()]
+        last_message = Message.objects.filter(conversation=conversation).order_by('-timestamp', '-id').first()
+        for user_id in participant_ids:
+            other_ids = [pid for pid in participant_ids if pid != user_id]
+            unread = Message.objects.filter(
+                conversation=conversation,
+                status__in=['sent', 'delivered']
+            ).exclude(sender_id=user_id).count()
+            if last_message is None:
+                preview = ''
+            elif last_message.is_deleted:
+                preview = 'This message was deleted'
+            else:
+                preview = (last_message.content or last_message.file_name)[:255]
+            entries.append(ConversationInbox(
+                user_id=user_id,
+                conversation_id=conversation.id,
+                other_user_id=other_ids[0] if other_ids else None,
+                last_message_id=last_message.id if last_message else None,
+                last_message_preview=preview,
+                last_message_sender_id=last_message.sender_id if last_message else None,
+                last_message_status=last_message.status if last_message else '',
+                last_message_at=last_message.timestamp if last_message else None,
+                unread_count=unread,
+                updated_at=conversation.updated_at,
+            ))
+    ConversationInbox.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0006_call'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_preview', models.CharField(blank=True, max_length=255)),
+                ('last_message_status', models.CharField(blank=True, max_length=10)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chat.conversation')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message')),
+                ('last_message_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('other_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at'],
+                'indexes': [models.Index(fields=['user', '-updated_at'], name='chat_inbox_user_updated_idx')],
+                'unique_together': {('user', 'conversation')},
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:25
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def close_duplicate_active_calls(apps, schema_editor):
+    """Keep only the newest live call per conversation so the unique constraint can be added"""
+    Call = apps.get_model('chat', 'Call')
+    seen = set()
+    active = Call.objects.filter(status__in=['initiated', 'ringing', 'accepted']).order_by('-initiated_at')
+    for call in active:
+        if call.conversation_id not in seen:
+            seen.add(call.conversation_id)
+            continue
+        call.status = 'ended' if call.status == 'accepted' else 'missed'
+        call.ended_at = timezone.now()
+        call.save(update_fields=['status', 'ended_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_calls, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(condition=models.Q(('status__in', ['initiated', 'ringing'])), fields=['initiated_at'], name='chat_call_ringing_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='call',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['initiated', 'ringing', 'accepted'])), fields=('conversation',), name='chat_call_one_active_per_conversation'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    # rowid is the message id; prefix indexes make "term*" lookups cheap
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "conversation_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO chat_message_fts (rowid, conversation_id, body) "
+    "SELECT id, conversation_id, trim(content || ' ' || file_name) FROM chat_message "
+    "WHERE is_deleted = 0 AND trim(content || ' ' || file_name) != ''",
+]
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gin',
+    'CREATE TABLE chat_message_search ('
+    'message_id bigint PRIMARY KEY REFERENCES chat_message (id) ON DELETE CASCADE, '
+    'conversation_id bigint NOT NULL, '
+    'document tsvector NOT NULL)',
+    "INSERT INTO chat_message_search (message_id, conversation_id, document) "
+    "SELECT id, conversation_id, to_tsvector('simple', concat_ws(' ', content, file_name)) FROM chat_message "
+    "WHERE NOT is_deleted AND trim(concat_ws(' ', content, file_name)) != ''",
+    # Conversation ids and terms are matched in one index scan
+    'CREATE INDEX chat_message_search_idx ON chat_message_search USING gin (conversation_id, document)',
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = POSTGRES_FORWARD if schema_editor.connection.vendor == 'postgresql' else SQLITE_FORWARD
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS chat_message_search')
+    else:
+        schema_editor.execute('DROP TABLE IF EXISTS chat_message_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_call_active_constraint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
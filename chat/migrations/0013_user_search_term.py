@@ -0,0 +1,72 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:31
+
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+TERM_MAX_LENGTH = 150
+
+
+# Frozen copy of chat.directory's normalization as of this migration
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())[:TERM_MAX_LENGTH]
+
+
+def user_terms(user):
+    first_name = normalize(user.first_name)
+    last_name = normalize(user.last_name)
+    terms = {normalize(user.username), first_name, last_name, normalize(f'{first_name} {last_name}')}
+    terms.discard('')
+    return terms
+
+
+def prepare_postgres(apps, schema_editor):
+    """Byte-order collation makes term ranges exact prefixes; trigrams serve substring matches"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE chat_usersearchterm ALTER COLUMN term TYPE varchar(150) COLLATE "C"')
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX chat_usersearchterm_trgm_idx ON chat_usersearchterm USING gin (term gin_trgm_ops)'
+    )
+
+
+def index_existing_users(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserSearchTerm = apps.get_model('chat', 'UserSearchTerm')
+    terms = []
+    for user in User.objects.only('username', 'first_name', 'last_name').iterator(chunk_size=BATCH_SIZE):
+        terms.extend(UserSearchTerm(user_id=user.id, term=term) for term in user_terms(user))
+        if len(terms) >= BATCH_SIZE:
+            UserSearchTerm.objects.bulk_create(terms)
+            terms = []
+    UserSearchTerm.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0012_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('term', 'user')},
+            },
+        ),
+        migrations.RunPython(prepare_postgres, migrations.RunPython.noop),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:46
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_attachment_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='thumbnail',
+            field=models.FileField(blank=True, db_index=True, null=True, upload_to=chat.models.message_thumbnail_path),
+        ),
+    ]
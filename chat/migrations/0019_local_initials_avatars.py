@@ -0,0 +1,25 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:48
+
+from django.db import migrations, models
+
+
+def clear_legacy_avatar_urls(apps, schema_editor):
+    # Generated avatars are now served locally (chat/initials_avatars.py)
+    UserProfile = apps.get_model('chat', 'UserProfile')
+    UserProfile.objects.filter(avatar_url__startswith='https://ui-avatars.com/').update(avatar_url='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_message_thumbnail_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar_url',
+            field=models.URLField(blank=True, help_text='Fallback avatar URL if no image is uploaded (default: generated initials)'),
+        ),
+        migrations.RunPython(clear_legacy_avatar_urls, migrations.RunPython.noop),
+    ]
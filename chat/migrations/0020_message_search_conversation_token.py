@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# The conversation is an indexed token (c<conversation_id>) in column conv, so
+# a search scoped to some conversations is one FTS5 query over both columns
+SQLITE_FORWARD = [
+    'DROP TABLE IF EXISTS chat_message_fts',
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "conv, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO chat_message_fts (rowid, conv, body) "
+    "SELECT id, 'c' || conversation_id, trim(content || ' ' || file_name) FROM chat_message "
+    "WHERE is_deleted = 0 AND trim(content || ' ' || file_name) != ''",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS chat_message_fts',
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "conversation_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO chat_message_fts (rowid, conversation_id, body) "
+    "SELECT id, conversation_id, trim(content || ' ' || file_name) FROM chat_message "
+    "WHERE is_deleted = 0 AND trim(content || ' ' || file_name) != ''",
+]
+
+
+def index_conversation_token(apps, schema_editor):
+    # Postgres already matches conversation ids in its GIN index
+    if schema_editor.connection.vendor != 'postgresql':
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+def unindex_conversation_token(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        for statement in SQLITE_BACKWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_local_initials_avatars'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_conversation_token, unindex_conversation_token),
+    ]
@@ -1,11 +1,12 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
-from PIL import Image
 import os
 import uuid
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
+from . import image_pipeline, initials_avatars
 
 def user_directory_path(instance, filename):
     """Upload profile pictures to MEDIA_ROOT/profiles/user_<id>/"""
@@ -18,12 +19,20 @@ def message_file_path(instance, filename):
     unique_filename = f"{uuid.uuid4().hex}.{ext}" if ext else str(uuid.uuid4().hex)
     return f'chat_files/conversation_{instance.conversation.id}/{unique_filename}'
 
+def message_thumbnail_path(instance, filename):
+    """Store image previews next to the attachments of their conversation"""
+    return f'chat_files/conversation_{instance.conversation_id}/thumbs/{uuid.uuid4().hex}.webp'
+
 def validate_file_size(value):
     """Validate uploaded file size (max 10MB)"""
     filesize = value.size
     if filesize > 10 * 1024 * 1024:  # 10MB
         raise ValidationError('File size cannot exceed 10MB')
 
+def _file_name(value):
+    """Stored name of a FileField value (a FieldFile, a plain string or None)"""
+    return getattr(value, 'name', value) or ''
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     avatar = models.ImageField(
@@ -33,10 +42,11 @@ class UserProfile(models.Model):
         help_text='Profile picture'
     )
     avatar_url = models.URLField(
-        default='https://ui-avatars.com/api/?background=random&name=User',
         blank=True,
-        help_text='Fallback avatar URL if no image is uploaded'
+        help_text='Fallback avatar URL if no image is uploaded (default: generated initials)'
     )
+    # SHA-256 of the uploaded avatar once its resized variants exist (see chat/image_pipeline.py)
+    avatar_hash = models.CharField(max_length=64, blank=True, editable=False)
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(default=timezone.now)
     bio = models.TextField(max_length=500, blank=True)
@@ -48,56 +58,49 @@ class UserProfile(models.Model):
     def display_name(self):
         return self.user.get_full_name() or self.user.username
     
-    def get_avatar_url(self):
-        """Get the avatar URL, prioritizing uploaded image over fallback URL"""
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_avatar = _file_name(instance.__dict__.get('avatar'))
+        return instance
+    
+    def get_avatar_url(self, size=None, image_format='webp'):
+        """Get the avatar URL, prioritizing uploaded image over fallback URL
+        
+        Processed uploads are served as the smallest variant covering size
+        pixels, in WebP or (image_format='jpeg') JPEG.
+        """
+        if self.avatar and self.avatar_hash:
+            variant = image_pipeline.avatar_variant_name(self.avatar_hash, image_pipeline.variant_size(size), image_format)
+            return self.avatar.storage.url(variant)
         if self.avatar and hasattr(self.avatar, 'url'):
             return self.avatar.url
         elif self.avatar_url:
             return self.avatar_url
         else:
-            # Generate default avatar URL with user's name and consistent color
-            name = self.display_name.replace(' ', '+')
-            import hashlib
-            username_hash = hashlib.md5(self.user.username.encode()).hexdigest()
-            bg_color = username_hash[:6]  # Use first 6 chars as hex color
-            return f'https://ui-avatars.com/api/?background={bg_color}&color=ffffff&name={name}&size=128&font-size=0.33'
+            # Initials in a colour derived from the username, rendered by this site
+            return initials_avatars.avatar_url(self.user.username, self.display_name, size)
     
     def save(self, *args, **kwargs):
-        """Override save to process uploaded images"""
-        # Set default avatar_url if not set or if it's still the generic default
-        if not self.avatar_url or self.avatar_url == 'https://ui-avatars.com/api/?background=random&name=User':
-            name = self.display_name.replace(' ', '+')
-            # Use a consistent background color based on username for better UX
-            import hashlib
-            username_hash = hashlib.md5(self.user.username.encode()).hexdigest()
-            bg_color = username_hash[:6]  # Use first 6 chars as hex color
-            self.avatar_url = f'https://ui-avatars.com/api/?background={bg_color}&color=ffffff&name={name}&size=128&font-size=0.33'
+        """Override save to queue a changed avatar for background processing"""
+        update_fields = kwargs.get('update_fields')
+        avatar_changed = (
+            _file_name(self.avatar) != getattr(self, '_loaded_avatar', '')
+            and (update_fields is None or 'avatar' in update_fields)
+        )
+        if avatar_changed:
+            self.avatar_hash = ''
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'avatar_hash'}
         
         super().save(*args, **kwargs)
         
-        # Process uploaded image only if there's an actual file
-        if self.avatar and hasattr(self.avatar, 'path') and self.avatar.name:
-            try:
-                self.resize_avatar()
-            except Exception as e:
-                print(f"Error processing avatar for user {self.user.username}: {e}")
-    
-    def resize_avatar(self):
-        """Resize uploaded avatar to reasonable dimensions"""
-        try:
-            img = Image.open(self.avatar.path)
-            
-            # Convert RGBA to RGB if necessary
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-            
-            # Resize image if it's too large
-            max_size = (300, 300)
-            if img.height > max_size[0] or img.width > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                img.save(self.avatar.path, quality=90, optimize=True)
-        except Exception as e:
-            print(f"Error processing avatar for user {self.user.username}: {e}")
+        if avatar_changed:
+            self._loaded_avatar = _file_name(self.avatar)
+            if self.avatar:
+                # Unchanged avatars are never reprocessed; new ones are resized off the request path
+                profile_id = self.id
+                transaction.on_commit(lambda: image_pipeline.submit(image_pipeline.process_avatar, profile_id))
     
     def delete_avatar(self):
         """Delete the uploaded avatar file"""
@@ -110,6 +113,18 @@ class UserProfile(models.Model):
             self.avatar = None
             self.save()
 
+class UserSearchTerm(models.Model):
+    """One normalized name fragment of a user, for indexed prefix search (see chat/directory.py)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=150)
+    
+    class Meta:
+        # (term, user) doubles as the prefix index: range scans return user ids from the index alone
+        unique_together = ['term', 'user']
+    
+    def __str__(self):
+        return f"{self.term} -> {self.user_id}"
+
 class Conversation(models.Model):
     participants = models.ManyToManyField(User, related_name='conversations')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -128,6 +143,17 @@ class Conversation(models.Model):
     def other_participant(self, user):
         return self.participants.exclude(id=user.id).first()
 
+class Blob(models.Model):
+    """An attachment file stored once by content and shared by every message that sent it (see chat/blobs.py)"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)  # Storage name, chat_files/blobs/<sha[:2]>/<sha>.<ext>
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)  # Messages pointing at it; reclaimed at 0
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Blob {self.sha256[:12]} ({self.ref_count} references)"
+
 class Message(models.Model):
     MESSAGE_STATUS_CHOICES = [
         ('sent', 'Sent'),
@@ -149,6 +175,7 @@ class Message(models.Model):
     # File attachment fields
     file = models.FileField(
         upload_to=message_file_path,
+        max_length=255,
         null=True,
         blank=True,
         validators=[
@@ -173,8 +200,17 @@ class Message(models.Model):
     )
     file_name = models.CharField(max_length=255, blank=True)  # Original filename
     file_size = models.PositiveIntegerField(null=True, blank=True)  # File size in bytes
+    # Shared content-addressed file; file then names the blob's path
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='messages')
     
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Image previews so clients can lay out before the full image loads (see chat/image_pipeline.py)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(upload_to=message_thumbnail_path, null=True, blank=True, db_index=True)
+    placeholder = models.TextField(blank=True)  # Tiny blurred data: URI (LQIP)
+    
+    # A default rather than auto_now_add so write-behind can keep the broadcast timestamp
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     status = models.CharField(max_length=10, choices=MESSAGE_STATUS_CHOICES, default='sent')
     is_edited = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
@@ -184,6 +220,10 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination over a conversation's history
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conv_ts_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
@@ -228,6 +268,15 @@ class Message(models.Model):
         file_ext = self.file.name.split('.')[-1].lower() if '.' in self.file.name else ''
         return file_ext in image_extensions
     
+    def attachment_preview(self):
+        """Dimensions, thumbnail and placeholder of an image attachment (None until known)"""
+        return {
+            'image_width': self.image_width,
+            'image_height': self.image_height,
+            'thumbnail_url': self.thumbnail.url if self.thumbnail else None,
+            'placeholder': self.placeholder or None,
+        }
+    
     @property
     def file_extension(self):
         """Get file extension"""
@@ -293,8 +342,27 @@ class Message(models.Model):
             if not self.file_size:
                 self.file_size = self.file.size
         
+        if self.pk is None and settings.MESSAGE_WRITE_BEHIND:
+            # Share the snowflake id space with queued messages so ids never collide
+            from .snowflake import next_id
+            self.pk = next_id()
+            kwargs.setdefault('force_insert', True)
+        
         super().save(*args, **kwargs)
 
+class ReadWatermark(models.Model):
+    """Highest message id a user has read in a conversation"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_watermarks')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_watermarks')
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'conversation']
+    
+    def __str__(self):
+        return f"{self.user.username} read conversation {self.conversation_id} up to {self.last_read_id}"
+
 class TypingStatus(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -379,8 +447,26 @@ class Call(models.Model):
     # WebRTC session data
     session_data = models.JSONField(default=dict, blank=True)
     
+    ACTIVE_STATUSES = ['initiated', 'ringing', 'accepted']
+    
     class Meta:
         ordering = ['-initiated_at']
+        constraints = [
+            # At most one live call per conversation; also indexes the "already in progress" check
+            models.UniqueConstraint(
+                fields=['conversation'],
+                condition=models.Q(status__in=['initiated', 'ringing', 'accepted']),
+                name='chat_call_one_active_per_conversation',
+            ),
+        ]
+        indexes = [
+            # Ringing calls by age, for the expire_calls sweeper
+            models.Index(
+                fields=['initiated_at'],
+                condition=models.Q(status__in=['initiated', 'ringing']),
+                name='chat_call_ringing_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.get_call_type_display()} call from {self.caller.username} to {self.callee.username}"
@@ -399,19 +485,25 @@ class Call(models.Model):
         else:
             return f"{minutes:02d}:{seconds:02d}"
     
+    def _answer(self, status, **fields):
+        """Move a ringing call to status; False if it was already answered, missed or ended"""
+        # Conditional update: of an accept, a reject and the ring timeout, exactly one wins
+        changed = Call.objects.filter(pk=self.pk, status__in=['initiated', 'ringing']).update(status=status, **fields)
+        if not changed:
+            self.refresh_from_db(fields=['status', 'accepted_at', 'ended_at'])
+            return False
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+    
     def accept_call(self):
         """Mark call as accepted"""
-        if self.status in ['initiated', 'ringing']:
-            self.status = 'accepted'
-            self.accepted_at = timezone.now()
-            self.save()
+        return self._answer('accepted', accepted_at=timezone.now())
     
     def reject_call(self):
         """Mark call as rejected"""
-        if self.status in ['initiated', 'ringing']:
-            self.status = 'rejected'
-            self.ended_at = timezone.now()
-            self.save()
+        return self._answer('rejected', ended_at=timezone.now())
     
     def end_call(self):
         """End an active call and calculate duration"""
@@ -428,7 +520,50 @@ class Call(models.Model):
     
     def mark_as_missed(self):
         """Mark call as missed"""
-        if self.status in ['initiated', 'ringing']:
-            self.status = 'missed'
-            self.ended_at = timezone.now()
-            self.save()
+        return self._answer('missed', ended_at=timezone.now())
+
+class ConversationInbox(models.Model):
+    """Denormalized per-user sidebar row for a conversation"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='inbox_entries')
+    other_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    # Snapshot of the latest message in the conversation
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_status = models.CharField(max_length=10, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['user', 'conversation']
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='chat_inbox_user_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Inbox entry for {self.user.username} in conversation {self.conversation_id}"
+
+class UploadSession(models.Model):
+    """A chunked attachment upload in progress (see chat/uploads.py)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)  # Original filename
+    file_size = models.PositiveBigIntegerField()  # Declared total size in bytes
+    path = models.CharField(max_length=255)  # Storage name the chunks are appended to; moved into a Blob on finalize
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='chat_upload_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Upload of {self.file_name} by {self.user.username} ({self.received}/{self.file_size})"
@@ -0,0 +1,233 @@
+"""
+Presence tracking shared by ChatConsumer and UserConsumer.
+
+Every open socket registers its channel name under the user. The user is
+online while at least one socket is registered, so closing one of several
+tabs no longer flaps them offline. Sockets send periodic heartbeats and a
+sweeper drops sockets whose heartbeat is older than PRESENCE_HEARTBEAT_TTL,
+which covers workers that died without running disconnect(). A socket
+that was swept but is still alive registers again with its next heartbeat.
+
+The database is only written on real transitions (first socket opened,
+last socket gone), and the change is published once to each contact's
+``user_<id>`` group instead of to every conversation room.
+
+Two stores are available: a process-local one for the in-memory channel
+layer, and a Redis hash per user for multi-worker deployments.
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Conversation, UserProfile
+from .query_stats import database_sync_to_async
+
+HEARTBEAT_TTL = getattr(settings, 'PRESENCE_HEARTBEAT_TTL', 90)
+SWEEP_INTERVAL = getattr(settings, 'PRESENCE_SWEEP_INTERVAL', 30)
+
+
+class LocalPresenceStore:
+    """Connection refcounts kept in this process only"""
+
+    def __init__(self):
+        self._channels = defaultdict(dict)
+
+    async def connect(self, user_id, channel_name):
+        channels = self._channels[user_id]
+        channels[channel_name] = time.time()
+        return len(channels) == 1
+
+    async def disconnect(self, user_id, channel_name):
+        channels = self._channels.get(user_id)
+        if not channels or channels.pop(channel_name, None) is None:
+            return False
+        if channels:
+            return False
+        del self._channels[user_id]
+        return True
+
+    async def heartbeat(self, user_id, channel_name):
+        """Refresh a socket, registering it again if the sweeper dropped it; True if that brought the user online"""
+        channels = self._channels[user_id]
+        known = channel_name in channels
+        channels[channel_name] = time.time()
+        return not known and len(channels) == 1
+
+    async def is_online(self, user_id):
+        return bool(self._channels.get(user_id))
+
+    async def expire(self, ttl):
+        """Drop stale sockets and return the users that went offline"""
+        cutoff = time.time() - ttl
+        offline = []
+        for user_id in list(self._channels):
+            channels = self._channels[user_id]
+            for channel_name, seen in list(channels.items()):
+                if seen < cutoff:
+                    del channels[channel_name]
+            if not channels:
+                del self._channels[user_id]
+                offline.append(user_id)
+        return offline
+
+
+class RedisPresenceStore:
+    """Connection refcounts in a Redis hash per user, shared by all workers"""
+
+    # Sockets of the user after re-registering a missing one, 0 if it was registered
+    HEARTBEAT_SCRIPT = """
+local known = redis.call('HEXISTS', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if known == 1 then
+    return 0
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+    def __init__(self, url, prefix):
+        self.url = url
+        self.prefix = f'{prefix}:presence:'
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    def _key(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    async def connect(self, user_id, channel_name):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(user_id), channel_name, time.time())
+            pipe.hlen(self._key(user_id))
+            _, count = await pipe.execute()
+        return count == 1
+
+    async def disconnect(self, user_id, channel_name):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._key(user_id), channel_name)
+            pipe.hlen(self._key(user_id))
+            removed, count = await pipe.execute()
+        return removed == 1 and count == 0
+
+    async def heartbeat(self, user_id, channel_name):
+        # One script, so a concurrent disconnect or sweep cannot interleave
+        count = await self.client.eval(self.HEARTBEAT_SCRIPT, 1, self._key(user_id), channel_name, time.time())
+        return count == 1
+
+    async def is_online(self, user_id):
+        return await self.client.hlen(self._key(user_id)) > 0
+
+    async def expire(self, ttl):
+        cutoff = time.time() - ttl
+        offline = []
+        async for key in self.client.scan_iter(match=f'{self.prefix}*', count=500):
+            stale = [
+                channel_name
+                for channel_name, seen in (await self.client.hgetall(key)).items()
+                if float(seen) < cutoff
+            ]
+            if not stale:
+                continue
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hdel(key, *stale)
+                pipe.hlen(key)
+                removed, count = await pipe.execute()
+            if removed and count == 0:
+                key = key.decode() if isinstance(key, bytes) else key
+                offline.append(int(key[len(self.prefix):]))
+        return offline
+
+
+def _build_store():
+    backend = getattr(settings, 'PRESENCE_BACKEND', 'local')
+    if backend == 'redis':
+        return RedisPresenceStore(settings.REDIS_URL, getattr(settings, 'CHANNEL_LAYER_PREFIX', 'chat'))
+    return LocalPresenceStore()
+
+
+store = _build_store()
+_sweeper = None
+
+
+@database_sync_to_async
+def _record_transition(user_id, is_online):
+    """Persist an online/offline transition and return the user's contact ids"""
+    fields = {'is_online': is_online}
+    if not is_online:
+        fields['last_seen'] = timezone.now()
+    UserProfile.objects.filter(user_id=user_id).update(**fields)
+
+    return list(
+        Conversation.participants.through.objects
+        .filter(conversation__participants=user_id)
+        .exclude(user_id=user_id)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+async def publish(channel_layer, user_id, username, is_online):
+    """Write the transition once and tell every contact about it"""
+    contact_ids = await _record_transition(user_id, is_online)
+    event = {
+        'type': 'user_status',
+        'user_id': user_id,
+        'username': username,
+        'is_online': is_online
+    }
+    for contact_id in contact_ids:
+        await channel_layer.group_send(f'user_{contact_id}', event)
+
+
+async def user_connected(channel_layer, user, channel_name):
+    """Register a socket; publishes 'online' only for the user's first socket"""
+    _ensure_sweeper(channel_layer)
+    if await store.connect(user.id, channel_name):
+        await publish(channel_layer, user.id, user.username, True)
+
+
+async def user_disconnected(channel_layer, user, channel_name):
+    """Unregister a socket; publishes 'offline' only when the last one closes"""
+    if await store.disconnect(user.id, channel_name):
+        await publish(channel_layer, user.id, user.username, False)
+
+
+async def heartbeat(channel_layer, user, channel_name):
+    """Keep a socket registered; one the sweeper expired while still connected is put back online"""
+    if await store.heartbeat(user.id, channel_name):
+        await publish(channel_layer, user.id, user.username, True)
+
+
+async def sweep(channel_layer, ttl=HEARTBEAT_TTL):
+    """Expire sockets that stopped sending heartbeats"""
+    from django.contrib.auth.models import User
+
+    for user_id in await store.expire(ttl):
+        username = await database_sync_to_async(
+            lambda: User.objects.filter(id=user_id).values_list('username', flat=True).first()
+        )()
+        await publish(channel_layer, user_id, username or '', False)
+
+
+async def _sweep_forever(channel_layer):
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep(channel_layer)
+        except Exception as e:
+            print(f"Presence sweep failed: {e}")
+
+
+def _ensure_sweeper(channel_layer):
+    """Start the heartbeat sweeper once per event loop"""
+    global _sweeper
+    loop = asyncio.get_running_loop()
+    if _sweeper is None or _sweeper.done() or _sweeper.get_loop() is not loop:
+        _sweeper = loop.create_task(_sweep_forever(channel_layer))
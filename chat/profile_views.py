@@ -2,10 +2,13 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
 from django.views.decorators.http import require_http_methods
+from django.utils.http import parse_etags
+from . import initials_avatars, metrics
 from .models import UserProfile
 import json
+import re
 
 @login_required
 def profile_view(request, user_id=None):
@@ -72,6 +75,7 @@ def upload_avatar(request):
             return JsonResponse({'error': 'No file uploaded'}, status=400)
         
         avatar_file = request.FILES['avatar']
+        metrics.upload_bytes.inc(avatar_file.size, kind='avatar')
         
         # Validate file type
         allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif']
@@ -154,3 +158,31 @@ def update_profile_ajax(request):
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
         return JsonResponse({'error': f'Update failed: {str(e)}'}, status=500)
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def initials_avatar(request, colour, letters, size, image_format):
+    """A rendered initials avatar; everything it shows is in the URL"""
+    if (
+        not re.fullmatch(r'[0-9a-f]{6}', colour)
+        or not initials_avatars.valid_initials(letters)
+        or size not in initials_avatars.SIZES
+        or image_format not in initials_avatars.CONTENT_TYPES
+    ):
+        raise Http404('Unknown avatar')
+    
+    content, etag = initials_avatars.get_avatar(colour, letters, size, image_format)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=initials_avatars.CONTENT_TYPES[image_format])
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=604800'
+    return response
+
+@login_required
+def user_avatar(request, user_id):
+    """Redirect to a user's current avatar (?size= pixels), for scripts that only know the id"""
+    profile = get_object_or_404(UserProfile.objects.select_related('user'), user_id=user_id)
+    size = request.GET.get('size')
+    return redirect(profile.get_avatar_url(size=int(size) if size and size.isdigit() else None))
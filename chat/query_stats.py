@@ -0,0 +1,235 @@
+"""
+Opt-in database query instrumentation (settings.QUERY_STATS).
+
+Every HTTP request (QueryStatsMiddleware) and every websocket frame
+(consumer methods decorated with instrument_frame) gets a QueryStats that
+counts its queries and their total time through connection.execute_wrapper.
+SQL is recorded with its placeholders, so the same statement run over and
+over with different parameters, the shape of an N+1 loop, shows up as one
+template with a count. Queries slower than QUERY_STATS_SLOW_MS are kept with
+their time.
+
+Websocket frames run their queries in database_sync_to_async threads. The
+frame's QueryStats travels there in a context variable, so the consumers
+import database_sync_to_async from this module instead of channels.db; it
+behaves the same when no frame is being measured, and also feeds the
+database thread metrics (chat/metrics.py).
+
+Each request or frame prints one ``query_stats {json}`` line and is added to
+a per-process summary(). With DEBUG, HTTP responses also carry X-DB-Queries,
+X-DB-Time (ms), X-DB-Duplicates and a Server-Timing entry. ``python manage.py
+query_report`` aggregates logged lines, or measures given URLs in its own
+process.
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import Counter
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics
+
+ENABLED = getattr(settings, 'QUERY_STATS', False)
+SLOW_MS = getattr(settings, 'QUERY_STATS_SLOW_MS', 100)
+# A statement run this many times in one request or frame is reported as a likely N+1
+DUPLICATE_THRESHOLD = 3
+MAX_REPORTED = 5
+SQL_LENGTH = 300
+
+_current = contextvars.ContextVar('query_stats', default=None)
+# When the database_sync_to_async call being run was made (see chat/metrics.py)
+_queued_at = contextvars.ContextVar('query_stats_queued_at')
+_totals = {}
+_lock = threading.Lock()
+
+
+class QueryStats:
+    """Queries of one request or frame; an execute_wrapper"""
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.time = 0.0
+        self.templates = Counter()
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            self.templates[sql] += 1
+            if elapsed * 1000 >= SLOW_MS and len(self.slow) < MAX_REPORTED:
+                self.slow.append((elapsed, sql))
+
+    @property
+    def duplicates(self):
+        """Queries that repeated an earlier statement"""
+        return sum(count - 1 for count in self.templates.values() if count > 1)
+
+    def repeated(self):
+        """(sql, count) of statements run at least DUPLICATE_THRESHOLD times, most frequent first"""
+        return [
+            (sql, count) for sql, count in self.templates.most_common(MAX_REPORTED)
+            if count >= DUPLICATE_THRESHOLD
+        ]
+
+    def as_dict(self):
+        return {
+            'endpoint': self.label,
+            'queries': self.count,
+            'db_ms': round(self.time * 1000, 2),
+            'duplicates': self.duplicates,
+            'repeated': [{'sql': sql[:SQL_LENGTH], 'count': count} for sql, count in self.repeated()],
+            'slow': [{'ms': round(elapsed * 1000, 2), 'sql': sql[:SQL_LENGTH]} for elapsed, sql in self.slow],
+        }
+
+
+def record(entry):
+    """Add one request or frame (an as_dict() entry) to this process's summary"""
+    with _lock:
+        totals = _totals.setdefault(entry['endpoint'], {
+            'calls': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'db_ms': 0.0,
+            'duplicates': 0,
+            'slow': 0,
+            'slowest': None,
+            'repeated': Counter(),
+        })
+        totals['calls'] += 1
+        totals['queries'] += entry['queries']
+        totals['max_queries'] = max(totals['max_queries'], entry['queries'])
+        totals['db_ms'] += entry['db_ms']
+        totals['duplicates'] += entry['duplicates']
+        totals['slow'] += len(entry['slow'])
+        for slow in entry['slow']:
+            if totals['slowest'] is None or slow['ms'] > totals['slowest']['ms']:
+                totals['slowest'] = slow
+        for repeated in entry['repeated']:
+            totals['repeated'][repeated['sql']] += repeated['count']
+
+
+def summary():
+    """{endpoint: totals} of everything recorded in this process"""
+    with _lock:
+        return {endpoint: dict(totals, repeated=Counter(totals['repeated'])) for endpoint, totals in _totals.items()}
+
+
+def reset():
+    with _lock:
+        _totals.clear()
+
+
+def finish(stats):
+    """Log and record a finished request or frame"""
+    entry = stats.as_dict()
+    print(f"query_stats {json.dumps(entry)}")
+    record(entry)
+    return entry
+
+
+class QueryStatsMiddleware:
+    """Measure the queries of every HTTP request; first in MIDDLEWARE so sessions and auth count too"""
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats(request.method)
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        # View names, not paths, so ids in URLs do not split an endpoint
+        stats.label = f'{request.method} {match.view_name if match else "unresolved"}'
+        finish(stats)
+
+        if settings.DEBUG:
+            db_ms = stats.time * 1000
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time'] = f'{db_ms:.2f}'
+            response['X-DB-Duplicates'] = str(stats.duplicates)
+            response['Server-Timing'] = f'db;dur={db_ms:.2f};desc="{stats.count} queries"'
+        return response
+
+
+def _frame_type(method, args, kwargs):
+    text_data = kwargs.get('text_data', args[0] if args else None)
+    if isinstance(text_data, str):
+        try:
+            return json.loads(text_data).get('type', 'message')
+        except (ValueError, AttributeError):
+            return 'invalid'
+    return method.__name__
+
+
+def instrument_frame(method):
+    """Measure the queries of a consumer method (receive: per frame type)"""
+
+    @functools.wraps(method)
+    async def wrapper(consumer, *args, **kwargs):
+        if not ENABLED or _current.get() is not None:
+            # Off, or already measured by an overriding method that called super()
+            return await method(consumer, *args, **kwargs)
+        stats = QueryStats(f'WS {type(consumer).__name__}.{_frame_type(method, args, kwargs)}')
+        token = _current.set(stats)
+        try:
+            return await method(consumer, *args, **kwargs)
+        finally:
+            _current.reset(token)
+            finish(stats)
+
+    return wrapper
+
+
+def _measured(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Runs in the database thread, inside a copy of the awaiting frame's context
+        started = time.perf_counter()
+        metrics.db_wait_seconds.observe(started - _queued_at.get(started))
+        stats = _current.get()
+        try:
+            if stats is None:
+                return func(*args, **kwargs)
+            with connection.execute_wrapper(stats):
+                return func(*args, **kwargs)
+        finally:
+            metrics.db_call_seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class InstrumentedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    database_sync_to_async that counts its queries towards the frame being
+    measured, and reports how long calls queue for the database thread
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        super().__init__(_measured(func), *args, **kwargs)
+
+    async def __call__(self, *args, **kwargs):
+        metrics.db_in_flight.inc()
+        token = _queued_at.set(time.perf_counter())
+        try:
+            return await super().__call__(*args, **kwargs)
+        finally:
+            _queued_at.reset(token)
+            metrics.db_in_flight.dec()
+
+
+database_sync_to_async = InstrumentedDatabaseSyncToAsync
@@ -0,0 +1,55 @@
+"""
+Bulk read receipts.
+
+Instead of saving every unread message one by one, a reader advances a
+per-conversation watermark and all messages up to it are flipped to
+``read`` with a single UPDATE.
+"""
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Message, ReadWatermark
+from . import inbox
+
+
+def mark_read_up_to(conversation, user, up_to_id=None):
+    """Mark every message from other participants with id <= up_to_id as read
+    
+    When ``up_to_id`` is omitted the newest message of the conversation is
+    used. A client-supplied id is lowered to the newest such message at or
+    below it, so an id past the end cannot pin the watermark. Returns the new
+    watermark, or None when it did not move (so callers can skip broadcasting
+    a no-op receipt).
+    """
+    others = Message.objects.filter(conversation=conversation).exclude(sender=user)
+    candidates = others
+    if up_to_id is not None:
+        # Ids past a signed 64-bit integer cannot be compared by the database
+        candidates = others.filter(id__lte=min(int(up_to_id), 2 ** 63 - 1))
+    up_to_id = candidates.aggregate(last_id=Max('id'))['last_id']
+    if not up_to_id:
+        return None
+    
+    advanced = ReadWatermark.objects.filter(
+        user=user,
+        conversation=conversation,
+        last_read_id__lt=up_to_id
+    ).update(last_read_id=up_to_id, updated_at=timezone.now())
+    if not advanced:
+        watermark, created = ReadWatermark.objects.get_or_create(
+            user=user,
+            conversation=conversation,
+            defaults={'last_read_id': up_to_id}
+        )
+        if not created:
+            return None
+    
+    unread = others.filter(status__in=['sent', 'delivered'])
+    unread.filter(id__lte=up_to_id).update(status='read')
+    inbox.mark_inbox_read(
+        conversation,
+        user,
+        up_to_id=up_to_id,
+        unread_count=unread.filter(id__gt=up_to_id).count()
+    )
+    return up_to_id
@@ -0,0 +1,228 @@
+"""
+Full-text search over chat messages.
+
+Messages are indexed in a table of their own that every write path changing
+searchable text keeps in sync, next to the inbox update: new messages (socket,
+file upload, write-behind batches), edits, deletes, restores and conversation
+deletion. Deleted messages are dropped from the index. ``python manage.py
+rebuild_search_index`` rebuilds it from the messages table.
+
+Backends, chosen by the database vendor:
+    sqlite   - FTS5 table chat_message_fts (rowid = message id) with the
+               conversation as an indexed token, c<conversation_id>
+    postgres - chat_message_search, a tsvector per message with a GIN index
+               on (conversation_id, document) (btree_gin)
+
+Results are newest first and keyset paginated on the message id, so a page
+costs no OFFSET or COUNT. Both backends only look at matches inside the
+searching user's conversations: the conversation ids are part of the index
+query, not a filter applied to the matches afterwards.
+"""
+import html
+import re
+
+from django.db import connection
+
+from .models import Conversation, Message
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_TERMS = 8
+SNIPPET_WORDS = 16
+REBUILD_BATCH_SIZE = 5000
+
+# Highlight markers that cannot be confused with HTML; replaced after escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+_TERM = re.compile(r'\w+')
+
+
+def document_text(message):
+    """Searchable text of a message: its content and attachment name"""
+    return ' '.join(part for part in (message.content, message.file_name) if part)
+
+
+def parse_query(text):
+    """Split user input into plain word terms; operators and quotes are ignored"""
+    return _TERM.findall((text or '').lower())[:MAX_TERMS]
+
+
+def _is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def _insert(cursor, messages):
+    rows = [
+        (message.id, message.conversation_id, document_text(message))
+        for message in messages
+        if not message.is_deleted and document_text(message)
+    ]
+    if not rows:
+        return
+    if _is_postgres():
+        cursor.executemany(
+            "INSERT INTO chat_message_search (message_id, conversation_id, document) "
+            "VALUES (%s, %s, to_tsvector('simple', %s)) "
+            "ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document",
+            rows
+        )
+    else:
+        cursor.executemany(
+            'INSERT INTO chat_message_fts (rowid, conv, body) VALUES (%s, %s, %s)',
+            [(message_id, _conversation_token(conversation_id), body) for message_id, conversation_id, body in rows]
+        )
+
+
+def _delete(cursor, message_ids):
+    if not message_ids:
+        return
+    if _is_postgres():
+        cursor.execute(f'DELETE FROM chat_message_search WHERE message_id IN ({_in(message_ids)})', message_ids)
+    else:
+        cursor.execute(f'DELETE FROM chat_message_fts WHERE rowid IN ({_in(message_ids)})', message_ids)
+
+
+def record_new_message(message):
+    """Index a freshly created message"""
+    record_new_messages([message])
+
+
+def record_new_messages(messages):
+    """Index freshly created messages in one statement"""
+    with connection.cursor() as cursor:
+        _insert(cursor, messages)
+
+
+def message_changed(message):
+    """Re-index a message after an edit, delete or restore"""
+    with connection.cursor() as cursor:
+        _delete(cursor, [message.id])
+        _insert(cursor, [message])
+
+
+def conversation_deleted(conversation):
+    """Drop a conversation's messages from the index; call before deleting them"""
+    # By message id, the key of both index tables
+    table, key = ('chat_message_search', 'message_id') if _is_postgres() else ('chat_message_fts', 'rowid')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {key} IN (SELECT id FROM chat_message WHERE conversation_id = %s)',
+            [conversation.id]
+        )
+
+
+def rebuild_index(batch_size=REBUILD_BATCH_SIZE):
+    """Rebuild the whole index from the messages table in id order; returns the messages indexed"""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM chat_message_search' if _is_postgres() else 'DELETE FROM chat_message_fts')
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Message.objects.filter(id__gt=last_id, is_deleted=False)
+            .order_by('id')
+            .only('id', 'conversation_id', 'content', 'file_name', 'is_deleted')[:batch_size]
+        )
+        if not batch:
+            return indexed
+        with connection.cursor() as cursor:
+            _insert(cursor, batch)
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+
+def render_snippet(raw):
+    """Escape a highlighted snippet and turn the markers into <mark> tags"""
+    return html.escape(raw).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _in(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _conversation_token(conversation_id):
+    return f'c{conversation_id}'
+
+
+def _search_sqlite(terms, conversation_ids, before_id, limit):
+    # One of the conversations and every term must match; the last term is a prefix so
+    # results follow the user's typing
+    conversations = ' OR '.join(_conversation_token(conversation_id) for conversation_id in conversation_ids)
+    words = ' '.join(f'"{term}"' for term in terms) + '*'
+    match = f'conv:({conversations}) AND body:({words})'
+    sql = (
+        'SELECT rowid, snippet(chat_message_fts, 1, %s, %s, %s, %s) FROM chat_message_fts '
+        'WHERE chat_message_fts MATCH %s'
+    )
+    params = [MARK_START, MARK_END, '…', SNIPPET_WORDS, match]
+    if before_id is not None:
+        sql += ' AND rowid < %s'
+        params.append(before_id)
+    sql += ' ORDER BY rowid DESC LIMIT %s'
+    return sql, params + [limit]
+
+
+def _search_postgres(terms, conversation_ids, before_id, limit):
+    query = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+    headline_options = (
+        f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=5, '
+        'MaxFragments=1, FragmentDelimiter=" … "'
+    )
+    # Headlines are computed for the page only, not for every match
+    sql = (
+        "SELECT hit.message_id, ts_headline('simple', concat_ws(' ', m.content, m.file_name), "
+        "to_tsquery('simple', %s), %s) "
+        "FROM (SELECT message_id FROM chat_message_search "
+        f"WHERE conversation_id IN ({_in(conversation_ids)}) AND document @@ to_tsquery('simple', %s)"
+    )
+    params = [query, headline_options, *conversation_ids, query]
+    if before_id is not None:
+        sql += ' AND message_id < %s'
+        params.append(before_id)
+    sql += (
+        ' ORDER BY message_id DESC LIMIT %s) hit '
+        'JOIN chat_message m ON m.id = hit.message_id ORDER BY hit.message_id DESC'
+    )
+    return sql, params + [limit]
+
+
+def search_messages(user, text, conversation_id=None, before_id=None, limit=PAGE_SIZE):
+    """
+    Search the messages of conversations the user participates in, newest first.
+
+    Returns (results, next_before_id); each result is {'message': Message,
+    'snippet': html}. next_before_id is the cursor of the next page, or None
+    when this was the last one.
+    """
+    terms = parse_query(text)
+    if not terms:
+        return [], None
+
+    conversations = Conversation.participants.through.objects.filter(user_id=user.id)
+    if conversation_id is not None:
+        conversations = conversations.filter(conversation_id=conversation_id)
+    conversation_ids = list(conversations.values_list('conversation_id', flat=True))
+    if not conversation_ids:
+        return [], None
+
+    build = _search_postgres if _is_postgres() else _search_sqlite
+    # One extra row tells whether there is another page
+    sql, params = build(terms, conversation_ids, before_id, limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        hits = cursor.fetchall()
+
+    # The cursor follows the index, even past rows filtered out below
+    next_before_id = hits[limit - 1][0] if len(hits) > limit else None
+    hits = hits[:limit]
+    messages = Message.objects.select_related('sender').in_bulk([message_id for message_id, _ in hits])
+    results = [
+        {'message': messages[message_id], 'snippet': render_snippet(snippet or '')}
+        # Rows of messages deleted behind the index's back (e.g. cascades) are skipped
+        for message_id, snippet in hits
+        if message_id in messages and not messages[message_id].is_deleted
+    ]
+    return results, next_before_id
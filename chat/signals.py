@@ -1,21 +1,19 @@
-from django.db.models.signals import post_save
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import Message, UserProfile
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Automatically create a UserProfile when a new User is created"""
     if created:
-        import hashlib
-        name = (instance.get_full_name() or instance.username).replace(' ', '+')
-        username_hash = hashlib.md5(instance.username.encode()).hexdigest()
-        bg_color = username_hash[:6]
-        
-        UserProfile.objects.create(
-            user=instance,
-            avatar_url=f'https://ui-avatars.com/api/?background={bg_color}&color=ffffff&name={name}&size=128&font-size=0.33'
-        )
+        # The default avatar is derived from the user on display (see chat/initials_avatars.py)
+        UserProfile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
@@ -24,12 +22,45 @@ def save_user_profile(sender, instance, **kwargs):
         instance.userprofile.save()
     else:
         # Create profile if it doesn't exist
-        import hashlib
-        name = (instance.get_full_name() or instance.username).replace(' ', '+')
-        username_hash = hashlib.md5(instance.username.encode()).hexdigest()
-        bg_color = username_hash[:6]
-        
-        UserProfile.objects.create(
-            user=instance,
-            avatar_url=f'https://ui-avatars.com/api/?background={bg_color}&color=ffffff&name={name}&size=128&font-size=0.33'
-        )
+        UserProfile.objects.create(user=instance)
+
+@receiver(post_save, sender=User)
+def index_user_directory(sender, instance, update_fields=None, **kwargs):
+    """Keep the user search terms in step with the names (not on every last_login update)"""
+    if update_fields is not None and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    from . import directory
+    directory.index_user(instance)
+
+@receiver(post_delete, sender=Message)
+def release_message_blob(sender, instance, **kwargs):
+    """Hard-deleted messages give back their attachment; the last one reclaims it"""
+    if instance.blob_id:
+        from . import blobs
+        blobs.release(instance.blob_id)
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """WAL lets readers run alongside the single writer; busy_timeout waits for the lock instead of failing"""
+    if connection.vendor != 'sqlite':
+        return
+    timeout_ms = int(connection.settings_dict.get('OPTIONS', {}).get('timeout', 5) * 1000)
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA busy_timeout={timeout_ms}')
+        if settings.SQLITE_JOURNAL_MODE.lower() == 'wal':
+            # Durable across application crashes; only a power loss can drop the last commits
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+@receiver(request_finished)
+def close_request_connections(sender, **kwargs):
+    """
+    Under ASGI each HTTP request runs its sync code on a thread of its own, so a
+    connection kept there for CONN_MAX_AGE would never be used again. The
+    consumers' database thread lives on and keeps its connection.
+    """
+    if SyncToAsync.thread_sensitive_context.get(None) is None:
+        # WSGI, the test client or a management command: the thread is reused
+        return
+    for conn in connections.all(initialized_only=True):
+        conn.close()
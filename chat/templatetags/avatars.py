@@ -0,0 +1,22 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+@register.filter
+def avatar_url(profile, size=None):
+    """{{ profile|avatar_url:40 }} - the avatar variant for a size-pixel slot"""
+    return profile.get_avatar_url(size=size)
+
+@register.simple_tag
+def avatar_picture(profile, size, css_class='', alt='Avatar'):
+    """WebP avatar with a JPEG fallback for browsers without WebP"""
+    if not profile.avatar_hash:
+        return format_html('<img src="{}" alt="{}" class="{}">', profile.get_avatar_url(size=size), alt, css_class)
+    return format_html(
+        '<picture><source srcset="{}" type="image/webp"><img src="{}" alt="{}" class="{}"></picture>',
+        profile.get_avatar_url(size=size),
+        profile.get_avatar_url(size=size, image_format='jpeg'),
+        alt,
+        css_class
+    )
@@ -0,0 +1,65 @@
+"""
+Ephemeral typing indicators.
+
+Typing state never touches the database. Each process keeps a small TTL map
+of who is typing where and only lets one "is typing" broadcast through per
+user per conversation per window. Receivers hide the indicator on their own
+once ``expires_in`` passes without a refresh, so no "stopped typing" frame is
+needed. A user's socket for a conversation lives in a single worker, so a
+process-local map is enough even with several Daphne workers.
+"""
+import time
+
+from django.conf import settings
+
+TYPING_TTL = getattr(settings, 'TYPING_INDICATOR_TTL', 5)
+TYPING_BROADCAST_WINDOW = getattr(settings, 'TYPING_BROADCAST_WINDOW', 2)
+
+
+class TypingTracker:
+    """Process-local TTL store of active typists with broadcast debouncing"""
+
+    # Prune expired entries once the map grows past this many keys
+    PRUNE_THRESHOLD = 1000
+
+    def __init__(self, ttl=TYPING_TTL, window=TYPING_BROADCAST_WINDOW, clock=time.monotonic):
+        self.ttl = ttl
+        self.window = window
+        self.clock = clock
+        self._last_broadcast = {}
+
+    def should_broadcast(self, conversation_id, user_id, is_typing):
+        """Record a typing frame and return True if it should be broadcast"""
+        key = (str(conversation_id), user_id)
+        now = self.clock()
+        last = self._last_broadcast.get(key)
+        if last is not None and now - last >= self.ttl:
+            # Receivers have already expired this indicator on their own
+            del self._last_broadcast[key]
+            last = None
+
+        if not is_typing:
+            # Only announce a stop if receivers still show the indicator
+            return self._last_broadcast.pop(key, None) is not None
+
+        if last is not None and now - last < self.window:
+            return False
+
+        self._last_broadcast[key] = now
+        if len(self._last_broadcast) > self.PRUNE_THRESHOLD:
+            self.prune(now)
+        return True
+
+    def clear(self, conversation_id, user_id):
+        """Forget a typist; return True if receivers may still show the indicator"""
+        last = self._last_broadcast.pop((str(conversation_id), user_id), None)
+        return last is not None and self.clock() - last < self.ttl
+
+    def prune(self, now=None):
+        now = self.clock() if now is None else now
+        expired = [key for key, last in self._last_broadcast.items() if now - last >= self.ttl]
+        for key in expired:
+            del self._last_broadcast[key]
+
+
+typing_tracker = TypingTracker()
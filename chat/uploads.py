@@ -0,0 +1,224 @@
+"""
+Chunked, resumable attachment uploads.
+
+Protocol (all JSON except the chunk bodies):
+    POST   /uploads/                        init: conversation_id, file_name, file_size
+    GET    /uploads/<id>/                   status: bytes received so far
+    PUT    /uploads/<id>/chunk/?offset=N    append: raw bytes, at most CHUNK_SIZE
+    POST   /uploads/<id>/finalize/          finalize: content, optional sha256
+    DELETE /uploads/<id>/                   abort
+
+Chunks are streamed straight into a file next to the conversation's
+attachments, and the SHA-256 is updated as they arrive, so finalizing
+neither copies nor re-reads the file: it is renamed into the blob store
+(chat/blobs.py), or dropped when the same bytes are already stored. Sizes are checked against the declared size and
+MAX_FILE_SIZE before any chunk body is read. A chunk must start at the
+current offset: after a dropped connection the client asks for the status
+and resumes there, and a partly written chunk is cut off again. The Message
+is only created on finalize.
+
+Hash state lives in the worker that received the previous chunk; another
+worker re-hashes the bytes already stored once and carries on from there.
+Abandoned uploads are removed by ``python manage.py clear_stale_uploads``.
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, image_pipeline, metrics
+from .models import Message, UploadSession, message_file_path
+
+ALLOWED_EXTENSIONS = [
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'svg',  # Images
+    'pdf', 'doc', 'docx', 'txt', 'rtf',  # Documents
+    'xls', 'xlsx', 'csv',  # Spreadsheets
+    'ppt', 'pptx',  # Presentations
+    'zip', 'rar', '7z',  # Archives
+    'mp3', 'wav', 'ogg', 'aac',  # Audio
+    'mp4', 'avi', 'mov', 'webm'  # Video
+]
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+MAX_FILE_SIZE = getattr(settings, 'CHAT_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+CHUNK_SIZE = getattr(settings, 'CHAT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+SESSION_TTL = timedelta(hours=24)
+READ_SIZE = 64 * 1024
+
+# {upload id: (offset, sha256 of the first offset bytes)} for uploads this process is receiving
+_hashers = {}
+
+
+class UploadError(Exception):
+    """A rejected upload request; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def file_extension(file_name):
+    return file_name.split('.')[-1].lower() if '.' in file_name else ''
+
+
+def validate(file_name, file_size, max_size=MAX_FILE_SIZE):
+    """Raise UploadError unless an attachment of this name and size is accepted"""
+    ext = file_extension(file_name)
+    if ext not in ALLOWED_EXTENSIONS:
+        raise UploadError(f'File type .{ext} is not allowed')
+    if file_size > max_size:
+        raise UploadError(f'File size cannot exceed {max_size // (1024 * 1024)}MB', status=413)
+
+
+def start(user, conversation, file_name, file_size):
+    """Create an upload session and its empty file at the final storage name"""
+    file_name = os.path.basename(file_name or '')[:255]
+    if not file_name or file_size < 1:
+        raise UploadError('file_name and a positive file_size are required')
+    validate(file_name, file_size)
+
+    path = default_storage.get_available_name(message_file_path(Message(conversation=conversation), file_name))
+    full_path = default_storage.path(path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    open(full_path, 'xb').close()
+
+    session = UploadSession.objects.create(
+        user=user,
+        conversation=conversation,
+        file_name=file_name,
+        file_size=file_size,
+        path=path
+    )
+    _hashers[session.id] = (0, hashlib.sha256())
+    return session
+
+
+def get_session(user, upload_id, lock=False):
+    sessions = UploadSession.objects.select_for_update() if lock else UploadSession.objects
+    session = sessions.filter(id=upload_id, user=user).first()
+    if session is None:
+        raise UploadError('Upload not found', status=404)
+    return session
+
+
+def _hasher(session):
+    """SHA-256 state of the bytes received so far"""
+    offset, hasher = _hashers.get(session.id, (None, None))
+    if offset == session.received:
+        return hasher
+    # Earlier chunks went to another worker
+    hasher = hashlib.sha256()
+    with open(default_storage.path(session.path), 'rb') as file:
+        remaining = session.received
+        while remaining:
+            data = file.read(min(READ_SIZE, remaining))
+            if not data:
+                raise UploadError('Upload data is missing', status=410)
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def append_chunk(user, upload_id, offset, stream, length):
+    """Stream length bytes from stream into the upload at offset; returns the new offset"""
+    if length is None or length < 1:
+        raise UploadError('Content-Length is required')
+    if length > CHUNK_SIZE:
+        raise UploadError(f'Chunks cannot exceed {CHUNK_SIZE} bytes', status=413)
+
+    with transaction.atomic():
+        # One writer per upload; a retried chunk waits for the first attempt
+        session = get_session(user, upload_id, lock=True)
+        if offset != session.received:
+            raise UploadError('Unexpected offset', status=409, offset=session.received)
+        if session.received + length > session.file_size:
+            raise UploadError('Chunk exceeds the declared file size', status=413, offset=session.received)
+
+        hasher = _hasher(session)
+        written = 0
+        with open(default_storage.path(session.path), 'r+b') as file:
+            # Drop whatever an interrupted attempt left past the offset
+            file.seek(offset)
+            file.truncate()
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                file.write(data)
+                hasher.update(data)
+                written += len(data)
+            if written != length:
+                file.truncate(offset)
+
+        if written != length:
+            _hashers.pop(session.id, None)
+            raise UploadError('Incomplete chunk', offset=session.received)
+
+        session.received += written
+        session.save(update_fields=['received', 'updated_at'])
+    _hashers[session.id] = (session.received, hasher)
+    metrics.upload_bytes.inc(written, kind='chunked')
+    return session.received
+
+
+def finish(user, upload_id, content='', sha256=None):
+    """Create the file message of a complete upload and close the session"""
+    with transaction.atomic():
+        session = get_session(user, upload_id, lock=True)
+        if session.received != session.file_size:
+            raise UploadError('Upload is incomplete', status=409, offset=session.received)
+
+        digest = _hasher(session).hexdigest()
+        if sha256 and sha256.lower() != digest:
+            # Corrupt data: the client has to start over
+            discard(session)
+            message = None
+        else:
+            extension = file_extension(session.file_name)
+            dimensions = None
+            if extension in IMAGE_EXTENSIONS:
+                with default_storage.open(session.path, 'rb') as file:
+                    dimensions = image_pipeline.image_dimensions(file)
+
+            blob = blobs.acquire(digest, session.file_size, extension, lambda name: blobs.move(session.path, name))
+            # Already stored: the uploaded copy is not needed
+            default_storage.delete(session.path)
+
+            message = Message.objects.create(
+                conversation=session.conversation,
+                sender=user,
+                content=content,
+                file=blob.path,
+                blob=blob,
+                file_name=session.file_name,
+                file_size=session.file_size,
+                image_width=dimensions[0] if dimensions else None,
+                image_height=dimensions[1] if dimensions else None
+            )
+            session.delete()
+    _hashers.pop(session.id, None)
+
+    if message is None:
+        raise UploadError('Checksum mismatch; upload discarded')
+    return message
+
+
+def discard(session):
+    """Delete an unfinished upload and its partial file"""
+    _hashers.pop(session.id, None)
+    default_storage.delete(session.path)
+    session.delete()
+
+
+def clear_stale_sessions(max_age=SESSION_TTL):
+    """Discard uploads that have not received a chunk within max_age; returns how many"""
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for session in stale.iterator():
+        discard(session)
+        count += 1
+    return count
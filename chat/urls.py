@@ -25,11 +25,17 @@ urlpatterns = [
     path('start-conversation/', views.start_conversation, name='start_conversation'),
     path('messages/<int:conversation_id>/', views.get_messages, name='get_messages'),
     path('search-users/', views.user_search, name='user_search'),
+    path('contacts/', views.contacts, name='contacts'),
+    path('search-messages/', views.search_messages, name='search_messages'),
     path('delete-message/<int:message_id>/', views.delete_message, name='delete_message'),
     path('delete-conversation/<int:conversation_id>/', views.delete_conversation, name='delete_conversation'),
     path('restore-message/<int:message_id>/', views.restore_message, name='restore_message'),
     path('edit-message/<int:message_id>/', views.edit_message, name='edit_message'),
     path('upload-file/', views.upload_file, name='upload_file'),
+    path('uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<uuid:upload_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<uuid:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
     path('test-file-upload/', views.test_file_upload, name='test_file_upload'),
     
     # Debug/Test views
@@ -37,6 +43,7 @@ urlpatterns = [
     path('simple-test/', simple_test, name='simple_test'),
     path('debug-chat/', views.debug_chat, name='debug_chat'),
     path('debug-db-check/', views.debug_db_check, name='debug_db_check'),
+    path('health/', views.health_check, name='health_check'),
     path('call-test/', call_test, name='call_test'),
     path('websocket-debug/', websocket_debug, name='websocket_debug'),
     
@@ -53,6 +60,8 @@ urlpatterns = [
     path('profile/upload-avatar/', profile_views.upload_avatar, name='upload_avatar'),
     path('profile/delete-avatar/', profile_views.delete_avatar, name='delete_avatar'),
     path('profile/update/', profile_views.update_profile_ajax, name='update_profile_ajax'),
+    path('avatars/initials/<str:colour>/<str:letters>/<int:size>.<str:image_format>', profile_views.initials_avatar, name='initials_avatar'),
+    path('avatars/user/<int:user_id>/', profile_views.user_avatar, name='user_avatar'),
     
     # Call views
     path('calls/initiate/', call_views.initiate_call, name='initiate_call'),
@@ -3,16 +3,30 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.models import User
 from django.db.models import Q
-from .models import Conversation, Message, UserProfile
+from .models import Conversation, Message, UserProfile, ConversationInbox
+from . import blobs, directory, image_pipeline, inbox, metrics, receipts, search, uploads
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.middleware.csrf import get_token
+import asyncio
 import json
 import os
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
 from django.core.files.storage import default_storage
 
+# Cap of the single-request upload_file endpoint, which buffers the whole file
+LEGACY_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+
+# Size of a history window for chat_home and the cursor API
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
 @login_required
 def chat_home(request, template_name='chat/chat_home.html'):
     """Main chat interface showing conversations and messages"""
@@ -30,29 +44,21 @@ def chat_home(request, template_name='chat/chat_home.html'):
     # Ensure user has a profile
     user_profile, created = UserProfile.objects.get_or_create(user=request.user)
     
-    # Get user's conversations (hard deleted conversations are completely removed from DB)
-    conversations = Conversation.objects.filter(
-        participants=request.user
-    ).prefetch_related('participants', 'messages')
-    
-    # Add other_user to each conversation for template use
-    conversation_list = []
-    for conv in conversations:
-        other_user = conv.participants.exclude(id=request.user.id).first()
-        # Only include conversations that have another participant
-        if other_user:
-            conversation_list.append({
-                'conversation': conv,
-                'other_user': other_user
-            })
+    # Sidebar rows come straight from the denormalized inbox (one indexed query).
+    # Only include conversations that have another participant
+    conversation_list = ConversationInbox.objects.filter(
+        user=request.user,
+        other_user__isnull=False
+    ).select_related('other_user__userprofile')
     
-    # Get all users for starting new conversations
-    users = User.objects.exclude(id=request.user.id).select_related('userprofile')
+    # The new chat picker starts from the first window of contacts; the rest is fetched lazily
+    contacts, contacts_cursor = directory.contacts_page(request.user)
     
     # Get selected conversation if any
     selected_conversation = None
     selected_other_user = None
     messages = []
+    has_older_messages = False
     
     conversation_id = request.GET.get('conversation')
     if conversation_id:
@@ -63,14 +69,16 @@ def chat_home(request, template_name='chat/chat_home.html'):
                 participants=request.user
             )
             selected_other_user = selected_conversation.participants.exclude(id=request.user.id).first()
-            messages = selected_conversation.messages.all().select_related('sender', 'deleted_by').order_by('timestamp')
-            
-            # Mark messages as read
-            unread_messages = messages.exclude(sender=request.user).filter(
-                Q(status='sent') | Q(status='delivered')
+            # Only render the latest window; older history is fetched by cursor
+            latest = list(
+                selected_conversation.messages.select_related('sender', 'deleted_by')
+                .order_by('-timestamp', '-id')[:MESSAGE_PAGE_SIZE + 1]
             )
-            for message in unread_messages:
-                message.mark_as_read()
+            has_older_messages = len(latest) > MESSAGE_PAGE_SIZE
+            messages = latest[:MESSAGE_PAGE_SIZE][::-1]
+            
+            # Mark everything up to the newest message as read in one UPDATE
+            receipts.mark_read_up_to(selected_conversation, request.user)
                 
         except Conversation.DoesNotExist:
             pass
@@ -80,7 +88,12 @@ def chat_home(request, template_name='chat/chat_home.html'):
         'selected_conversation': selected_conversation,
         'selected_other_user': selected_other_user,
         'messages': messages,
-        'users': users,
+        'has_older_messages': has_older_messages,
+        'initial_contacts': {
+            'contacts': [serialize_contact(entry) for entry in contacts],
+            'next_cursor': contacts_cursor,
+        },
+        'max_upload_size': uploads.MAX_FILE_SIZE,
     }
     return render(request, template_name, context)
 
@@ -108,6 +121,7 @@ def start_conversation(request):
             # if the previous one was deleted (hard deleted)
             conversation = Conversation.objects.create()
             conversation.participants.add(request.user, other_user)
+            inbox.ensure_inbox_entries(conversation)
             conversation_id = conversation.id
         
         return JsonResponse({
@@ -177,6 +191,51 @@ def debug_db_check(request):
             'type': type(e).__name__
         }, status=500)
 
+@require_http_methods(["GET", "HEAD"])
+def health_check(request):
+    """Liveness/readiness probe: round-trips the database and the channel layer"""
+    checks = {}
+    healthy = True
+
+    started = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        checks['database'] = {
+            'status': 'ok',
+            'vendor': connection.vendor,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+    except Exception as e:
+        healthy = False
+        checks['database'] = {'status': 'error', 'error': str(e)}
+
+    started = time.perf_counter()
+    try:
+        async_to_sync(_channel_layer_round_trip)()
+        checks['channel_layer'] = {
+            'status': 'ok',
+            'backend': settings.CHANNEL_LAYER,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+    except Exception as e:
+        healthy = False
+        checks['channel_layer'] = {'status': 'error', 'error': str(e) or type(e).__name__}
+
+    return JsonResponse(
+        {'status': 'ok' if healthy else 'error', 'checks': checks},
+        status=200 if healthy else 503
+    )
+
+
+async def _channel_layer_round_trip(timeout=2):
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    await channel_layer.send(channel, {'type': 'health.check'})
+    await asyncio.wait_for(channel_layer.receive(channel), timeout)
+
+
 @login_required
 @require_http_methods(["POST"])
 def upload_file(request):
@@ -199,52 +258,158 @@ def upload_file(request):
             return JsonResponse({'error': 'Conversation not found'}, status=404)
         
         uploaded_file = request.FILES['file']
+        metrics.upload_bytes.inc(uploaded_file.size, kind='form')
         
-        # Validate file size (10MB max)
-        if uploaded_file.size > 10 * 1024 * 1024:
-            return JsonResponse({'error': 'File size cannot exceed 10MB'}, status=400)
-        
-        # Validate file extension
-        allowed_extensions = [
-            'jpg', 'jpeg', 'png', 'gif', 'webp', 'svg',  # Images
-            'pdf', 'doc', 'docx', 'txt', 'rtf',  # Documents
-            'xls', 'xlsx', 'csv',  # Spreadsheets
-            'ppt', 'pptx',  # Presentations
-            'zip', 'rar', '7z',  # Archives
-            'mp3', 'wav', 'ogg', 'aac',  # Audio
-            'mp4', 'avi', 'mov', 'webm'  # Video
-        ]
-        
-        file_ext = uploaded_file.name.split('.')[-1].lower() if '.' in uploaded_file.name else ''
-        if file_ext not in allowed_extensions:
-            return JsonResponse({'error': f'File type .{file_ext} is not allowed'}, status=400)
-        
-        # Create message with file
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=request.POST.get('content', ''),  # Optional text content
-            file=uploaded_file,
-            file_name=uploaded_file.name,
-            file_size=uploaded_file.size
-        )
+        # Validate file extension and size (10MB max; larger files use the chunked /uploads/ API)
+        try:
+            uploads.validate(uploaded_file.name, uploaded_file.size, max_size=LEGACY_UPLOAD_MAX_SIZE)
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        # Header-only read, so clients can reserve the image's space right away
+        extension = uploads.file_extension(uploaded_file.name)
+        dimensions = image_pipeline.image_dimensions(uploaded_file) if extension in uploads.IMAGE_EXTENSIONS else None
+        
+        # Stored once per content: bytes that are already stored are not written again
+        digest = image_pipeline.file_hash(uploaded_file)
+        with transaction.atomic():
+            blob = blobs.acquire(
+                digest, uploaded_file.size, extension,
+                lambda name: default_storage.save(name, uploaded_file)
+            )
+            
+            # Create message with file
+            message = Message.objects.create(
+                conversation=conversation,
+                sender=request.user,
+                content=request.POST.get('content', ''),  # Optional text content
+                file=blob.path,
+                blob=blob,
+                file_name=uploaded_file.name,
+                file_size=uploaded_file.size,
+                image_width=dimensions[0] if dimensions else None,
+                image_height=dimensions[1] if dimensions else None
+            )
+        record_file_message(message)
         
         # Return file message data
-        return JsonResponse({
-            'success': True,
-            'file_id': message.id,
-            'file_name': message.file_name,
-            'file_url': message.file.url if message.file else None,
-            'file_size': message.format_file_size(),
-            'is_image': message.is_image,
-            'message_id': message.id
-        })
+        return JsonResponse(serialize_file_message(message))
         
     except Exception as e:
         return JsonResponse({
             'error': f'Upload failed: {str(e)}'
         }, status=500)
 
+def record_file_message(message):
+    """Index a new file message and queue the previews of an image"""
+    inbox.record_new_message(message)
+    search.record_new_message(message)
+    if message.image_width:
+        # Thumbnail and placeholder follow over the socket (attachment_ready)
+        transaction.on_commit(lambda: image_pipeline.submit(image_pipeline.process_message_image, message.id))
+
+def serialize_file_message(message):
+    """Upload response: what the client needs to announce the file message"""
+    return {
+        'success': True,
+        'file_id': message.id,
+        'file_name': message.file_name,
+        'file_url': message.file.url if message.file else None,
+        'file_size': message.format_file_size(),
+        'is_image': message.is_image,
+        'message_id': message.id,
+        **message.attachment_preview()
+    }
+
+def upload_error(error):
+    response = {'error': str(error)}
+    if error.offset is not None:
+        # Where the client has to resume
+        response['offset'] = error.offset
+    return JsonResponse(response, status=error.status)
+
+@login_required
+@require_http_methods(["POST"])
+def upload_start(request):
+    """Open a chunked upload (see chat/uploads.py)"""
+    try:
+        data = json.loads(request.body)
+        conversation_id = int(data.get('conversation_id'))
+        file_size = int(data.get('file_size'))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return JsonResponse({'error': 'conversation_id, file_name and file_size are required'}, status=400)
+    
+    conversation = Conversation.objects.filter(id=conversation_id, participants=request.user).first()
+    if conversation is None:
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+    
+    try:
+        session = uploads.start(request.user, conversation, data.get('file_name'), file_size)
+    except uploads.UploadError as e:
+        return upload_error(e)
+    
+    return JsonResponse({
+        'upload_id': str(session.id),
+        'offset': 0,
+        'chunk_size': uploads.CHUNK_SIZE
+    }, status=201)
+
+@login_required
+@require_http_methods(["GET", "DELETE"])
+def upload_session(request, upload_id):
+    """Resume point of a chunked upload (GET) or abort it (DELETE)"""
+    try:
+        session = uploads.get_session(request.user, upload_id)
+    except uploads.UploadError as e:
+        return upload_error(e)
+    
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return JsonResponse({'success': True})
+    
+    return JsonResponse({
+        'upload_id': str(session.id),
+        'file_name': session.file_name,
+        'file_size': session.file_size,
+        'offset': session.received,
+        'chunk_size': uploads.CHUNK_SIZE
+    })
+
+@login_required
+@require_http_methods(["PUT"])
+def upload_chunk(request, upload_id):
+    """Append the raw request body to a chunked upload at ?offset="""
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'offset and Content-Length are required'}, status=400)
+    
+    try:
+        # Read from the request stream, never buffering more than a read block
+        offset = uploads.append_chunk(request.user, upload_id, offset, request, length)
+    except uploads.UploadError as e:
+        return upload_error(e)
+    
+    return JsonResponse({'offset': offset})
+
+@login_required
+@require_http_methods(["POST"])
+def upload_finalize(request, upload_id):
+    """Turn a complete chunked upload into a file message"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    try:
+        message = uploads.finish(request.user, upload_id, data.get('content', ''), data.get('sha256'))
+    except uploads.UploadError as e:
+        return upload_error(e)
+    
+    record_file_message(message)
+    return JsonResponse(serialize_file_message(message))
+
 @login_required
 def test_file_upload(request):
     """Test endpoint for file upload debugging"""
@@ -271,74 +436,204 @@ def test_file_upload(request):
                 'error': f'Test upload failed: {str(e)}'
             }, status=500)
 
+def serialize_message(message, user):
+    """Serialize a message with everything the client needs to render it"""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'display_content': message.display_content,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.username,
+        'timestamp': message.timestamp.isoformat(),
+        'status': message.status,
+        'is_own': message.sender_id == user.id,
+        'message_type': message.message_type,
+        'is_edited': message.is_edited,
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        'is_deleted': message.is_deleted,
+        'deleted_at': message.deleted_at.isoformat() if message.deleted_at else None,
+        'file_url': message.file.url if message.file else None,
+        'file_name': message.file_name,
+        'file_size': message.format_file_size(),
+        'file_icon': message.get_file_icon(),
+        'is_image': message.is_image,
+        **message.attachment_preview(),
+    }
+
+def _get_anchor(conversation, message_id):
+    """Return (timestamp, id) of a cursor message inside the conversation"""
+    return conversation.messages.filter(id=message_id).values_list('timestamp', 'id').first()
+
 @login_required
 def get_messages(request, conversation_id):
-    """Get messages for a specific conversation (AJAX endpoint)"""
+    """Get messages for a specific conversation (AJAX endpoint)
+    
+    Cursor mode (default): ``before_id`` returns the window of older messages,
+    ``after_id`` the window of newer ones, and no cursor returns the latest
+    window. Ordering is keyset based on (timestamp, id) so no COUNT query or
+    OFFSET scan is needed. The legacy ``page`` parameter is still honoured.
+    """
     try:
         conversation = Conversation.objects.get(
             id=conversation_id,
             participants=request.user
         )
         
-        page = request.GET.get('page', 1)
-        messages = conversation.messages.all().select_related('sender').order_by('-timestamp')
-        
-        paginator = Paginator(messages, 50)
-        page_obj = paginator.get_page(page)
-        
-        messages_data = []
-        for message in reversed(page_obj.object_list):
-            messages_data.append({
-                'id': message.id,
-                'content': message.content,
-                'sender_id': message.sender.id,
-                'sender_username': message.sender.username,
-                'timestamp': message.timestamp.isoformat(),
-                'status': message.status,
-                'is_own': message.sender == request.user
-            })
+        if 'page' in request.GET:
+            return _get_messages_paginated(request, conversation)
+        
+        try:
+            limit = int(request.GET.get('limit', MESSAGE_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+        limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+        
+        try:
+            before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+            after_id = int(request.GET['after_id']) if request.GET.get('after_id') else None
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        messages = conversation.messages.select_related('sender')
+        
+        if after_id:
+            anchor = _get_anchor(conversation, after_id)
+            if anchor is None:
+                return JsonResponse({'error': 'Message not found'}, status=404)
+            timestamp, anchor_id = anchor
+            window = list(messages.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=anchor_id)
+            ).order_by('timestamp', 'id')[:limit + 1])
+            has_more = len(window) > limit
+            window = window[:limit]
+            has_newer, has_older = has_more, True
+        else:
+            if before_id:
+                anchor = _get_anchor(conversation, before_id)
+                if anchor is None:
+                    return JsonResponse({'error': 'Message not found'}, status=404)
+                timestamp, anchor_id = anchor
+                messages = messages.filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=anchor_id)
+                )
+            window = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+            has_more = len(window) > limit
+            window = window[:limit][::-1]
+            has_older, has_newer = has_more, bool(before_id)
         
         return JsonResponse({
-            'messages': messages_data,
-            'has_next': page_obj.has_next(),
-            'has_previous': page_obj.has_previous(),
-            'page_number': page_obj.number,
-            'total_pages': paginator.num_pages
+            'messages': [serialize_message(message, request.user) for message in window],
+            'has_older': has_older,
+            'has_newer': has_newer,
+            'oldest_id': window[0].id if window else None,
+            'newest_id': window[-1].id if window else None,
         })
         
     except Conversation.DoesNotExist:
         return JsonResponse({'error': 'Conversation not found'}, status=404)
 
+def _get_messages_paginated(request, conversation):
+    """Offset pagination kept for older clients"""
+    page = request.GET.get('page', 1)
+    messages = conversation.messages.all().select_related('sender').order_by('-timestamp')
+    
+    paginator = Paginator(messages, MESSAGE_PAGE_SIZE)
+    page_obj = paginator.get_page(page)
+    
+    messages_data = []
+    for message in reversed(page_obj.object_list):
+        messages_data.append(serialize_message(message, request.user))
+    
+    return JsonResponse({
+        'messages': messages_data,
+        'has_next': page_obj.has_next(),
+        'has_previous': page_obj.has_previous(),
+        'page_number': page_obj.number,
+        'total_pages': paginator.num_pages
+    })
+
+def serialize_directory_user(profile, is_contact):
+    """Serialize a user for the new chat picker"""
+    return {
+        'id': profile.user.id,
+        'username': profile.user.username,
+        'display_name': profile.display_name,
+        'avatar': profile.get_avatar_url(size=40),
+        'is_online': profile.is_online,
+        'is_contact': is_contact
+    }
+
+def serialize_contact(entry):
+    """Serialize an inbox entry as a contact of its owner"""
+    try:
+        profile = entry.other_user.userprofile
+    except UserProfile.DoesNotExist:
+        profile = UserProfile(user=entry.other_user)
+    data = serialize_directory_user(profile, True)
+    data['conversation_id'] = entry.conversation_id
+    data['last_interaction'] = entry.updated_at.isoformat()
+    return data
+
 @login_required
 def user_search(request):
-    """Search for users to start conversations with"""
-    query = request.GET.get('q', '')
+    """Search for users to start conversations with (indexed prefix lookup, contacts first)"""
+    results = directory.search_users(request.user, request.GET.get('q', ''))
+    return JsonResponse({'users': [serialize_directory_user(profile, is_contact) for profile, is_contact in results]})
+
+@login_required
+@require_http_methods(["GET"])
+def contacts(request):
+    """Cursor-paginated contacts for the new chat picker (AJAX endpoint)
     
-    if len(query) < 2:
-        return JsonResponse({'users': []})
+    Online contacts come first, then the most recent conversations. Pass
+    ``next_cursor`` back as ``cursor`` for the next window.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', directory.CONTACTS_PAGE_SIZE)), directory.MAX_CONTACTS_PAGE_SIZE))
+        entries, next_cursor = directory.contacts_page(request.user, request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters'}, status=400)
+    
+    return JsonResponse({
+        'contacts': [serialize_contact(entry) for entry in entries],
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def search_messages(request):
+    """Full-text search over the user's conversations (AJAX endpoint)
     
-    users = User.objects.filter(
-        Q(username__icontains=query) |
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query)
-    ).exclude(id=request.user.id).select_related('userprofile')[:10]
+    ``q`` is the query and ``conversation_id`` optionally narrows it to one
+    conversation. Results are newest first; pass ``next_before_id`` back as
+    ``before_id`` for the next page.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', search.PAGE_SIZE)), search.MAX_PAGE_SIZE))
+        before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        conversation_id = int(request.GET['conversation_id']) if request.GET.get('conversation_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters'}, status=400)
     
-    users_data = []
-    for user in users:
-        try:
-            profile = user.userprofile
-        except UserProfile.DoesNotExist:
-            profile = UserProfile.objects.create(user=user)
-        
-        users_data.append({
-            'id': user.id,
-            'username': user.username,
-            'display_name': profile.display_name,
-            'avatar': profile.get_avatar_url(),
-            'is_online': profile.is_online
-        })
+    results, next_before_id = search.search_messages(
+        request.user,
+        request.GET.get('q', ''),
+        conversation_id=conversation_id,
+        before_id=before_id,
+        limit=limit
+    )
     
-    return JsonResponse({'users': users_data})
+    return JsonResponse({
+        'results': [{
+            'message_id': result['message'].id,
+            'conversation_id': result['message'].conversation_id,
+            'sender_id': result['message'].sender_id,
+            'sender_username': result['message'].sender.username,
+            'timestamp': result['message'].timestamp.isoformat(),
+            'snippet': result['snippet'],
+        } for result in results],
+        'has_more': next_before_id is not None,
+        'next_before_id': next_before_id,
+    })
 
 @login_required
 @require_http_methods(["DELETE"])
@@ -353,6 +648,8 @@ def delete_message(request, message_id):
         
         # Soft delete the message
         message.soft_delete(request.user)
+        inbox.message_changed(message)
+        search.message_changed(message)
         
         return JsonResponse({
             'success': True,
@@ -375,6 +672,7 @@ def delete_conversation(request, conversation_id):
         )
         
         # Hard delete: Remove all messages in the conversation
+        search.conversation_deleted(conversation)
         conversation.messages.all().delete()
         
         # Delete any related records (reactions, edits, typing status, etc.)
@@ -416,6 +714,8 @@ def restore_message(request, message_id):
         
         # Restore the message
         message.restore()
+        inbox.message_changed(message)
+        search.message_changed(message)
         
         return JsonResponse({
             'success': True,
@@ -467,6 +767,8 @@ def edit_message(request, message_id):
         message.is_edited = True
         message.edited_at = timezone.now()
         message.save()
+        inbox.message_changed(message)
+        search.message_changed(message)
         
         return JsonResponse({
             'success': True,
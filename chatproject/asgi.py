@@ -12,7 +12,6 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.sessions import SessionMiddlewareStack
-import chat.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatproject.settings')
 
@@ -20,6 +19,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatproject.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+import chat.routing  # noqa: E402
+
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
     'websocket': SessionMiddlewareStack(
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.query_stats.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,12 +80,52 @@ ASGI_APPLICATION = 'chatproject.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE selects the profile:
+#   sqlite   - single file (development). WAL and busy_timeout are applied to
+#              every connection in chat/signals.py
+#   postgres - PostgreSQL for production (pip install "psycopg[binary]")
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='sqlite')
+
+# Consumers run their queries through database_sync_to_async in one long-lived
+# thread per worker; keeping that thread's connection open avoids a new
+# connection per websocket frame. HTTP requests under ASGI run on a thread of
+# their own each, so their connections are closed when the request finishes
+# whatever this says (chat/signals.py).
+CONN_MAX_AGE = config('CONN_MAX_AGE', default=60, cast=int)
+
+if DATABASE_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('POSTGRES_DB', default='chat'),
+            'USER': config('POSTGRES_USER', default='chat'),
+            'PASSWORD': config('POSTGRES_PASSWORD', default=''),
+            'HOST': config('POSTGRES_HOST', default='127.0.0.1'),
+            'PORT': config('POSTGRES_PORT', default=5432, cast=int),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer in transaction pooling mode cannot hold server-side cursors
+            'DISABLE_SERVER_SIDE_CURSORS': config('POSTGRES_PGBOUNCER', default=False, cast=bool),
+            'OPTIONS': {
+                'connect_timeout': config('POSTGRES_CONNECT_TIMEOUT', default=5, cast=int),
+                'application_name': 'chat-app',
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds to wait for a write lock before "database is locked"
+                'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+            },
+        }
+    }
+
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='wal')
 
 
 # Password validation
@@ -136,22 +179,107 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media is served by chat/media_views.py after an access check. MEDIA_OFFLOAD hands the transfer to
+# the proxy: '' (Django streams it), 'x-accel' (nginx, internal location MEDIA_ACCEL_PREFIX aliased
+# to MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+MEDIA_OFFLOAD = config('MEDIA_OFFLOAD', default='')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
 # Channels configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
-
-# For production, use Redis:
-# CHANNEL_LAYERS = {
-#     'default': {
-#         'BACKEND': 'channels_redis.core.RedisChannelLayer',
-#         'CONFIG': {
-#             "hosts": [('127.0.0.1', 6379)],
-#         },
-#     },
-# }
+# CHANNEL_LAYER selects the backend:
+#   memory       - InMemoryChannelLayer, single process only (development)
+#   redis        - channels_redis RedisChannelLayer, required for more than one Daphne worker
+#   redis_pubsub - channels_redis RedisPubSubChannelLayer (lower latency, no per-channel capacity)
+CHANNEL_LAYER = config('CHANNEL_LAYER', default='memory')
+REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/0')
+CHANNEL_LAYER_PREFIX = config('CHANNEL_LAYER_PREFIX', default='chat')
+
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'prefix': CHANNEL_LAYER_PREFIX,
+                'capacity': config('CHANNEL_LAYER_CAPACITY', default=1500, cast=int),
+                'expiry': config('CHANNEL_LAYER_EXPIRY', default=60, cast=int),
+                'group_expiry': config('CHANNEL_LAYER_GROUP_EXPIRY', default=86400, cast=int),
+            },
+        },
+    }
+elif CHANNEL_LAYER == 'redis_pubsub':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'prefix': CHANNEL_LAYER_PREFIX,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Presence: connection refcounts shared across consumers (see chat/presence.py).
+# Multi-worker deployments need the redis store so refcounts span processes.
+PRESENCE_BACKEND = config('PRESENCE_BACKEND', default='redis' if CHANNEL_LAYER.startswith('redis') else 'local')
+PRESENCE_HEARTBEAT_TTL = config('PRESENCE_HEARTBEAT_TTL', default=90, cast=int)
+PRESENCE_SWEEP_INTERVAL = config('PRESENCE_SWEEP_INTERVAL', default=30, cast=int)
+
+# Call sessions used to route WebRTC signalling (see chat/call_sessions.py)
+CALL_REGISTRY_BACKEND = config('CALL_REGISTRY_BACKEND', default='redis' if CHANNEL_LAYER.startswith('redis') else 'local')
+CALL_SESSION_TTL = config('CALL_SESSION_TTL', default=4 * 60 * 60, cast=int)
+# Unanswered calls are marked missed after this many seconds (see chat/call_timeouts.py)
+CALL_RING_TIMEOUT = config('CALL_RING_TIMEOUT', default=45, cast=int)
+# Trickled ICE candidates are forwarded in batches at most this often (seconds)
+ICE_BATCH_WINDOW = config('ICE_BATCH_WINDOW', default=0.05, cast=float)
+
+# Typing indicators are kept in memory only (see chat/typing_indicators.py)
+TYPING_INDICATOR_TTL = config('TYPING_INDICATOR_TTL', default=5, cast=float)
+TYPING_BROADCAST_WINDOW = config('TYPING_BROADCAST_WINDOW', default=2, cast=float)
+# Also record debounced typing events in the TypingStatus table
+TYPING_ANALYTICS = config('TYPING_ANALYTICS', default=False, cast=bool)
+
+# User directory search (see chat/directory.py): per-process cache of hot prefixes
+USER_SEARCH_CACHE_SIZE = config('USER_SEARCH_CACHE_SIZE', default=1024, cast=int)
+USER_SEARCH_CACHE_TTL = config('USER_SEARCH_CACHE_TTL', default=30, cast=float)
+
+# Background image processing threads (see chat/image_pipeline.py)
+IMAGE_PIPELINE_WORKERS = config('IMAGE_PIPELINE_WORKERS', default=2, cast=int)
+
+# Chunked attachment uploads (see chat/uploads.py): largest attachment and largest chunk, in bytes
+CHAT_UPLOAD_MAX_SIZE = config('CHAT_UPLOAD_MAX_SIZE', default=100 * 1024 * 1024, cast=int)
+CHAT_UPLOAD_CHUNK_SIZE = config('CHAT_UPLOAD_CHUNK_SIZE', default=1024 * 1024, cast=int)
+
+# Write-behind message persistence (see chat/message_writer.py): messages get a
+# snowflake id, are broadcast at once and are inserted in batches.
+MESSAGE_WRITE_BEHIND = config('MESSAGE_WRITE_BEHIND', default=False, cast=bool)
+MESSAGE_WRITE_BATCH_SIZE = config('MESSAGE_WRITE_BATCH_SIZE', default=200, cast=int)
+MESSAGE_WRITE_FLUSH_INTERVAL = config('MESSAGE_WRITE_FLUSH_INTERVAL', default=0.05, cast=float)
+MESSAGE_WRITE_QUEUE_SIZE = config('MESSAGE_WRITE_QUEUE_SIZE', default=5000, cast=int)
+# Unique per worker process (0-31), required with MESSAGE_WRITE_BEHIND: two workers
+# with the same id can issue the same message id in the same millisecond
+MESSAGE_WORKER_ID = config('MESSAGE_WORKER_ID', default='', cast=lambda value: int(value) if value != '' else None)
+if MESSAGE_WRITE_BEHIND and MESSAGE_WORKER_ID is None:
+    raise ImproperlyConfigured('MESSAGE_WRITE_BEHIND needs a MESSAGE_WORKER_ID (0-31) unique to each worker process')
+if MESSAGE_WORKER_ID is not None and not 0 <= MESSAGE_WORKER_ID <= 31:
+    raise ImproperlyConfigured('MESSAGE_WORKER_ID must be between 0 and 31')
+
+# Runtime metrics served at /metrics (see chat/metrics.py). The redis store adds up
+# every worker; local only reports the worker answering the scrape.
+METRICS_BACKEND = config('METRICS_BACKEND', default='redis' if CHANNEL_LAYER.startswith('redis') else 'local')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=10, cast=float)
+# Bearer token of the scraper (staff users can always read /metrics)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Query instrumentation (see chat/query_stats.py): per-request and per-frame query
+# counts, time, repeated statements and queries slower than QUERY_STATS_SLOW_MS
+QUERY_STATS = config('QUERY_STATS', default=False, cast=bool)
+QUERY_STATS_SLOW_MS = config('QUERY_STATS_SLOW_MS', default=100, cast=float)
 
 # Login/Logout URLs
 LOGIN_URL = '/auth/login/'
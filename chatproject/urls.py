@@ -18,12 +18,16 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from chat import media_views, metrics_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Access-checked in every environment; in production the proxy sends the bytes (MEDIA_OFFLOAD)
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', media_views.serve_media, name='serve_media'),
+    # Prometheus scrape target (METRICS_TOKEN)
+    path('metrics', metrics_views.metrics_view, name='metrics'),
     path('', include('chat.urls')),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
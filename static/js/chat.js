@@ -23,6 +23,8 @@ class ChatApp {
         this.allowNotifications = false; // More strict flag for notifications
         this.initialLoadComplete = false; // Track if initial messages have loaded
         
+        // Image previews that arrived before their message was rendered, by message id
+        this.pendingAttachments = new Map();
         
         this.init();
     }
@@ -32,8 +34,10 @@ class ChatApp {
         this.setupModal();
         this.setupDeleteModals();
         
+        // One multiplexed socket per page carries chat, presence and call events
+        this.connectWebSocket();
         if (this.conversationId) {
-            this.connectWebSocket();
+            this.setupHistoryLoading();
         }
         
         // Don't request notification permission automatically
@@ -101,15 +105,35 @@ class ChatApp {
         const modal = document.getElementById('newChatModal');
         const userSearchInput = document.getElementById('userSearchInput');
         
+        // First window of contacts is embedded in the page; later windows are fetched on scroll
+        const initialContacts = document.getElementById('initialContacts');
+        const contactsPage = initialContacts ? JSON.parse(initialContacts.textContent) : { contacts: [], next_cursor: null };
+        this.contacts = contactsPage.contacts;
+        this.contactsCursor = contactsPage.next_cursor;
+        this.loadingContacts = false;
+        
         [newChatBtn, startChatBtn].forEach(btn => {
             if (btn) {
                 btn.addEventListener('click', () => {
                     modal.classList.remove('hidden');
                     userSearchInput.focus();
+                    if (userSearchInput.value.length < 2) {
+                        this.showContacts();
+                    }
                 });
             }
         });
         
+        const resultsContainer = document.getElementById('userSearchResults');
+        if (resultsContainer) {
+            resultsContainer.addEventListener('scroll', () => {
+                const nearBottom = resultsContainer.scrollTop + resultsContainer.clientHeight > resultsContainer.scrollHeight - 50;
+                if (nearBottom && userSearchInput.value.length < 2) {
+                    this.loadMoreContacts();
+                }
+            });
+        }
+        
         if (closeModalBtn) {
             closeModalBtn.addEventListener('click', () => {
                 modal.classList.add('hidden');
@@ -373,16 +397,9 @@ class ChatApp {
     }
     
     connectWebSocket() {
-        if (!this.conversationId) {
-            console.error('No conversation ID provided for WebSocket connection');
-            console.error('Current URL:', window.location.href);
-            console.error('URL params:', new URLSearchParams(window.location.search));
-            // Suppressed alert: No conversation ID found
-            return;
-        }
-        
         const wsScheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${wsScheme}://${window.location.host}/ws/chat/${this.conversationId}/`;
+        const wsUrl = `${wsScheme}://${window.location.host}/ws/stream/`;
+        this.multiplexed = true;
         
         this.updateConnectionStatus('connecting');
         
@@ -396,6 +413,15 @@ class ChatApp {
         
         this.chatSocket.onopen = (e) => {
             this.updateConnectionStatus('connected');
+            this.startHeartbeat();
+            
+            // Frames without a "stream" key go to the subscribed conversation
+            if (this.conversationId) {
+                this.chatSocket.send(JSON.stringify({
+                    'type': 'subscribe',
+                    'conversation_id': this.conversationId
+                }));
+            }
             // Mark connection as ready after a delay to allow initial messages to load
             setTimeout(() => {
                 this.connectionReady = true;
@@ -416,6 +442,7 @@ class ChatApp {
         
         this.chatSocket.onclose = (e) => {
             console.log('WebSocket closed:', e.code, e.reason);
+            clearInterval(this.heartbeatTimer);
             this.connectionReady = false; // Reset connection ready flag
             this.allowNotifications = false; // Reset notification flag
             this.initialLoadComplete = false; // Reset initial load flag
@@ -432,10 +459,8 @@ class ChatApp {
             // Attempt to reconnect after 3 seconds if not intentionally closed
             if (e.code !== 1000) {
                 setTimeout(() => {
-                    if (this.conversationId) {
-                        console.log('Attempting to reconnect...');
-                        this.connectWebSocket();
-                    }
+                    console.log('Attempting to reconnect...');
+                    this.connectWebSocket();
                 }, 3000);
             }
         };
@@ -446,11 +471,30 @@ class ChatApp {
         };
     }
     
+    startHeartbeat() {
+        // Keeps this socket counted as online; the server expires silent sockets
+        clearInterval(this.heartbeatTimer);
+        this.heartbeatTimer = setInterval(() => {
+            if (this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN) {
+                this.chatSocket.send(JSON.stringify({ 'type': 'heartbeat' }));
+            }
+        }, 30000);
+    }
+    
     handleWebSocketMessage(data) {
+        // Ignore room events from conversations other than the open one
+        if (data.stream && String(data.stream) !== String(this.conversationId)) {
+            return;
+        }
+        
         switch (data.type) {
             case 'message':
             case 'file_message':
+                if (data.user_id !== this.currentUserId) {
+                    this.handleTypingIndicator({ is_typing: false });
+                }
                 this.displayMessage(data);
+                this.queueReadReceipt(data);
                 this.scrollToBottom();
                 this.playReceiveSound();
                 this.showBrowserNotification(data);
@@ -473,12 +517,38 @@ class ChatApp {
             case 'message_delete':
                 this.handleMessageDelete(data);
                 break;
+            case 'attachment_ready':
+                this.handleAttachmentReady(data);
+                break;
             case 'user_activity':
                 this.handleUserActivity(data);
                 break;
         }
     }
     
+    queueReadReceipt(data) {
+        // Coalesce receipts: one "read up to N" frame for a burst of messages
+        if (data.user_id === this.currentUserId || !data.message_id || document.hidden) {
+            return;
+        }
+        
+        this.pendingReadId = Math.max(this.pendingReadId || 0, data.message_id);
+        if (this.readReceiptTimer) {
+            return;
+        }
+        
+        this.readReceiptTimer = setTimeout(() => {
+            this.readReceiptTimer = null;
+            if (this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN) {
+                this.chatSocket.send(JSON.stringify({
+                    'type': 'message_read',
+                    'message_id': this.pendingReadId
+                }));
+            }
+            this.pendingReadId = 0;
+        }, 500);
+    }
+    
     sendMessage() {
         const messageInput = document.getElementById('messageInput');
         if (!messageInput) {
@@ -543,7 +613,78 @@ class ChatApp {
         }
     }
     
-    displayMessage(data) {
+    setupHistoryLoading() {
+        const messagesContainer = document.getElementById('messagesContainer');
+        const messagesList = document.getElementById('messagesList');
+        if (!messagesContainer || !messagesList) {
+            return;
+        }
+        
+        this.hasOlderMessages = messagesList.dataset.hasOlder === 'true';
+        this.oldestMessageId = messagesList.dataset.oldestId || null;
+        this.loadingOlderMessages = false;
+        
+        messagesContainer.addEventListener('scroll', () => {
+            if (messagesContainer.scrollTop < 50) {
+                this.loadOlderMessages();
+            }
+        });
+    }
+    
+    async loadOlderMessages() {
+        if (!this.hasOlderMessages || !this.oldestMessageId || this.loadingOlderMessages) {
+            return;
+        }
+        
+        this.loadingOlderMessages = true;
+        const messagesContainer = document.getElementById('messagesContainer');
+        
+        try {
+            const response = await fetch(`/messages/${this.conversationId}/?before_id=${this.oldestMessageId}`);
+            const data = await response.json();
+            if (!response.ok) {
+                console.error('Failed to load older messages:', data.error);
+                return;
+            }
+            
+            const previousHeight = messagesContainer.scrollHeight;
+            
+            // Messages arrive oldest first; prepend newest first to keep order
+            data.messages.slice().reverse().forEach(message => {
+                this.displayMessage({
+                    message: message.display_content,
+                    user_id: message.sender_id,
+                    username: message.sender_username,
+                    timestamp: message.timestamp,
+                    message_id: message.id,
+                    status: message.status,
+                    file_url: message.is_deleted ? null : message.file_url,
+                    file_name: message.is_deleted ? null : message.file_name,
+                    file_size: message.file_size,
+                    is_image: message.is_image,
+                    image_width: message.image_width,
+                    image_height: message.image_height,
+                    thumbnail_url: message.thumbnail_url,
+                    placeholder: message.placeholder
+                }, { prepend: true });
+                this.updateMessageStatus({ message_id: message.id, status: message.status });
+            });
+            
+            // Keep the viewport anchored on the message the user was reading
+            messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+            
+            this.hasOlderMessages = data.has_older;
+            if (data.oldest_id) {
+                this.oldestMessageId = data.oldest_id;
+            }
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            this.loadingOlderMessages = false;
+        }
+    }
+    
+    displayMessage(data, options = {}) {
         // Remove temp message if it exists
         if (data.temp_id) {
             const tempMessage = document.querySelector(`[data-temp-id="${data.temp_id}"]`);
@@ -624,12 +765,21 @@ class ChatApp {
         messageContent.appendChild(timeDiv);
         messageDiv.appendChild(messageContent);
         
-        messagesList.appendChild(messageDiv);
+        if (options.prepend) {
+            messagesList.insertBefore(messageDiv, messagesList.firstChild);
+        } else {
+            messagesList.appendChild(messageDiv);
+        }
     }
     
     handleTyping() {
-        if (!this.isTyping && this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN) {
+        // Refresh "is typing" while the user keeps typing; the server debounces
+        // and receivers expire the indicator on their own, so no stop frame is sent
+        const now = Date.now();
+        if (this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN &&
+            (!this.isTyping || now - this.lastTypingSent > 2000)) {
             this.isTyping = true;
+            this.lastTypingSent = now;
             this.chatSocket.send(JSON.stringify({
                 'type': 'typing',
                 'is_typing': true
@@ -645,20 +795,19 @@ class ChatApp {
     }
     
     stopTyping() {
-        if (this.isTyping && this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN) {
-            this.isTyping = false;
-            this.chatSocket.send(JSON.stringify({
-                'type': 'typing',
-                'is_typing': false
-            }));
-        }
+        clearTimeout(this.typingTimer);
+        this.isTyping = false;
     }
     
     handleTypingIndicator(data) {
         const typingIndicator = document.getElementById('typingIndicator');
+        clearTimeout(this.typingIndicatorTimer);
         if (data.is_typing) {
             typingIndicator.classList.remove('hidden');
             this.scrollToBottom();
+            this.typingIndicatorTimer = setTimeout(() => {
+                typingIndicator.classList.add('hidden');
+            }, (data.expires_in || 5) * 1000);
         } else {
             typingIndicator.classList.add('hidden');
         }
@@ -693,14 +842,32 @@ class ChatApp {
     }
     
     updateMessageStatus(data) {
+        // Read receipts carry a watermark: every own message up to it is read
+        if (data.up_to_id) {
+            if (data.reader_id === this.currentUserId) {
+                return;
+            }
+            document.querySelectorAll('#messagesList [data-message-id]').forEach(element => {
+                const messageId = parseInt(element.dataset.messageId, 10);
+                if (messageId <= data.up_to_id) {
+                    this.setMessageStatusIcon(element, data.status);
+                }
+            });
+            return;
+        }
+        
         const messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
+        this.setMessageStatusIcon(messageElement, data.status);
+    }
+    
+    setMessageStatusIcon(messageElement, status) {
         if (messageElement) {
             const statusIcon = messageElement.querySelector('.message-status svg');
             if (statusIcon) {
                 statusIcon.className = 'w-4 h-4';
-                if (data.status === 'read') {
+                if (status === 'read') {
                     statusIcon.className += ' text-blue-500';
-                } else if (data.status === 'delivered') {
+                } else if (status === 'delivered') {
                     statusIcon.className += ' text-gray-500';
                 } else {
                     statusIcon.className += ' text-gray-400';
@@ -789,11 +956,53 @@ class ChatApp {
         });
     }
     
+    showContacts() {
+        const resultsContainer = document.getElementById('userSearchResults');
+        if (this.contacts.length === 0) {
+            resultsContainer.innerHTML = '<p class="text-center text-gray-500 dark:text-gray-400 py-4">Type to search users...</p>';
+            return;
+        }
+        this.renderUserItems(resultsContainer, this.contacts);
+    }
+    
+    async loadMoreContacts() {
+        if (!this.contactsCursor || this.loadingContacts) {
+            return;
+        }
+        
+        this.loadingContacts = true;
+        try {
+            const response = await fetch(`/contacts/?cursor=${encodeURIComponent(this.contactsCursor)}`);
+            const data = await response.json();
+            if (!response.ok) {
+                console.error('Failed to load contacts:', data.error);
+                return;
+            }
+            
+            // Online status can change between windows; skip contacts already shown
+            const known = new Set(this.contacts.map(contact => contact.id));
+            this.contacts.push(...data.contacts.filter(contact => !known.has(contact.id)));
+            this.contactsCursor = data.next_cursor;
+            
+            const userSearchInput = document.getElementById('userSearchInput');
+            if (userSearchInput.value.length < 2) {
+                const resultsContainer = document.getElementById('userSearchResults');
+                const scrollTop = resultsContainer.scrollTop;
+                this.showContacts();
+                resultsContainer.scrollTop = scrollTop;
+            }
+        } catch (error) {
+            console.error('Error loading contacts:', error);
+        } finally {
+            this.loadingContacts = false;
+        }
+    }
+    
     async searchUsers(query) {
         const resultsContainer = document.getElementById('userSearchResults');
         
         if (query.length < 2) {
-            resultsContainer.innerHTML = '<p class="text-center text-gray-500 dark:text-gray-400 py-4">Type to search users...</p>';
+            this.showContacts();
             return;
         }
         
@@ -806,27 +1015,7 @@ class ChatApp {
                 return;
             }
             
-            resultsContainer.innerHTML = data.users.map(user => `
-                <div class="user-item p-3 hover:bg-gray-100 dark:hover:bg-gray-600 cursor-pointer rounded-lg transition-colors" data-user-id="${user.id}">
-                    <div class="flex items-center space-x-3">
-                        <div class="relative">
-                            <img src="${user.avatar}" alt="Avatar" class="w-10 h-10 rounded-full">
-                            ${user.is_online ? '<div class="absolute bottom-0 right-0 w-3 h-3 bg-green-400 rounded-full border-2 border-white dark:border-gray-800"></div>' : ''}
-                        </div>
-                        <div>
-                            <h4 class="font-semibold text-gray-900 dark:text-white">${this.escapeHtml(user.display_name)}</h4>
-                            <p class="text-sm text-gray-500 dark:text-gray-400">@${this.escapeHtml(user.username)}</p>
-                        </div>
-                    </div>
-                </div>
-            `).join('');
-            
-            // Add click handlers to user items
-            resultsContainer.querySelectorAll('.user-item').forEach(item => {
-                item.addEventListener('click', () => {
-                    this.startConversation(item.dataset.userId);
-                });
-            });
+            this.renderUserItems(resultsContainer, data.users);
             
         } catch (error) {
             console.error('Error searching users:', error);
@@ -834,6 +1023,30 @@ class ChatApp {
         }
     }
     
+    renderUserItems(resultsContainer, users) {
+        resultsContainer.innerHTML = users.map(user => `
+            <div class="user-item p-3 hover:bg-gray-100 dark:hover:bg-gray-600 cursor-pointer rounded-lg transition-colors" data-user-id="${user.id}">
+                <div class="flex items-center space-x-3">
+                    <div class="relative">
+                        <img src="${user.avatar}" alt="Avatar" class="w-10 h-10 rounded-full" loading="lazy">
+                        ${user.is_online ? '<div class="absolute bottom-0 right-0 w-3 h-3 bg-green-400 rounded-full border-2 border-white dark:border-gray-800"></div>' : ''}
+                    </div>
+                    <div>
+                        <h4 class="font-semibold text-gray-900 dark:text-white">${this.escapeHtml(user.display_name)}</h4>
+                        <p class="text-sm text-gray-500 dark:text-gray-400">@${this.escapeHtml(user.username)}</p>
+                    </div>
+                </div>
+            </div>
+        `).join('');
+        
+        // Add click handlers to user items
+        resultsContainer.querySelectorAll('.user-item').forEach(item => {
+            item.addEventListener('click', () => {
+                this.startConversation(item.dataset.userId);
+            });
+        });
+    }
+    
     async startConversation(userId) {
         try {
             const response = await fetch('/start-conversation/', {
@@ -1569,11 +1782,11 @@ class ChatApp {
     handleFileSelection(file) {
         console.log('🔄 Processing file selection:', file.name);
         
-        // Validate file size (max 10MB)
-        const maxSize = 10 * 1024 * 1024; // 10MB
+        // Validate file size (the server's CHAT_UPLOAD_MAX_SIZE)
+        const maxSize = window.maxUploadSize || 10 * 1024 * 1024;
         if (file.size > maxSize) {
             console.error('❌ File too large:', file.size, 'bytes');
-            alert('File is too large. Maximum size is 10MB.');
+            alert(`File is too large. Maximum size is ${Math.floor(maxSize / (1024 * 1024))}MB.`);
             return;
         }
         
@@ -1758,22 +1971,8 @@ class ChatApp {
             // Show uploading indicator
             this.showUploadingIndicator();
             
-            // Create FormData for file upload
-            const formData = new FormData();
-            formData.append('file', this.selectedFile);
-            formData.append('content', textContent);
-            formData.append('conversation_id', this.conversationId);
-            
-            // Upload file via HTTP POST
-            const response = await fetch('/upload-file/', {
-                method: 'POST',
-                headers: {
-                    'X-CSRFToken': this.getCsrfToken()
-                },
-                body: formData
-            });
-            
-            const data = await response.json();
+            // Upload in resumable chunks; the message is created on finalize
+            const data = await this.uploadInChunks(this.selectedFile, textContent);
             
             if (data.success) {
                 // Send WebSocket message with file info
@@ -1784,7 +1983,9 @@ class ChatApp {
                     'file_name': data.file_name,
                     'file_url': data.file_url,
                     'file_size': data.file_size,
-                    'is_image': data.is_image
+                    'is_image': data.is_image,
+                    'image_width': data.image_width,
+                    'image_height': data.image_height
                 };
                 
                 this.chatSocket.send(JSON.stringify(messageData));
@@ -1812,6 +2013,73 @@ class ChatApp {
         }
     }
     
+    async uploadInChunks(file, content) {
+        const headers = { 'X-CSRFToken': this.getCsrfToken() };
+        const jsonHeaders = { ...headers, 'Content-Type': 'application/json' };
+        
+        const startResponse = await fetch('/uploads/', {
+            method: 'POST',
+            headers: jsonHeaders,
+            body: JSON.stringify({
+                conversation_id: this.conversationId,
+                file_name: file.name,
+                file_size: file.size
+            })
+        });
+        const upload = await startResponse.json();
+        if (!startResponse.ok) {
+            throw new Error(upload.error || 'File upload failed');
+        }
+        
+        const uploadUrl = `/uploads/${upload.upload_id}/`;
+        let offset = 0;
+        let failures = 0;
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`${uploadUrl}chunk/?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: headers,
+                    body: file.slice(offset, offset + upload.chunk_size)
+                });
+                const result = await response.json();
+                if (response.ok) {
+                    offset = result.offset;
+                    failures = 0;
+                    continue;
+                }
+                if (result.offset === undefined) {
+                    const error = new Error(result.error || 'File upload failed');
+                    error.fatal = true;
+                    throw error;
+                }
+                // The server says where to resume
+                offset = result.offset;
+                failures++;
+            } catch (error) {
+                if (error.fatal || ++failures > 5) {
+                    throw error;
+                }
+                // Dropped connection: wait, then resume where the server stopped
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                try {
+                    const status = await fetch(uploadUrl);
+                    if (status.ok) {
+                        offset = (await status.json()).offset;
+                    }
+                } catch (statusError) {
+                    console.warn('Upload status unavailable, retrying:', statusError);
+                }
+            }
+        }
+        
+        const finalizeResponse = await fetch(`${uploadUrl}finalize/`, {
+            method: 'POST',
+            headers: jsonHeaders,
+            body: JSON.stringify({ content: content })
+        });
+        return finalizeResponse.json();
+    }
+    
     showUploadingIndicator() {
         const sendBtn = document.getElementById('sendBtn');
         if (sendBtn) {
@@ -1843,10 +2111,14 @@ class ChatApp {
             // Image message
             fileContainer.className = 'file-message image-message';
             const img = document.createElement('img');
-            img.src = data.file_url;
             img.alt = data.file_name || 'Image';
-            img.className = 'max-w-full max-h-64 rounded-lg cursor-pointer hover:opacity-90 transition-opacity';
+            img.loading = 'lazy';
+            img.decoding = 'async';
+            img.className = 'attachment-image max-w-full max-h-64 rounded-lg cursor-pointer hover:opacity-90 transition-opacity';
+            // The full image only opens on click; the bubble shows the thumbnail when there is one
             img.onclick = () => window.open(data.file_url, '_blank');
+            this.applyAttachmentPreview(img, { ...data, ...this.pendingAttachments.get(data.message_id) });
+            this.pendingAttachments.delete(data.message_id);
             fileContainer.appendChild(img);
         } else {
             // Regular file message
@@ -1891,6 +2163,35 @@ class ChatApp {
         return fileContainer;
     }
     
+    applyAttachmentPreview(img, preview) {
+        // Known dimensions reserve the image's box, so nothing shifts when it loads
+        if (preview.image_width && preview.image_height) {
+            img.width = preview.image_width;
+            img.height = preview.image_height;
+            img.style.aspectRatio = `${preview.image_width} / ${preview.image_height}`;
+            img.style.height = 'auto';
+        }
+        if (preview.placeholder) {
+            img.style.backgroundImage = `url("${preview.placeholder}")`;
+            img.style.backgroundSize = 'cover';
+            img.addEventListener('load', () => { img.style.backgroundImage = ''; }, { once: true });
+        }
+        const src = preview.thumbnail_url || preview.file_url;
+        if (src && img.getAttribute('src') !== src) {
+            img.src = src;
+        }
+    }
+    
+    handleAttachmentReady(data) {
+        const img = document.querySelector(`[data-message-id="${data.message_id}"] img.attachment-image`);
+        if (img) {
+            this.applyAttachmentPreview(img, data);
+        } else {
+            // The file message itself has not been displayed yet
+            this.pendingAttachments.set(data.message_id, data);
+        }
+    }
+    
     getFileIconByName(fileName) {
         if (!fileName) return this.getGenericFileIcon();
         
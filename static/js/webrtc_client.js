@@ -9,6 +9,12 @@ class WebRTCClient {
         this.isInitiator = false;
         this.currentCall = null;
         
+        // Trickled ICE candidates are sent in batches; remote ones wait for the remote description
+        this.iceBatchDelay = 50;
+        this.outgoingCandidates = [];
+        this.outgoingCandidatesTimer = null;
+        this.pendingRemoteCandidates = [];
+        
         // WebRTC configuration with STUN servers
         this.rtcConfiguration = {
             iceServers: [
@@ -111,6 +117,10 @@ class WebRTCClient {
                 this.handleWebRTCIceCandidate(data);
                 return true;
                 
+            case 'webrtc_ice_candidates':
+                this.handleWebRTCIceCandidates(data);
+                return true;
+                
             default:
                 return false; // Message not handled
         }
@@ -294,11 +304,10 @@ class WebRTCClient {
             // Handle ICE candidates
             this.peerConnection.onicecandidate = (event) => {
                 if (event.candidate) {
-                    console.log('Sending ICE candidate');
-                    this.sendSignalingMessage('webrtc_ice_candidate', {
-                        call_id: callId,
-                        candidate: event.candidate
-                    });
+                    this.queueIceCandidate(callId, event.candidate);
+                } else {
+                    // Gathering finished: send whatever is still queued
+                    this.flushIceCandidates(callId);
                 }
             };
             
@@ -357,6 +366,7 @@ class WebRTCClient {
             }
             
             await this.peerConnection.setRemoteDescription(data.offer);
+            await this.addPendingRemoteCandidates();
             
             const answer = await this.peerConnection.createAnswer();
             await this.peerConnection.setLocalDescription(answer);
@@ -379,6 +389,7 @@ class WebRTCClient {
             
             if (this.peerConnection) {
                 await this.peerConnection.setRemoteDescription(data.answer);
+                await this.addPendingRemoteCandidates();
             }
             
         } catch (error) {
@@ -389,18 +400,62 @@ class WebRTCClient {
     
     // Handle ICE candidate
     async handleWebRTCIceCandidate(data) {
-        try {
-            console.log('Received ICE candidate');
-            
-            if (this.peerConnection && this.peerConnection.remoteDescription) {
-                await this.peerConnection.addIceCandidate(data.candidate);
+        await this.addRemoteCandidates([data.candidate]);
+    }
+    
+    // Handle a batch of ICE candidates coalesced by the server
+    async handleWebRTCIceCandidates(data) {
+        console.log(`Received ${data.candidates.length} ICE candidates`);
+        await this.addRemoteCandidates(data.candidates);
+    }
+    
+    async addRemoteCandidates(candidates) {
+        if (!this.peerConnection || !this.peerConnection.remoteDescription) {
+            // The offer/answer is still being applied; add these right after it
+            this.pendingRemoteCandidates.push(...candidates);
+            return;
+        }
+        
+        for (const candidate of candidates) {
+            try {
+                await this.peerConnection.addIceCandidate(candidate);
+            } catch (error) {
+                console.error('Error handling ICE candidate:', error);
             }
-            
-        } catch (error) {
-            console.error('Error handling ICE candidate:', error);
         }
     }
     
+    async addPendingRemoteCandidates() {
+        const candidates = this.pendingRemoteCandidates;
+        this.pendingRemoteCandidates = [];
+        if (candidates.length) {
+            await this.addRemoteCandidates(candidates);
+        }
+    }
+    
+    // Collect local candidates for a short window and send them as one frame
+    queueIceCandidate(callId, candidate) {
+        this.outgoingCandidates.push(candidate);
+        if (!this.outgoingCandidatesTimer) {
+            this.outgoingCandidatesTimer = setTimeout(() => this.flushIceCandidates(callId), this.iceBatchDelay);
+        }
+    }
+    
+    flushIceCandidates(callId) {
+        clearTimeout(this.outgoingCandidatesTimer);
+        this.outgoingCandidatesTimer = null;
+        if (!this.outgoingCandidates.length) {
+            return;
+        }
+        
+        console.log(`Sending ${this.outgoingCandidates.length} ICE candidates`);
+        this.sendSignalingMessage('webrtc_ice_candidates', {
+            call_id: callId,
+            candidates: this.outgoingCandidates
+        });
+        this.outgoingCandidates = [];
+    }
+    
     // Send signaling message through WebSocket
     sendSignalingMessage(type, data) {
         if (this.chatApp.chatSocket && this.chatApp.chatSocket.readyState === WebSocket.OPEN) {
@@ -429,8 +484,13 @@ class WebRTCClient {
     
     // Handle call ended
     handleCallEnded(data) {
-        console.log('Call ended by:', data.ended_by);
+        console.log('Call ended by:', data.ended_by, 'reason:', data.reason);
+        this.hideIncomingCallUI();
+        this.hideOutgoingCallUI();
         this.hideCallUI();
+        if (data.reason === 'missed') {
+            this.showError('Call was not answered');
+        }
         this.cleanup();
     }
     
@@ -544,6 +604,12 @@ class WebRTCClient {
             this.userSocket.close();
         }
         
+        // Drop queued candidates of the finished call
+        clearTimeout(this.outgoingCandidatesTimer);
+        this.outgoingCandidatesTimer = null;
+        this.outgoingCandidates = [];
+        this.pendingRemoteCandidates = [];
+        
         // Reset state
         this.remoteStream = null;
         this.isCallActive = false;
@@ -579,9 +645,9 @@ class WebRTCClient {
             
             console.log('📱 Modal content set - caller:', data.caller_name, 'type:', data.call_type);
             
-            // Set caller avatar (you might need to fetch this from server)
+            // Set caller avatar (redirects to the uploaded picture or the initials avatar)
             if (callerAvatar) {
-                callerAvatar.src = `https://ui-avatars.com/api/?background=random&name=${encodeURIComponent(data.caller_name)}&size=80`;
+                callerAvatar.src = `/avatars/user/${data.caller_id}/?size=80`;
                 console.log('📱 Avatar set for:', data.caller_name);
             }
             
@@ -642,7 +708,7 @@ class WebRTCClient {
             
             // Set callee avatar
             if (calleeAvatar) {
-                calleeAvatar.src = `https://ui-avatars.com/api/?background=random&name=User${calleeId}&size=80`;
+                calleeAvatar.src = `/avatars/user/${calleeId}/?size=80`;
             }
             
             // Remove old event listener and add new one
@@ -739,6 +805,11 @@ class WebRTCClient {
     
     // User WebSocket connection for receiving call notifications
     connectUserSocket() {
+        // The multiplexed chat socket already receives call notifications
+        if (this.chatApp && this.chatApp.multiplexed) {
+            return;
+        }
+        
         const wsScheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
         const wsUrl = `${wsScheme}://${window.location.host}/ws/user/`;
         
@@ -749,6 +820,14 @@ class WebRTCClient {
             
             this.userSocket.onopen = (e) => {
                 console.log('User WebSocket connected successfully');
+                
+                // Keep this socket counted as online; the server expires silent sockets
+                clearInterval(this.userHeartbeatTimer);
+                this.userHeartbeatTimer = setInterval(() => {
+                    if (this.userSocket && this.userSocket.readyState === WebSocket.OPEN) {
+                        this.userSocket.send(JSON.stringify({ 'type': 'heartbeat' }));
+                    }
+                }, 30000);
             };
             
             this.userSocket.onmessage = (e) => {
@@ -763,6 +842,11 @@ class WebRTCClient {
                     
                     const handled = this.handleCallMessage(data);
                     console.log('📨 Message handled by WebRTC client:', handled);
+                    
+                    // Contacts' presence changes are published to the user socket
+                    if (!handled && data.type === 'user_status' && this.chatApp) {
+                        this.chatApp.updateUserStatus(data);
+                    }
                 } catch (error) {
                     console.error('📨 Error parsing user WebSocket message:', error, 'Raw data:', e.data);
                 }
@@ -770,6 +854,7 @@ class WebRTCClient {
             
             this.userSocket.onclose = (e) => {
                 console.log('User WebSocket closed:', e.code, e.reason);
+                clearInterval(this.userHeartbeatTimer);
                 
                 // Attempt to reconnect after 3 seconds
                 if (e.code !== 1000) {
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Call setup benchmark: WebRTC signalling with and without the call session
+registry and ICE candidate coalescing.
+
+Drives chatproject.asgi.application in-process with two logged-in users on the
+multiplexed socket and runs complete call setups:
+
+    call_initiate -> incoming_call -> call_accept -> call_accepted
+    -> webrtc_offer -> webrtc_answer -> N ICE candidates each way -> call_end
+
+For each mode it reports setup latency (initiate until both peers have every
+candidate), the DB queries spent on signalling frames (offer, answer, ICE),
+and the channel-layer sends and websocket frames a call setup costs.
+Candidates are sent one frame each, like a browser trickling them, so the
+coalescing shown is done by the server.
+
+    python tools/call_benchmark.py --calls 50 --candidates 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from ws_benchmark import InProcessClient, QueryCounter, percentile, setup_fixtures  # noqa: E402
+
+
+async def expect(client, frame_type, timeout):
+    """Read frames until one of the given type arrives"""
+    while True:
+        frame = await client.recv(timeout)
+        if frame.get('type') == frame_type:
+            return frame
+
+
+async def connect(application, spec, timeout):
+    client = InProcessClient(application, '/ws/stream/', spec['cookie'])
+    if not await client.connect(timeout):
+        raise ConnectionError('websocket connection refused')
+    await client.send({'type': 'subscribe', 'conversation_id': spec['conversation_id']})
+    await expect(client, 'subscribed', timeout)
+    return client
+
+
+class LayerSendCounter:
+    """Counts group_send calls on the shared channel layer"""
+
+    def __init__(self, channel_layer):
+        self.count = 0
+        original = channel_layer.group_send
+
+        async def group_send(group, message):
+            self.count += 1
+            return await original(group, message)
+
+        channel_layer.group_send = group_send
+
+
+async def run_call(caller, callee, callee_id, candidates, queries, sends, timeout):
+    started = time.perf_counter()
+    await caller.send({'type': 'call_initiate', 'callee_id': callee_id, 'call_type': 'video'})
+    call_id = (await expect(callee, 'incoming_call', timeout))['call_id']
+    await callee.send({'type': 'call_accept', 'call_id': call_id})
+    await expect(caller, 'call_accepted', timeout)
+
+    signalling_queries = queries.count
+    signalling_sends = sends.count
+    await caller.send({'type': 'webrtc_offer', 'call_id': call_id, 'offer': {'type': 'offer', 'sdp': 'v=0'}})
+    await expect(callee, 'webrtc_offer', timeout)
+    await callee.send({'type': 'webrtc_answer', 'call_id': call_id, 'answer': {'type': 'answer', 'sdp': 'v=0'}})
+    await expect(caller, 'webrtc_answer', timeout)
+
+    async def trickle(sender, receiver):
+        for index in range(candidates):
+            await sender.send({
+                'type': 'webrtc_ice_candidate',
+                'call_id': call_id,
+                'candidate': {'candidate': f'candidate:{index} 1 udp 2122260223 10.0.0.1 {50000 + index} typ host',
+                              'sdpMid': '0', 'sdpMLineIndex': 0},
+            })
+        received = frames = 0
+        while received < candidates:
+            frame = await receiver.recv(timeout)
+            if frame.get('type') == 'webrtc_ice_candidate':
+                received += 1
+            elif frame.get('type') == 'webrtc_ice_candidates':
+                received += len(frame['candidates'])
+            else:
+                continue
+            frames += 1
+        return frames
+
+    candidate_frames = sum(await asyncio.gather(trickle(caller, callee), trickle(callee, caller)))
+    setup_ms = (time.perf_counter() - started) * 1000
+    signalling_queries = queries.count - signalling_queries
+    signalling_sends = sends.count - signalling_sends
+
+    await caller.send({'type': 'call_end', 'call_id': call_id})
+    await expect(callee, 'call_ended', timeout)
+    return setup_ms, signalling_queries, signalling_sends, candidate_frames
+
+
+async def run_mode(application, specs, backend, ice_window, args, queries, sends):
+    from chat import call_sessions
+    from chat.ice_batching import ice_batcher
+    call_sessions.store = call_sessions.build_store(backend)
+    ice_batcher.window = ice_window
+
+    caller = await connect(application, specs[0], args.timeout)
+    callee = await connect(application, specs[1], args.timeout)
+    setups, signalling, layer_sends, candidate_frames = [], [], [], []
+    try:
+        for _ in range(args.calls):
+            setup_ms, query_count, send_count, frame_count = await run_call(
+                caller, callee, specs[1]['user_id'], args.candidates, queries, sends, args.timeout
+            )
+            setups.append(setup_ms)
+            signalling.append(query_count)
+            layer_sends.append(send_count)
+            candidate_frames.append(frame_count)
+    finally:
+        await caller.close()
+        await callee.close()
+
+    setups.sort()
+    frames = 2 + 2 * args.candidates
+    return {
+        'registry': backend,
+        'ice_window_ms': round(ice_window * 1000),
+        'calls': args.calls,
+        'candidates_per_peer': args.candidates,
+        'setup_p50_ms': round(percentile(setups, 50), 2),
+        'setup_p95_ms': round(percentile(setups, 95), 2),
+        'setup_p99_ms': round(percentile(setups, 99), 2),
+        'signalling_queries_per_call': round(sum(signalling) / len(signalling), 2),
+        'queries_per_signalling_frame': round(sum(signalling) / len(signalling) / frames, 3),
+        'layer_sends_per_call': round(sum(layer_sends) / len(layer_sends), 2),
+        'candidate_frames_per_call': round(sum(candidate_frames) / len(candidate_frames), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=50, help='Call setups per mode')
+    parser.add_argument('--candidates', type=int, default=20, help='ICE candidates sent by each peer')
+    parser.add_argument('--ice-window', type=float, default=0.05, help='Coalescing window for the batched mode')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--output', help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix='chat-callbench-')
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'chatproject.settings',
+        'SQLITE_PATH': os.path.join(scratch_dir, 'benchmark.sqlite3'),
+    })
+    os.environ.setdefault('CHANNEL_LAYER', 'memory')
+
+    import django
+    django.setup()
+
+    try:
+        specs = setup_fixtures(2)
+        from chatproject.asgi import application
+
+        from channels.layers import get_channel_layer
+
+        queries = QueryCounter()
+        queries.install()
+        sends = LayerSendCounter(get_channel_layer())
+
+        async def run_all():
+            return [
+                await run_mode(application, specs, backend, ice_window, args, queries, sends)
+                for backend, ice_window in (('none', 0), ('local', 0), ('local', args.ice_window))
+            ]
+
+        # Consumers print every call event; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            reports = asyncio.run(run_all())
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    print(f"{'registry':<10} {'ice ms':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries/call':>13} "
+          f"{'sends/call':>11} {'ice frames/call':>16}")
+    for report in reports:
+        print(f"{report['registry']:<10} {report['ice_window_ms']:>6} {report['setup_p50_ms']:>8} "
+              f"{report['setup_p95_ms']:>8} {report['setup_p99_ms']:>8} {report['signalling_queries_per_call']:>13} "
+              f"{report['layer_sends_per_call']:>11} {report['candidate_frames_per_call']:>16}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(reports, handle, indent=2)
+        print(f'Report written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""
+Database profile benchmark: SQLite (WAL vs rollback journal) and PostgreSQL.
+
+Runs the chat's two hottest database workloads against each profile in a
+fresh process with a scratch database:
+
+    message_insert          the consumer's per-frame save path, run from
+                            concurrent threads (Message insert,
+                            Conversation.updated_at, inbox update)
+    message_insert_batched  the write-behind path: write_batch() of 100 messages
+    inbox_read              the chat_home sidebar query, run by concurrent
+                            readers while one writer keeps inserting messages
+
+Usage:
+
+    python tools/db_benchmark.py                      # sqlite-wal and sqlite-delete
+    python tools/db_benchmark.py --postgres           # also PostgreSQL, from POSTGRES_* settings
+
+The Postgres profile creates and drops a test_<POSTGRES_DB> database, so the
+configured user needs CREATEDB. The results are printed and written as JSON.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+PROFILES = {
+    'sqlite-wal': {'DATABASE_ENGINE': 'sqlite', 'SQLITE_JOURNAL_MODE': 'wal'},
+    'sqlite-delete': {'DATABASE_ENGINE': 'sqlite', 'SQLITE_JOURNAL_MODE': 'delete'},
+    'postgres': {'DATABASE_ENGINE': 'postgres'},
+}
+BATCH_SIZE = 100
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, errors, seconds, operations):
+    latencies = sorted(latencies)
+    return {
+        'operations': operations,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'ops_per_sec': round(operations / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+    }
+
+
+def setup_fixtures(user_count, conversations_per_user):
+    """Bulk-create users, conversations and their inbox rows"""
+    from django.contrib.auth.models import User
+    from chat.models import Conversation, ConversationInbox, UserProfile
+
+    User.objects.bulk_create(
+        [User(username=f'dbbench_{index:05d}', password='!') for index in range(user_count)], batch_size=500
+    )
+    user_ids = list(User.objects.filter(username__startswith='dbbench_').values_list('id', flat=True))
+    UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in user_ids], batch_size=500)
+
+    pairs = set()
+    for user_id in user_ids:
+        for other_id in random.sample(user_ids, min(conversations_per_user, len(user_ids) - 1) + 1):
+            if other_id != user_id:
+                pairs.add((min(user_id, other_id), max(user_id, other_id)))
+    pairs = sorted(pairs)
+
+    Conversation.objects.bulk_create([Conversation() for _ in pairs], batch_size=500)
+    conversation_ids = list(Conversation.objects.order_by('id').values_list('id', flat=True))
+    Participant = Conversation.participants.through
+    Participant.objects.bulk_create([
+        Participant(conversation_id=conversation_id, user_id=user_id)
+        for conversation_id, pair in zip(conversation_ids, pairs)
+        for user_id in pair
+    ], batch_size=500)
+    ConversationInbox.objects.bulk_create([
+        ConversationInbox(conversation_id=conversation_id, user_id=user_id, other_user_id=other_id)
+        for conversation_id, (first, second) in zip(conversation_ids, pairs)
+        for user_id, other_id in ((first, second), (second, first))
+    ], batch_size=500)
+    return user_ids, list(zip(conversation_ids, pairs))
+
+
+def run_threads(threads, target):
+    """Run target(index, results) in parallel threads and return the merged results"""
+    from django.db import connections
+
+    results = [{'latencies': [], 'errors': 0, 'operations': 0} for _ in range(threads)]
+
+    def wrapper(index):
+        try:
+            target(index, results[index])
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=wrapper, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    return summarize(
+        [latency for result in results for latency in result['latencies']],
+        sum(result['errors'] for result in results),
+        seconds,
+        sum(result['operations'] for result in results),
+    )
+
+
+def save_message(conversation_id, sender_id, content):
+    """Same statements as ChatConsumer.save_message"""
+    from django.utils import timezone
+    from chat import inbox
+    from chat.models import Conversation, Message
+
+    conversation = Conversation.objects.get(id=conversation_id)
+    message = Message.objects.create(conversation=conversation, sender_id=sender_id, content=content)
+    conversation.updated_at = timezone.now()
+    conversation.save()
+    inbox.record_new_message(message)
+
+
+def message_insert(conversations, threads, per_thread):
+    def work(index, result):
+        rng = random.Random(index)
+        for sequence in range(per_thread):
+            conversation_id, pair = rng.choice(conversations)
+            started = time.perf_counter()
+            try:
+                save_message(conversation_id, rng.choice(pair), f'benchmark {index}-{sequence}')
+                result['operations'] += 1
+            except Exception:
+                result['errors'] += 1
+            result['latencies'].append((time.perf_counter() - started) * 1000)
+
+    return run_threads(threads, work)
+
+
+def message_insert_batched(conversations, threads, per_thread):
+    from django.utils import timezone
+    from chat import snowflake
+    from chat.message_writer import write_batch
+    from chat.models import Message
+
+    def work(index, result):
+        rng = random.Random(index)
+        for start in range(0, per_thread, BATCH_SIZE):
+            batch = []
+            for sequence in range(start, min(start + BATCH_SIZE, per_thread)):
+                conversation_id, pair = rng.choice(conversations)
+                batch.append(Message(
+                    id=snowflake.next_id(),
+                    conversation_id=conversation_id,
+                    sender_id=rng.choice(pair),
+                    content=f'benchmark {index}-{sequence}',
+                    timestamp=timezone.now(),
+                ))
+            started = time.perf_counter()
+            try:
+                write_batch(batch)
+                result['operations'] += len(batch)
+            except Exception:
+                result['errors'] += len(batch)
+            # Per-message cost of the batch, comparable with message_insert
+            result['latencies'].extend([(time.perf_counter() - started) * 1000 / len(batch)] * len(batch))
+
+    return run_threads(threads, work)
+
+
+def inbox_read(user_ids, conversations, threads, per_thread):
+    from chat.models import ConversationInbox
+
+    stop = threading.Event()
+    writer_result = {'operations': 0, 'errors': 0}
+
+    def background_writer():
+        from django.db import connections
+        rng = random.Random(-1)
+        while not stop.is_set():
+            conversation_id, pair = rng.choice(conversations)
+            try:
+                save_message(conversation_id, rng.choice(pair), 'background write')
+                writer_result['operations'] += 1
+            except Exception:
+                writer_result['errors'] += 1
+        connections.close_all()
+
+    def work(index, result):
+        rng = random.Random(index)
+        for _ in range(per_thread):
+            user_id = rng.choice(user_ids)
+            started = time.perf_counter()
+            try:
+                # The chat_home sidebar query
+                list(ConversationInbox.objects.filter(
+                    user_id=user_id,
+                    other_user__isnull=False
+                ).select_related('other_user__userprofile'))
+                result['operations'] += 1
+            except Exception:
+                result['errors'] += 1
+            result['latencies'].append((time.perf_counter() - started) * 1000)
+
+    writer = threading.Thread(target=background_writer)
+    writer.start()
+    try:
+        summary = run_threads(threads, work)
+    finally:
+        stop.set()
+        writer.join()
+    summary['concurrent_writes'] = writer_result['operations']
+    summary['concurrent_write_errors'] = writer_result['errors']
+    return summary
+
+
+def run_profile(name, options, results):
+    """Worker process entry point: benchmark one database profile"""
+    os.environ.update(PROFILES[name])
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'chatproject.settings'
+    scratch_dir = tempfile.mkdtemp(prefix='chat-dbbench-')
+    os.environ['SQLITE_PATH'] = os.path.join(scratch_dir, 'benchmark.sqlite3')
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+
+    test_database = None
+    try:
+        if connection.vendor == 'postgresql':
+            test_database = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        else:
+            call_command('migrate', verbosity=0)
+
+        random.seed(0)
+        user_ids, conversations = setup_fixtures(options['users'], options['conversations_per_user'])
+        report = {'profile': name, 'vendor': connection.vendor, 'conversations': len(conversations)}
+        report['message_insert'] = message_insert(conversations, options['threads'], options['messages'])
+        report['message_insert_batched'] = message_insert_batched(
+            conversations, options['threads'], options['messages']
+        )
+        report['inbox_read'] = inbox_read(user_ids, conversations, options['threads'], options['reads'])
+    except Exception as e:
+        report = {'profile': name, 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        if test_database:
+            connection.creation.destroy_test_db(test_database, verbosity=0)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    results.put(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres', action='store_true', help='Also benchmark PostgreSQL (POSTGRES_* settings)')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), help='Explicit list of profiles')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent database threads')
+    parser.add_argument('--messages', type=int, default=500, help='Messages inserted per thread')
+    parser.add_argument('--reads', type=int, default=500, help='Inbox reads per thread')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conversations-per-user', type=int, default=10)
+    parser.add_argument('--output', help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    profiles = args.profiles or ['sqlite-wal', 'sqlite-delete'] + (['postgres'] if args.postgres else [])
+    options = {
+        'threads': args.threads,
+        'messages': args.messages,
+        'reads': args.reads,
+        'users': args.users,
+        'conversations_per_user': args.conversations_per_user,
+    }
+
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    for name in profiles:
+        print(f'Benchmarking {name}...')
+        results = context.Queue()
+        process = context.Process(target=run_profile, args=(name, options, results))
+        process.start()
+        reports.append(results.get())
+        process.join()
+
+    print(f"\n{'profile':<15} {'workload':<24} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for report in reports:
+        if 'error' in report:
+            print(f"{report['profile']:<15} FAILED: {report['error']}")
+            continue
+        for workload in ('message_insert', 'message_insert_batched', 'inbox_read'):
+            row = report[workload]
+            print(f"{report['profile']:<15} {workload:<24} {row['ops_per_sec']:>9} {row['p50_ms']:>8} "
+                  f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['errors']:>7}")
+
+    output = args.output or f'db-benchmark-{datetime.now():%Y%m%d-%H%M%S}.json'
+    with open(output, 'w') as handle:
+        json.dump({'options': options, 'results': reports}, handle, indent=2)
+    print(f'\nReport written to {output}')
+    return 1 if any('error' in report for report in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Multi-worker channel layer harness.
+
+Spins up N worker processes that share one Redis-protocol channel layer and
+proves that chat messages, typing indicators and call signalling reach
+sockets living in *other* processes, i.e. that the deployment works with
+more than one Daphne worker.
+
+Each worker runs the real ChatConsumer in-process through channels'
+WebsocketCommunicator. Worker 0 hosts the caller's socket, every other
+worker hosts one socket ("tab") of the callee.
+
+By default a local fakeredis TCP server is started as the stand-in, so no
+real Redis is needed:
+
+    pip install "fakeredis[lua]"
+    python tools/multiworker_harness.py --workers 4
+
+Point it at a real server instead with --redis-url redis://host:6379/0.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+RECEIVER_EXPECTED = {'message', 'typing', 'incoming_call'}
+CALLER_EXPECTED = {'call_accepted'}
+
+
+def start_fake_redis():
+    """Start a fakeredis TCP server on a free port and return (server, url)"""
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        sys.exit('fakeredis is not installed. Run: pip install "fakeredis[lua]" or pass --redis-url')
+
+    server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    return server, f'redis://{host}:{port}/0'
+
+
+def setup_fixtures():
+    """Create the caller, the callee and their conversation in the scratch database"""
+    from django.core.management import call_command
+    from django.contrib.auth.models import User
+    from chat.models import Conversation
+
+    call_command('migrate', verbosity=0)
+    caller = User.objects.create_user('harness_caller', password='harness')
+    callee = User.objects.create_user('harness_callee', password='harness')
+    conversation = Conversation.objects.create()
+    conversation.participants.add(caller, callee)
+    return caller.id, callee.id, conversation.id
+
+
+def run_worker(index, conversation_id, user_id, peer_id, barrier, results, timeout, verbose):
+    """Worker process entry point"""
+    import django
+    django.setup()
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        try:
+            result = asyncio.run(
+                _worker_main(index, conversation_id, user_id, peer_id, barrier, timeout)
+            )
+        except Exception as e:
+            result = {'worker': index, 'error': f'{type(e).__name__}: {e}'}
+    result['pid'] = os.getpid()
+    results.put(result)
+
+
+async def _worker_main(index, conversation_id, user_id, peer_id, barrier, timeout):
+    from channels.db import database_sync_to_async
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from django.contrib.auth.models import User
+    from chat.routing import websocket_urlpatterns
+
+    role = 'caller' if index == 0 else 'callee'
+    expected = CALLER_EXPECTED if role == 'caller' else RECEIVER_EXPECTED
+    user = await database_sync_to_async(User.objects.get)(id=user_id)
+
+    communicator = WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns),
+        f'/ws/chat/{conversation_id}/'
+    )
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect(timeout=timeout)
+    if not connected:
+        return {'worker': index, 'role': role, 'error': 'websocket connection refused'}
+
+    # Wait until every worker has joined its groups before anyone sends
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, barrier.wait, timeout)
+
+    if role == 'caller':
+        await communicator.send_to(text_data=json.dumps({'type': 'message', 'message': 'cross-worker hello'}))
+        await communicator.send_to(text_data=json.dumps({'type': 'typing', 'is_typing': True}))
+        await communicator.send_to(text_data=json.dumps({
+            'type': 'call_initiate',
+            'call_type': 'audio',
+            'callee_id': peer_id,
+        }))
+
+    received = set()
+    latencies = {}
+    started = time.perf_counter()
+    deadline = started + timeout
+    while not expected <= received and time.perf_counter() < deadline:
+        try:
+            frame = json.loads(await communicator.receive_from(timeout=deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            break
+        frame_type = frame.get('type')
+        if frame_type not in received:
+            latencies[frame_type] = round((time.perf_counter() - started) * 1000, 2)
+        received.add(frame_type)
+
+        # The first callee tab answers the call so the caller sees signalling come back
+        if role == 'callee' and index == 1 and frame_type == 'incoming_call':
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'call_accept',
+                'call_id': frame['call_id'],
+            }))
+
+    await communicator.disconnect()
+    return {
+        'worker': index,
+        'role': role,
+        'expected': sorted(expected),
+        'received': sorted(received & expected),
+        'missing': sorted(expected - received),
+        'latency_ms': {key: value for key, value in latencies.items() if key in expected},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3, help='Number of worker processes (at least 2)')
+    parser.add_argument('--redis-url', help='Use an existing Redis instead of a local fakeredis server')
+    parser.add_argument('--layer', choices=['redis', 'redis_pubsub'], default='redis', help='Channel layer profile to test')
+    parser.add_argument('--timeout', type=float, default=15.0, help='Seconds to wait for delivery')
+    parser.add_argument('--verbose', action='store_true', help='Show consumer output from the workers')
+    args = parser.parse_args()
+
+    if args.workers < 2:
+        parser.error('--workers must be at least 2 to test cross-worker delivery')
+
+    server = None
+    if args.redis_url:
+        redis_url = args.redis_url
+    else:
+        server, redis_url = start_fake_redis()
+
+    scratch_dir = tempfile.mkdtemp(prefix='chat-harness-')
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'chatproject.settings',
+        'SQLITE_PATH': os.path.join(scratch_dir, 'harness.sqlite3'),
+        'CHANNEL_LAYER': args.layer,
+        'REDIS_URL': redis_url,
+        'CHANNEL_LAYER_PREFIX': f'harness{os.getpid()}',
+    })
+
+    import django
+    django.setup()
+
+    try:
+        caller_id, callee_id, conversation_id = setup_fixtures()
+        print(f'Channel layer: {args.layer} at {redis_url}')
+        print(f'Starting {args.workers} workers (1 caller, {args.workers - 1} callee tabs)...')
+
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(args.workers)
+        results = context.Queue()
+        processes = []
+        for index in range(args.workers):
+            user_id, peer_id = (caller_id, callee_id) if index == 0 else (callee_id, caller_id)
+            process = context.Process(
+                target=run_worker,
+                args=(index, conversation_id, user_id, peer_id, barrier, results, args.timeout, args.verbose)
+            )
+            process.start()
+            processes.append(process)
+
+        outcomes = [results.get(timeout=args.timeout * 3) for _ in processes]
+        for process in processes:
+            process.join(timeout=args.timeout)
+
+        failed = False
+        for outcome in sorted(outcomes, key=lambda item: item['worker']):
+            if outcome.get('error') or outcome['missing']:
+                failed = True
+                status = f"FAIL {outcome.get('error') or 'missing ' + ', '.join(outcome['missing'])}"
+            else:
+                status = 'OK'
+            print(f"worker {outcome['worker']} (pid {outcome['pid']}, {outcome.get('role', '?')}): "
+                  f"{status} {outcome.get('latency_ms', {})}")
+
+        if failed:
+            print('Cross-worker delivery FAILED')
+            return 1
+        print('Cross-worker delivery OK')
+        return 0
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,617 @@
+#!/usr/bin/env python
+"""
+WebSocket load and latency benchmark for the realtime chat path.
+
+Simulates many concurrent users paired into one-to-one conversations. Every
+user connects, then for a number of rounds sends a typing frame, a chat
+message, a reaction on the last message from its peer, and a read receipt.
+Latency is measured from the moment a frame is sent to the moment the
+matching event reaches the peer's socket.
+
+Two modes are available:
+
+    # Drive chatproject.asgi.application in this process (WebsocketCommunicator)
+    python tools/ws_benchmark.py --mode inprocess --users 2000
+
+    # Start a real Daphne server and connect over TCP (pip install websockets)
+    python tools/ws_benchmark.py --mode daphne --users 2000
+
+The report contains p50/p95/p99 send-to-deliver latency per event type,
+messages/sec, DB queries per frame (in-process mode only), and memory per
+connection. The report is written as JSON. Pass --baseline with an earlier
+report to fail on regressions between releases.
+
+Each run uses a scratch SQLite database. The channel layer comes from the
+usual CHANNEL_LAYER / REDIS_URL settings, and defaults to the in-memory layer.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+EVENT_KINDS = ('message', 'typing', 'reaction', 'read')
+REACTION_EMOJIS = ['👍', '❤️', '😂', '😮', '😢', '🔥']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def rss_kb(pid=None):
+    """Resident set size of a process in KiB (Linux /proc, falling back to ru_maxrss for ourselves)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def raise_file_limit():
+    """Thousands of sockets need more file descriptors than the usual soft limit"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    """Counts SQL statements on every database connection, whichever thread opened it"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        def on_created(sender, connection, **kwargs):
+            if self not in connection.execute_wrappers:
+                connection.execute_wrappers.append(self)
+
+        self._receiver = on_created
+        connection_created.connect(on_created, weak=False)
+        for connection in connections.all():
+            if self not in connection.execute_wrappers:
+                connection.execute_wrappers.append(self)
+
+
+def setup_fixtures(user_count):
+    """Create paired users, their conversations and logged-in sessions in bulk"""
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.contrib.sessions.models import Session
+    from django.core.management import call_command
+    from django.utils import timezone
+    from django.utils.crypto import get_random_string
+    from chat.models import Conversation, UserProfile
+
+    call_command('migrate', verbosity=0)
+
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        [User(username=f'bench_{index:05d}', password=password) for index in range(user_count)],
+        batch_size=500
+    )
+    users = list(User.objects.filter(username__startswith='bench_').order_by('id'))
+    UserProfile.objects.bulk_create(
+        [UserProfile(user=user) for user in users], batch_size=500, ignore_conflicts=True
+    )
+
+    conversations = Conversation.objects.bulk_create(
+        [Conversation() for _ in range(user_count // 2)], batch_size=500
+    )
+    if conversations[0].pk is None:
+        conversations = list(Conversation.objects.order_by('id'))
+    Participant = Conversation.participants.through
+    Participant.objects.bulk_create([
+        Participant(conversation_id=conversation.pk, user_id=user.pk)
+        for conversation, pair in zip(conversations, zip(users[0::2], users[1::2]))
+        for user in pair
+    ], batch_size=500)
+
+    encoder = SessionStore()
+    expires = timezone.now() + timedelta(days=1)
+    sessions = []
+    virtual_users = []
+    for index, user in enumerate(users[:len(conversations) * 2]):
+        key = get_random_string(32)
+        sessions.append(Session(
+            session_key=key,
+            session_data=encoder.encode({
+                SESSION_KEY: str(user.pk),
+                BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+                HASH_SESSION_KEY: user.get_session_auth_hash(),
+            }),
+            expire_date=expires,
+        ))
+        virtual_users.append({
+            'user_id': user.pk,
+            'conversation_id': conversations[index // 2].pk,
+            'cookie': f'{settings.SESSION_COOKIE_NAME}={key}',
+        })
+    Session.objects.bulk_create(sessions, batch_size=500)
+    return virtual_users
+
+
+class InProcessClient:
+    """WebSocket client talking to the ASGI application inside this process"""
+
+    def __init__(self, application, path, cookie):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path, headers=[(b'cookie', cookie.encode())])
+
+    async def connect(self, timeout):
+        connected, _ = await self.communicator.connect(timeout=timeout)
+        return connected
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def recv(self, timeout):
+        # Read the queue directly: receive_from() cancels the application on timeout
+        while True:
+            message = await asyncio.wait_for(self.communicator.output_queue.get(), timeout)
+            if message['type'] == 'websocket.send':
+                return json.loads(message['text'])
+            if message['type'] == 'websocket.close':
+                raise ConnectionError('server closed the socket')
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class TcpClient:
+    """WebSocket client talking to a Daphne server over TCP"""
+
+    def __init__(self, url, cookie):
+        self.url = url
+        self.cookie = cookie
+        self.socket = None
+
+    async def connect(self, timeout):
+        import websockets
+        self.socket = await websockets.connect(
+            self.url,
+            additional_headers=[('Cookie', self.cookie)],
+            open_timeout=timeout,
+            max_queue=None,
+        )
+        return True
+
+    async def send(self, payload):
+        await self.socket.send(json.dumps(payload))
+
+    async def recv(self, timeout):
+        return json.loads(await asyncio.wait_for(self.socket.recv(), timeout))
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Stats:
+    """Send timestamps and delivery latencies shared by all virtual users"""
+
+    def __init__(self):
+        self.pending = {}
+        self.sent = {kind: 0 for kind in EVENT_KINDS}
+        self.latencies = {kind: [] for kind in EVENT_KINDS}
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.errors = []
+
+    def mark_sent(self, kind, key):
+        self.sent[kind] += 1
+        self.pending[(kind,) + key] = time.perf_counter()
+
+    def mark_delivered(self, kind, key):
+        started = self.pending.pop((kind,) + key, None)
+        if started is not None:
+            self.latencies[kind].append((time.perf_counter() - started) * 1000)
+
+
+class VirtualUser:
+    def __init__(self, spec, client, stats, multiplexed):
+        self.user_id = spec['user_id']
+        self.conversation_id = spec['conversation_id']
+        self.client = client
+        self.stats = stats
+        self.multiplexed = multiplexed
+        self.last_peer_message_id = None
+        self.sequence = 0
+        self.closed = False
+
+    async def connect(self, timeout):
+        if not await self.client.connect(timeout):
+            raise ConnectionError('websocket connection refused')
+        if self.multiplexed:
+            await self.client.send({'type': 'subscribe', 'conversation_id': self.conversation_id})
+            while True:
+                frame = await self.client.recv(timeout)
+                if frame.get('type') == 'subscribed':
+                    break
+                if frame.get('type') == 'error':
+                    raise ConnectionError(frame.get('error'))
+
+    async def send(self, payload):
+        self.stats.frames_sent += 1
+        await self.client.send(payload)
+
+    async def run(self, rounds, interval):
+        # Spread users over the first interval so they do not all fire at once
+        await asyncio.sleep(random.uniform(0, interval))
+        for _ in range(rounds):
+            self.sequence += 1
+            self.stats.mark_sent('typing', (self.conversation_id, self.user_id))
+            await self.send({'type': 'typing', 'is_typing': True})
+
+            temp_id = f'{self.user_id}-{self.sequence}'
+            self.stats.mark_sent('message', (temp_id,))
+            await self.send({'type': 'message', 'message': f'benchmark message {temp_id}', 'temp_id': temp_id})
+
+            if self.last_peer_message_id:
+                emoji = REACTION_EMOJIS[self.sequence % len(REACTION_EMOJIS)]
+                self.stats.mark_sent('reaction', (self.last_peer_message_id, self.user_id, emoji))
+                await self.send({
+                    'type': 'message_reaction',
+                    'message_id': self.last_peer_message_id,
+                    'emoji': emoji,
+                    'action': 'add',
+                })
+                self.stats.mark_sent('read', (self.user_id, self.last_peer_message_id))
+                await self.send({'type': 'message_read', 'message_id': self.last_peer_message_id})
+
+            await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+
+    async def read_forever(self):
+        while not self.closed:
+            try:
+                frame = await self.client.recv(1.0)
+            except asyncio.TimeoutError:
+                continue
+            except Exception as e:
+                if not self.closed:
+                    self.stats.errors.append(f'{type(e).__name__}: {e}')
+                return
+            self.stats.frames_received += 1
+            self.handle(frame)
+
+    def handle(self, frame):
+        frame_type = frame.get('type')
+        sender_id = frame.get('user_id')
+        if frame_type == 'message' and sender_id != self.user_id:
+            self.last_peer_message_id = frame.get('message_id')
+            self.stats.mark_delivered('message', (frame.get('temp_id'),))
+        elif frame_type == 'typing' and sender_id != self.user_id:
+            self.stats.mark_delivered('typing', (self.conversation_id, sender_id))
+        elif frame_type == 'reaction' and sender_id != self.user_id:
+            self.stats.mark_delivered('reaction', (frame.get('message_id'), sender_id, frame.get('emoji')))
+        elif frame_type == 'message_status' and frame.get('reader_id') != self.user_id:
+            self.stats.mark_delivered('read', (frame.get('reader_id'), frame.get('up_to_id')))
+        elif frame_type == 'error':
+            self.stats.errors.append(frame.get('error'))
+
+    async def close(self):
+        self.closed = True
+        try:
+            await self.client.close()
+        except Exception:
+            pass
+
+
+async def run_benchmark(args, specs, client_factory, server_pid=None, queries=None):
+    stats = Stats()
+    users = [VirtualUser(spec, client_factory(spec), stats, args.route == 'stream') for spec in specs]
+    report = {}
+
+    # Connection phase
+    rss_before = rss_kb(server_pid)
+    queries_before = queries.count if queries else None
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(user):
+        async with semaphore:
+            await user.connect(args.timeout)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(connect(user) for user in users), return_exceptions=True)
+    connect_seconds = time.perf_counter() - started
+    failed = [result for result in results if isinstance(result, Exception)]
+    connected = [user for user, result in zip(users, results) if not isinstance(result, Exception)]
+    for error in failed[:10]:
+        stats.errors.append(f'connect: {type(error).__name__}: {error}')
+    await asyncio.sleep(0.5)
+    rss_after = rss_kb(server_pid)
+
+    report['connect'] = {
+        'connections': len(connected),
+        'failed': len(failed),
+        'seconds': round(connect_seconds, 3),
+        'connections_per_sec': round(len(connected) / connect_seconds, 1) if connect_seconds else None,
+        'queries_per_connection': (
+            round((queries.count - queries_before) / len(connected), 2) if queries and connected else None
+        ),
+        'memory_per_connection_kb': (
+            round((rss_after - rss_before) / len(connected), 2)
+            if rss_before is not None and rss_after is not None and connected else None
+        ),
+        'memory_measured': 'server process' if server_pid else 'benchmark process (server and clients)',
+    }
+
+    # Load phase
+    readers = [asyncio.create_task(user.read_forever()) for user in connected]
+    queries_before = queries.count if queries else None
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run(args.rounds, args.interval) for user in connected))
+
+    # Wait for in-flight deliveries to drain
+    drain_deadline = time.perf_counter() + args.timeout
+    while stats.pending and time.perf_counter() < drain_deadline:
+        delivered = sum(len(values) for values in stats.latencies.values())
+        await asyncio.sleep(0.25)
+        if delivered == sum(len(values) for values in stats.latencies.values()) and not any(
+            kind == 'message' for kind, *_ in stats.pending
+        ):
+            break
+    load_seconds = time.perf_counter() - started
+    query_count = queries.count - queries_before if queries else None
+
+    for user in connected:
+        await user.close()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    report['load'] = {
+        'seconds': round(load_seconds, 3),
+        'frames_sent': stats.frames_sent,
+        'frames_received': stats.frames_received,
+        'frames_per_sec': round(stats.frames_sent / load_seconds, 1),
+        'messages_per_sec': round(len(stats.latencies['message']) / load_seconds, 1),
+        'queries_per_frame': round(query_count / stats.frames_sent, 2) if queries and stats.frames_sent else None,
+    }
+
+    latency = {}
+    for kind in EVENT_KINDS:
+        values = sorted(stats.latencies[kind])
+        latency[kind] = {
+            'sent': stats.sent[kind],
+            'delivered': len(values),
+            'p50': round(percentile(values, 50), 2) if values else None,
+            'p95': round(percentile(values, 95), 2) if values else None,
+            'p99': round(percentile(values, 99), 2) if values else None,
+            'max': round(values[-1], 2) if values else None,
+        }
+    report['latency_ms'] = latency
+    report['errors'] = stats.errors[:50]
+    report['error_count'] = len(stats.errors)
+    return report
+
+
+def run_inprocess(args, specs):
+    from chatproject.asgi import application
+
+    queries = QueryCounter()
+    queries.install()
+    path = '/ws/stream/' if args.route == 'stream' else None
+
+    def client_factory(spec):
+        return InProcessClient(application, path or f"/ws/chat/{spec['conversation_id']}/", spec['cookie'])
+
+    return asyncio.run(run_benchmark(args, specs, client_factory, queries=queries))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run_daphne(args, specs):
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        sys.exit('websockets is not installed. Run: pip install websockets')
+
+    port = args.port or free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'chatproject.asgi:application'],
+        cwd=BASE_DIR,
+        env=os.environ.copy(),
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    try:
+        if not wait_for_port('127.0.0.1', port, args.timeout):
+            sys.exit('Daphne did not start listening in time')
+        print(f'Daphne listening on 127.0.0.1:{port} (pid {server.pid})')
+
+        def client_factory(spec):
+            path = '/ws/stream/' if args.route == 'stream' else f"/ws/chat/{spec['conversation_id']}/"
+            return TcpClient(f'ws://127.0.0.1:{port}{path}', spec['cookie'])
+
+        return asyncio.run(run_benchmark(args, specs, client_factory, server_pid=server.pid))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Return human readable regressions of report against a baseline report"""
+    regressions = []
+    for kind, current in report['latency_ms'].items():
+        previous = baseline.get('latency_ms', {}).get(kind, {})
+        for key in ('p95', 'p99'):
+            if current.get(key) is not None and previous.get(key):
+                if current[key] > previous[key] * (1 + tolerance):
+                    regressions.append(f'{kind} {key} latency {previous[key]}ms -> {current[key]}ms')
+
+    checks = [
+        ('load', 'messages_per_sec', 'lower'),
+        ('load', 'queries_per_frame', 'higher'),
+        ('connect', 'queries_per_connection', 'higher'),
+        ('connect', 'memory_per_connection_kb', 'higher'),
+    ]
+    for section, key, worse in checks:
+        current = report.get(section, {}).get(key)
+        previous = baseline.get(section, {}).get(key)
+        if current is None or not previous:
+            continue
+        if worse == 'higher' and current > previous * (1 + tolerance):
+            regressions.append(f'{key} {previous} -> {current}')
+        elif worse == 'lower' and current < previous * (1 - tolerance):
+            regressions.append(f'{key} {previous} -> {current}')
+    return regressions
+
+
+def print_report(report):
+    connect = report['connect']
+    print(f"Connected {connect['connections']}/{report['users']} sockets in {connect['seconds']}s")
+    load = report['load']
+    print(f"Load: {load['frames_sent']} frames in {load['seconds']}s, "
+          f"{load['messages_per_sec']} messages/s, queries/frame: {load['queries_per_frame']}")
+    print(f"Memory per connection: {report['connect']['memory_per_connection_kb']} KiB, "
+          f"queries per connection: {report['connect']['queries_per_connection']}")
+    for kind, values in report['latency_ms'].items():
+        print(f"  {kind:<9} {values['delivered']}/{values['sent']} delivered  "
+              f"p50={values['p50']}ms p95={values['p95']}ms p99={values['p99']}ms")
+    if report['error_count']:
+        print(f"{report['error_count']} errors, first: {report['errors'][0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['inprocess', 'daphne'], default='inprocess')
+    parser.add_argument('--route', choices=['stream', 'chat'], default='stream',
+                        help='Multiplexed /ws/stream/ socket or the per-conversation /ws/chat/<id>/ socket')
+    parser.add_argument('--users', type=int, default=1000, help='Number of simulated users (rounded down to pairs)')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds of typing/message/reaction/read per user')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between a user\'s rounds')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='Sockets opened at the same time')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Connect and drain timeout in seconds')
+    parser.add_argument('--port', type=int, help='Daphne port (default: a free port)')
+    parser.add_argument('--output', help='Where to write the JSON report')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed regression against the baseline (0.2 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='Show consumer and server output')
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+
+    raise_file_limit()
+    scratch_dir = tempfile.mkdtemp(prefix='chat-benchmark-')
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'chatproject.settings',
+        'SQLITE_PATH': os.path.join(scratch_dir, 'benchmark.sqlite3'),
+    })
+    os.environ.setdefault('CHANNEL_LAYER', 'memory')
+
+    import django
+    django.setup()
+    from django.conf import settings
+
+    try:
+        print(f'Creating {args.users // 2 * 2} users...')
+        specs = setup_fixtures(args.users)
+
+        runner = run_inprocess if args.mode == 'inprocess' else run_daphne
+        # Consumers print on every error; keep the benchmark output readable
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            report = runner(args, specs)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'ws_benchmark',
+        'mode': args.mode,
+        'route': args.route,
+        'channel_layer': settings.CHANNEL_LAYER,
+        'users': len(specs),
+        'rounds': args.rounds,
+        'interval': args.interval,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        **report,
+    }
+    print_report(report)
+
+    output = args.output or f"ws-benchmark-{args.mode}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f'Report written to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare_with_baseline(report, json.load(handle), args.tolerance)
+        if regressions:
+            print('Regressions against baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('No regressions against baseline')
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())